@@ -0,0 +1,214 @@
+'''
+Banco de pruebas de rendimiento de las etapas de 'galaxy_polarization_functions04' con catálogos sintéticos.
+
+Uso:
+    python galaxy_polarization_benchmark.py --sizes 1000 100000 1000000 --output benchmark.json
+    python galaxy_polarization_benchmark.py --sizes 1000 100000 --baseline benchmark.json --tolerance 0.25
+
+Cada etapa se cronometra (mejor de 'repeat' ejecuciones) y, opcionalmente, se mide su pico de memoria con 'tracemalloc'.
+Los resultados se graban en 'json' y se pueden comparar con los de una ejecución anterior para detectar regresiones.
+'''
+import matplotlib
+matplotlib.use('Agg') # Sin ventanas: los gráficos se dibujan pero no se muestran
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+import galaxy_polarization_functions04 as gp
+
+def synthetic_catalog(rows:int,seed:int=0,number_of_clusters:int=30):
+    '''
+    Crea un catálogo sintético con las seis columnas normalizadas de 'read_catalog'.
+    Los puntos se concentran en el plano galáctico (latitud con distribución de Laplace), con un 25% de puntos en
+    grupos compactos de ángulo coherente (como los 'clusters' buscados) y un 10% repartido uniformemente por la esfera.
+    La polarización sigue una distribución log-normal, su error es proporcional a ella y el error del ángulo es el
+    habitual 28.65·e_Pol/Pol (º). Un 2% de los puntos tienen errores nulos, como ocurre en el catálogo de Heiles.
+
+    Parametros:
+    -----------
+    rows: Número de puntos.
+    seed: Semilla del generador de números aleatorios.
+    number_of_clusters: Número de grupos compactos.
+
+    Retorno:
+    --------
+    DataFrame con las columnas 'longitude','latitude','polarization','angle','polarization_error','angle_error'.
+    '''
+    generator=np.random.default_rng(seed)
+    longitude=generator.uniform(-180,180,rows)
+    latitude=np.clip(generator.laplace(0,8,rows),-90,90) # Plano galáctico
+    angle=np.mod(generator.normal(90,40,rows),180)
+    halo=generator.random(rows)<0.10 # Puntos repartidos por toda la esfera
+    longitude[halo]=generator.uniform(-180,180,halo.sum())
+    latitude[halo]=np.degrees(np.arcsin(generator.uniform(-1,1,halo.sum())))
+    grouped=(~halo)&(generator.random(rows)<0.25/0.90) # Puntos en grupos compactos
+    group=generator.integers(0,number_of_clusters,grouped.sum())
+    center_lon=generator.uniform(-180,180,number_of_clusters)
+    center_lat=np.clip(generator.laplace(0,10,number_of_clusters),-80,80)
+    center_ang=generator.uniform(0,180,number_of_clusters)
+    size=generator.uniform(1,5,number_of_clusters)
+    longitude[grouped]=np.mod(center_lon[group]+generator.normal(0,1,grouped.sum())*size[group]+180,360)-180
+    latitude[grouped]=np.clip(center_lat[group]+generator.normal(0,1,grouped.sum())*size[group],-90,90)
+    angle[grouped]=np.mod(center_ang[group]+generator.normal(0,8,grouped.sum()),180)
+    polarization=generator.lognormal(-0.3,0.8,rows)
+    polarization_error=polarization*generator.uniform(0.03,0.5,rows)
+    angle_error=np.minimum(28.65*polarization_error/polarization,90)
+    null_error=generator.random(rows)<0.02
+    polarization_error[null_error]=0
+    angle_error[null_error]=0
+    return pd.DataFrame({'longitude':longitude,'latitude':latitude,'polarization':polarization,'angle':angle,
+                         'polarization_error':polarization_error,'angle_error':angle_error})
+
+def measure(function,*args,repeat:int=1,memory:bool=True,**kwargs):
+    '''
+    Ejecuta 'function(*args,**kwargs)' y mide su tiempo y su pico de memoria.
+    El tiempo es el mejor de 'repeat' ejecuciones sin 'tracemalloc'; la memoria se mide en una ejecución aparte, ya que 'tracemalloc' ralentiza el cálculo.
+
+    Retorno:
+    --------
+    result: Resultado de la función.
+    seconds: Tiempo (s).
+    peak_mb: Pico de memoria reservada durante la ejecución (MB), o 'None' si 'memory' es 'False'.
+    '''
+    seconds=np.inf
+    for _ in range(repeat):
+        start=time.perf_counter()
+        result=function(*args,**kwargs)
+        seconds=min(seconds,time.perf_counter()-start)
+        plt.close('all')
+    peak_mb=None
+    if memory:
+        tracemalloc.start()
+        function(*args,**kwargs)
+        peak_mb=tracemalloc.get_traced_memory()[1]/2**20
+        tracemalloc.stop()
+        plt.close('all')
+    return result,seconds,peak_mb
+
+def zone_path(polarization_data:pd.DataFrame,zone_size:float=3,sigma_limit:float=3):
+    '''
+    Camino completo por zonas del programa principal (sin lectura ni gráfico).
+    '''
+    polarization_data=gp.values_cutout(gp.space_cutout(polarization_data,-180,180,-90,90),0.1,45)
+    polarization_data=gp.add_coords_of_zone_center(polarization_data,zone_size)
+    return gp.statistics_per_zone(polarization_data,sigma_limit)
+
+def cluster_path(polarization_data:pd.DataFrame,max_separation:float=4,min_num_points:int=20):
+    '''
+    Camino completo por clusters del programa principal (sin lectura ni gráfico).
+    '''
+    polarization_data=gp.values_cutout(gp.space_cutout(polarization_data,-180,180,-90,90),0.25,30)
+    catalog_with_clusters=gp.cluster_catalog_creator(polarization_data,max_separation,min_num_points)
+    summary,order=gp.cluster_summary(catalog_with_clusters)
+    return gp.clusters_center(catalog_with_clusters,summary=summary)
+
+def run_benchmarks(sizes,seed:int=0,repeat:int=1,memory:bool=True,plots:bool=True,max_cluster_rows:int=1000000):
+    '''
+    Mide todas las etapas para cada tamaño de catálogo.
+
+    Parametros:
+    -----------
+    sizes: Lista de números de puntos de los catálogos sintéticos.
+    seed: Semilla de los catálogos.
+    repeat: Número de ejecuciones de cada etapa (se guarda el mejor tiempo).
+    memory: Si es 'True' se mide también el pico de memoria de cada etapa.
+    plots: Si es 'True' se miden también los gráficos (con el 'backend' Agg, sin grabar imágenes).
+    max_cluster_rows: Las etapas de 'clusters' (DBSCAN) solo se miden hasta este número de puntos.
+
+    Retorno:
+    --------
+    Diccionario con la descripción del equipo ('environment') y una lista de resultados ('results'),
+    uno por etapa y tamaño con 'stage', 'rows', 'seconds' y 'peak_mb'.
+    '''
+    results=[]
+    def record(stage,rows,function,*args,**kwargs):
+        result,seconds,peak_mb=measure(function,*args,repeat=repeat,memory=memory,**kwargs)
+        results.append({'stage':stage,'rows':rows,'seconds':seconds,'peak_mb':peak_mb})
+        print(f'{stage:<28}{rows:>10}{seconds:>12.4f} s'+('' if peak_mb is None else f'{peak_mb:>12.1f} MB'))
+        return result
+    for rows in sizes:
+        catalog=synthetic_catalog(rows,seed)
+        selected=record('space_cutout',rows,gp.space_cutout,catalog,-180,180,-90,90)
+        selected=record('values_cutout',rows,gp.values_cutout,selected,0.1,45)
+        zoned=record('add_coords_of_zone_center',rows,gp.add_coords_of_zone_center,selected.copy(),3)
+        zones=record('statistics_per_zone',rows,gp.statistics_per_zone,zoned,3)
+        record('zone_path',rows,zone_path,catalog)
+        if plots:
+            record('cartesian_plot_by_zones',rows,gp.cartesian_plot_by_zones,zones,3,False)
+            record('mollweide_plot_by_zones',rows,gp.mollweide_plot_by_zones,zones,3,False)
+        if rows<=max_cluster_rows:
+            selected=gp.values_cutout(catalog,0.25,30)
+            catalog_with_clusters=record('cluster_catalog_creator',rows,gp.cluster_catalog_creator,selected,4,20)
+            summary,order=record('cluster_summary',rows,gp.cluster_summary,catalog_with_clusters)
+            clusters_catalog=record('clusters_center',rows,gp.clusters_center,catalog_with_clusters,summary=summary)
+            record('cluster_path',rows,cluster_path,catalog)
+            if plots:
+                record('cartesian_plot_3D_clusters',rows,gp.cartesian_plot_3D_clusters,catalog_with_clusters,clusters_catalog,True,summary=summary)
+    environment={'python':platform.python_version(),'numpy':np.__version__,'pandas':pd.__version__,'machine':platform.machine(),
+                 'processor':platform.processor(),'system':platform.system(),'seed':seed,'repeat':repeat,'date':time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'environment':environment,'results':results}
+
+def compare_results(current:dict,baseline:dict,tolerance:float=0.2):
+    '''
+    Compara dos ejecuciones de 'run_benchmarks'.
+
+    Parametros:
+    -----------
+    current, baseline: Resultados de la ejecución actual y de la de referencia.
+    tolerance: Aumento relativo de tiempo o de memoria a partir del cual se considera que hay una regresión (0.2 = 20%).
+
+    Retorno:
+    --------
+    Lista de regresiones: diccionarios con 'stage', 'rows', 'metric', 'baseline', 'current' y 'ratio'.
+    '''
+    reference={(result['stage'],result['rows']):result for result in baseline['results']}
+    regressions=[]
+    for result in current['results']:
+        previous=reference.get((result['stage'],result['rows']))
+        if previous is None:
+            continue
+        for metric in ('seconds','peak_mb'):
+            if result[metric] is None or previous[metric] is None or previous[metric]<=0:
+                continue
+            ratio=result[metric]/previous[metric]
+            if ratio>1+tolerance:
+                regressions.append({'stage':result['stage'],'rows':result['rows'],'metric':metric,
+                                    'baseline':previous[metric],'current':result[metric],'ratio':ratio})
+    return regressions
+
+def check_baseline(current:dict,baseline_file:str,tolerance:float=0.2):
+    '''
+    Compara 'current' con la ejecución grabada en 'baseline_file' (ver 'compare_results') e imprime cada regresión.
+
+    Retorno:
+    --------
+    Código de salida del programa: 1 si hay alguna regresión y 0 si no.
+    '''
+    with open(baseline_file) as file:
+        regressions=compare_results(current,json.load(file),tolerance)
+    for regression in regressions:
+        print(f"REGRESIÓN {regression['stage']} ({regression['rows']} puntos) {regression['metric']}: {regression['baseline']:.4g} -> {regression['current']:.4g} (x{regression['ratio']:.2f})")
+    return 1 if regressions else 0
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description='Banco de pruebas de rendimiento con catálogos sintéticos')
+    parser.add_argument('--sizes',type=int,nargs='+',default=[1000,10000,100000,1000000],help='Números de puntos de los catálogos (de 1e3 a 1e7)')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--repeat',type=int,default=1,help='Ejecuciones de cada etapa (se guarda el mejor tiempo)')
+    parser.add_argument('--no-memory',action='store_true',help='No medir el pico de memoria')
+    parser.add_argument('--no-plots',action='store_true',help='No medir los gráficos')
+    parser.add_argument('--max-cluster-rows',type=int,default=1000000,help='Tamaño máximo para las etapas de clusters')
+    parser.add_argument('--output',default='benchmark.json',help='Fichero json de resultados')
+    parser.add_argument('--baseline',help='Fichero json de una ejecución anterior con el que comparar')
+    parser.add_argument('--tolerance',type=float,default=0.2,help='Aumento relativo considerado regresión')
+    arguments=parser.parse_args()
+    benchmark=run_benchmarks(arguments.sizes,arguments.seed,arguments.repeat,not arguments.no_memory,not arguments.no_plots,arguments.max_cluster_rows)
+    with open(arguments.output,'w') as file:
+        json.dump(benchmark,file,indent=2)
+    print(f'Resultados grabados en {arguments.output}')
+    if arguments.baseline:
+        raise SystemExit(check_baseline(benchmark,arguments.baseline,arguments.tolerance))
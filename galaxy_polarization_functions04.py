@@ -4,12 +4,259 @@ import pandas as pd # Proporciona estructuras de datos y herramientas para su an
 import matplotlib.pyplot as plt # Permite trazar gráficos y figuras en pantalla y guardarlas en un fichero de imagen.
 import matplotlib as mtp # Gradaciones de color en gráficos.
 import matplotlib.colors as colors # Colores en hexadecimal.
+from matplotlib.collections import LineCollection,PolyCollection # Todas las barras de dirección (y todos los perímetros) en un solo artista
+from matplotlib.patches import Ellipse # Contorno del cielo en proyección Mollweide
+from matplotlib.figure import Figure # Figuras independientes de 'pyplot' (teselas)
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import time # En el desarrollo del programa permite evaluar el tiempo usado en diferentes etapas
+import os # Gestión de ficheros y directorios (caché local del catálogo)
+import json # Metadatos de los ficheros de la caché
+import hashlib # Claves de la caché a partir del contenido de los parámetros
+import shutil # Borrado de entradas de la caché
+import io # Teselas en memoria antes de grabarlas
+import http.server # Servidor local de teselas
+import functools # Parámetros fijos del manejador del servidor de teselas
+import threading # Servidor de teselas en segundo plano
+import argparse # Modo por lotes del programa principal
+import sys
+import tracemalloc # Pico de memoria de cada etapa (ver 'set_instrumentation')
+try:
+    import resource # Máximo de memoria residente del proceso (no existe en Windows)
+except ImportError:
+    resource=None
+import atexit # Espera a que terminen las grabaciones en segundo plano al salir del programa
+from concurrent.futures import ThreadPoolExecutor,ProcessPoolExecutor # Grabación de ficheros en segundo plano y cálculo en paralelo
+from multiprocessing import shared_memory # Catálogo compartido entre procesos sin copiarlo
+import warnings # Avisos cuando falta una dependencia opcional
+try:
+    import numba # Compilación JIT opcional del cálculo por zonas (ver 'set_kernel_backend')
+except ImportError:
+    numba=None
 from sklearn.cluster import DBSCAN # Búsqueda de 'clusters' 
-from scipy.spatial import ConvexHull # Contorno de los clusters hallados
+from sklearn.neighbors import NearestNeighbors # Grafo de vecinos reutilizable entre búsquedas de 'clusters'
+from scipy import sparse # Grabación y lectura del grafo de vecinos
+from scipy.spatial import ConvexHull,Delaunay,QhullError # Contorno de los clusters hallados
+from scipy.spatial import cKDTree # Índice espacial del catálogo
+PROGRAM_START=time.perf_counter()
+INSTRUMENTATION_OPTIONS={'enabled':True,'trace_memory':False} # Registro de las etapas (ver 'set_instrumentation')
+run_report=[] # Un registro por ejecución de cada etapa (ver 'instrumented_stage')
+profiling_hooks=[] # Funciones llamadas al empezar y al terminar cada etapa (ver 'add_profiling_hook')
+stage_stack=threading.local() # Etapas en curso en cada hilo (para las etapas anidadas)
+
+def set_instrumentation(enabled:bool=True,trace_memory:bool=False):
+    '''
+    Establece qué se registra de cada etapa.
+
+    Parametros:
+    -----------
+    enabled: Si es 'False' las etapas no se registran.
+    trace_memory: Si es 'True' se mide el pico de memoria de cada etapa con 'tracemalloc' (ralentiza el cálculo).
+    '''
+    INSTRUMENTATION_OPTIONS['enabled']=enabled
+    INSTRUMENTATION_OPTIONS['trace_memory']=trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def add_profiling_hook(hook):
+    '''
+    Añade una función 'hook(event,record)' que se llama con 'event' igual a 'start' al empezar cada etapa y 'end' al terminar.
+    'record' es el registro de la etapa (ver 'instrumented_stage'). Por ejemplo, para activar 'cProfile' solo en una etapa.
+    '''
+    profiling_hooks.append(hook)
+
+def remove_profiling_hook(hook):
+    profiling_hooks.remove(hook)
+
+def table_rows(value):
+    '''
+    Número de filas de un DataFrame (o del primer DataFrame de una tupla). 'None' si no hay ninguno.
+    '''
+    if isinstance(value,tuple):
+        value=next((item for item in value if isinstance(item,pd.DataFrame)),None)
+    return len(value) if isinstance(value,pd.DataFrame) else None
+
+class instrumented_stage:
+    '''
+    Contexto que registra en 'run_report' el tiempo real y de CPU, el pico de memoria y las filas de entrada y salida de una etapa:
+
+        with instrumented_stage('lectura',rows_in=len(df)) as record:
+            ...
+            record['rows_out']=len(result)
+
+    Campos del registro: 'stage', 'depth' (nivel de anidamiento), 'start' (s desde el inicio del programa), 'wall_s', 'cpu_s',
+    'peak_mb' (solo con 'trace_memory', memoria reservada por encima de la del inicio de la etapa), 'max_rss_mb' (máximo de memoria
+    residente del proceso hasta el final de la etapa, si el sistema lo proporciona), 'rows_in' y 'rows_out'.
+    '''
+    def __init__(self,name:str,rows_in:int=None):
+        self.record={'stage':name,'rows_in':rows_in,'rows_out':None}
+
+    def __enter__(self):
+        if not INSTRUMENTATION_OPTIONS['enabled']:
+            return self.record
+        stack=stage_stack.__dict__.setdefault('stages',[])
+        self.record['depth']=len(stack)
+        self.child_peak=0
+        if tracemalloc.is_tracing():
+            current,peak=tracemalloc.get_traced_memory()
+            if stack: # 'reset_peak' borra el pico que la etapa exterior haya alcanzado hasta ahora
+                stack[-1].child_peak=max(stack[-1].child_peak,peak)
+            self.memory_start=current
+            tracemalloc.reset_peak()
+        stack.append(self)
+        for hook in profiling_hooks:
+            hook('start',self.record)
+        self.record['start']=time.perf_counter()-PROGRAM_START
+        self.wall_start=time.perf_counter()
+        self.cpu_start=time.process_time()
+        return self.record
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if not INSTRUMENTATION_OPTIONS['enabled'] or 'depth' not in self.record:
+            return False
+        self.record['wall_s']=time.perf_counter()-self.wall_start
+        self.record['cpu_s']=time.process_time()-self.cpu_start
+        self.record['peak_mb']=None
+        stack=stage_stack.stages
+        stack.pop()
+        if tracemalloc.is_tracing() and hasattr(self,'memory_start'):
+            peak=max(tracemalloc.get_traced_memory()[1],self.child_peak) # 'reset_peak' de las etapas anidadas borra el pico anterior
+            self.record['peak_mb']=(peak-self.memory_start)/2**20
+            if stack:
+                stack[-1].child_peak=max(stack[-1].child_peak,peak)
+        self.record['max_rss_mb']=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/2**10 if resource is not None else None # 'ru_maxrss' en kB (Linux)
+        if exc_type is not None:
+            self.record['error']=exc_type.__name__
+        run_report.append(self.record)
+        for hook in profiling_hooks:
+            hook('end',self.record)
+        return False
+
+def instrumented(function):
+    '''
+    Decorador que registra cada llamada a 'function' como una etapa con su nombre (ver 'instrumented_stage').
+    Las filas de entrada son las del primer DataFrame de los parámetros y las de salida las del DataFrame devuelto.
+    '''
+    @functools.wraps(function)
+    def wrapper(*args,**kwargs):
+        if not INSTRUMENTATION_OPTIONS['enabled']:
+            return function(*args,**kwargs)
+        rows_in=next((len(arg) for arg in args if isinstance(arg,pd.DataFrame)),None)
+        with instrumented_stage(function.__name__,rows_in) as record:
+            result=function(*args,**kwargs)
+            record['rows_out']=table_rows(result)
+        return result
+    return wrapper
+
+def reset_run_report():
+    run_report.clear()
+
+def write_run_report(file_name:str=None):
+    '''
+    Informe de la ejecución: un DataFrame con un registro por etapa (ver 'instrumented_stage').
+
+    Parametros:
+    -----------
+    file_name: Si se indica, el informe se graba en formato 'json' si el nombre termina en '.json' y en 'csv' (separado por ';') si no.
+
+    Retorno:
+    --------
+    DataFrame del informe.
+    '''
+    report=pd.DataFrame(run_report,columns=['stage','depth','start','wall_s','cpu_s','peak_mb','max_rss_mb','rows_in','rows_out'])
+    report[['rows_in','rows_out']]=report[['rows_in','rows_out']].astype('Int64')
+    if file_name is not None:
+        if file_name.endswith('.json'):
+            with open(file_name,'w') as file:
+                json.dump(run_report,file,indent=1,default=str)
+        else:
+            report.to_csv(file_name,sep=';',index=False)
+    return report
+
+TABLE_FORMATS={'csv':'.csv','parquet':'.parquet','feather':'.feather','npz':'.npz'} # Formatos de fichero para las tablas intermedias y su extensión
+OUTPUT_OPTIONS={'format':'csv','background':False} # Formato y modo de grabación usados por 'csv_creator' (ver 'set_output_backend')
+pending_writes=[] # Grabaciones en segundo plano pendientes de terminar
+write_executor=None
+
+def set_output_backend(file_format:str='csv',background:bool=False):
+    '''
+    Establece cómo graban 'csv_creator' y todas las etapas las tablas intermedias.
+
+    Parametros:
+    -----------
+    file_format: Uno de los formatos de 'TABLE_FORMATS'. 'csv' es el formato de texto de siempre (separado por ';'); 'parquet' y 'feather' necesitan 'pyarrow'; 'npz' solo necesita 'numpy'.
+    background: Si es 'True' las tablas se graban en un hilo aparte y el cálculo continúa sin esperar a que termine la escritura. 'wait_for_writes' espera a que terminen.
+    '''
+    if file_format not in TABLE_FORMATS:
+        raise ValueError(f"Formato '{file_format}' desconocido. Formatos disponibles: {list(TABLE_FORMATS)}")
+    wait_for_writes()
+    OUTPUT_OPTIONS['format']=file_format
+    OUTPUT_OPTIONS['background']=background
+
+def wait_for_writes():
+    '''
+    Espera a que terminen todas las grabaciones en segundo plano. Si alguna ha fallado se reproduce aquí su excepción.
+    '''
+    while pending_writes:
+        pending_writes.pop(0).result()
+
+atexit.register(wait_for_writes)
+
+def table_file_name(file_name:str,file_format:str):
+    '''
+    Sustituye (o añade) la extensión de 'file_name' por la del formato 'file_format'.
+    '''
+    root,extension=os.path.splitext(file_name)
+    if extension not in TABLE_FORMATS.values():
+        root=file_name
+    return root+TABLE_FORMATS[file_format]
+
+@instrumented
+def table_writer(dataframe:pd.DataFrame,file_name:str,file_format:str=None):
+    '''
+    Graba el DataFrame en el formato indicado (por defecto el deducido de la extensión de 'file_name').
+
+    Retorno:
+    --------
+    Nombre del fichero grabado.
+    '''
+    if file_format is None:
+        file_format=next((name for name,extension in TABLE_FORMATS.items() if file_name.endswith(extension)),'csv')
+    file_name=table_file_name(file_name,file_format)
+    if file_format=='csv':
+        dataframe.to_csv(file_name,sep=";")
+    elif file_format=='parquet':
+        dataframe.to_parquet(file_name)
+    elif file_format=='feather':
+        dataframe.reset_index(drop=True).to_feather(file_name) # 'feather' no admite índices distintos del índice por defecto
+    else:
+        columns={'column%d'%n:dataframe[name].to_numpy() for n,name in enumerate(dataframe.columns)} # Los nombres de columna pueden no ser nombres válidos dentro de un 'npz'
+        np.savez(file_name,column_names=np.array([str(name) for name in dataframe.columns]),**columns)
+    return file_name
+
+def table_reader(file_name:str):
+    '''
+    Lee una tabla grabada por 'csv_creator' o 'table_writer' en cualquiera de los formatos de 'TABLE_FORMATS'.
+    Permite reanudar el cálculo desde el fichero intermedio de cualquier etapa.
+
+    Retorno:
+    --------
+    DataFrame de 'pandas' con las mismas columnas que el grabado.
+    '''
+    if file_name.endswith('.parquet'):
+        return pd.read_parquet(file_name)
+    if file_name.endswith('.feather'):
+        return pd.read_feather(file_name)
+    if file_name.endswith('.npz'):
+        with np.load(file_name) as npz_file:
+            return pd.DataFrame({str(name):npz_file['column%d'%n] for n,name in enumerate(npz_file['column_names'])})
+    return pd.read_csv(file_name,sep=";",index_col=0)
+
 def csv_creator(dataframe:pd.DataFrame,csv_file:str):
     '''
     Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
+    Si con 'set_output_backend' se ha elegido otro formato, se graba en este formato cambiando la extensión del fichero.
 
     Parametros:
     -----------
@@ -20,11 +267,18 @@ def csv_creator(dataframe:pd.DataFrame,csv_file:str):
     --------
     No retorna ningun valor. Solo graba en un fichero 'csv' el Dataframe.
     '''
+    global write_executor
     if csv_file!=None:
-        if csv_file[-4:]!=".csv":
+        if OUTPUT_OPTIONS['format']=='csv' and csv_file[-4:]!=".csv":
             csv_file+=".csv"
-        dataframe.to_csv(csv_file,sep=";")
+        if OUTPUT_OPTIONS['background']:
+            if write_executor is None:
+                write_executor=ThreadPoolExecutor(max_workers=1) # Un solo hilo: los ficheros se graban en el orden en que se piden
+            pending_writes.append(write_executor.submit(table_writer,dataframe.copy(),csv_file,OUTPUT_OPTIONS['format'])) # Copia: algunas etapas modifican después el DataFrame grabado
+        else:
+            table_writer(dataframe,csv_file,OUTPUT_OPTIONS['format'])
 
+@instrumented
 def jpg_creator(image_file:chr=None,dots_per_inch:int=1200):
     '''
     Si 'image_file' contiene un nombre, se graba un fichero imagen '.jpg' con este nombre.
@@ -49,13 +303,13 @@ def deg_to_rad(degrees):
 
     Parametros:
     -----------
-    degrees: Grados sexagesimales
+    degrees: Grados sexagesimales (un valor, un array de 'numpy' o una columna de 'pandas')
     
     Retorno:
     --------
     Grados en radianes redondeados a 5 decimales.
     '''
-    return round(degrees*np.pi/180,5)
+    return np.round(degrees*np.pi/180,5)
 
 def weighted_average(values, tolerances):
     '''
@@ -120,6 +374,222 @@ def outliers_by_sigma(polxzone:list,pol_errxzone:list,angxzone:list,ang_errxzone
         ang_errxzone_acum=ang_errxzone
     return polxzone_acum,pol_errxzone_acum,angxzone_acum,ang_errxzone_acum
 
+def zone_boundaries(*zone_keys):
+    '''
+    Parametros
+    ----------
+    zone_keys: Uno o varios arrays (por ejemplo 'zone_lon' y 'zone_lat') que identifican la zona de cada fila. Las filas de una misma zona deben ser consecutivas.
+
+    Retorno
+    -------
+    Array con la posición de la primera fila de cada zona. Se empieza una nueva zona cada vez que cambia alguno de los valores respecto a la fila anterior.
+    '''
+    rows_number=len(zone_keys[0])
+    if rows_number==0:
+        return np.zeros(0,dtype=np.int64)
+    change=np.zeros(rows_number-1,dtype=bool)
+    for key in zone_keys:
+        key=np.asarray(key)
+        change|=key[1:]!=key[:-1] # Igual que en la comparación fila a fila, un 'NaN' siempre inicia una zona nueva.
+    return np.concatenate(([0],np.flatnonzero(change)+1)).astype(np.int64)
+
+def segment_ids(starts,rows_number:int):
+    '''
+    Devuelve para cada fila el número de zona (segmento) al que pertenece a partir de las posiciones de inicio 'starts'.
+    '''
+    return np.repeat(np.arange(len(starts)),np.diff(np.append(starts,rows_number)))
+
+def segmented_weighted_average(values,tolerances,starts,keep=None):
+    '''
+    Versión por segmentos de 'weighted_average': calcula de una vez la media ponderada de todas las zonas.
+
+    Parametros
+    ----------
+    values: Array de valores de todas las zonas, con las filas de cada zona consecutivas.
+    tolerances: Array de tolerancias del array de valores.
+    starts: Posición de la primera fila de cada zona (ver 'zone_boundaries').
+    keep: Array booleano opcional. Solo se tienen en cuenta las filas con valor 'True'.
+
+    Retorno
+    -------
+    Array con la media ponderada de cada zona. Igual que en 'weighted_average', las tolerancias inferiores o iguales a 0 se igualan al máximo error de la zona (0.01 si este no es positivo).
+    '''
+    values=np.asarray(values,dtype=float)
+    tolerances=np.asarray(tolerances,dtype=float)
+    if keep is None:
+        keep=np.ones(len(values),dtype=bool)
+    max_tolerance=np.maximum.reduceat(np.where(keep,tolerances,-np.inf),starts) # Máximo de las tolerancias de los puntos que se tienen en cuenta en cada zona
+    replacement=np.maximum(max_tolerance,0.01)[segment_ids(starts,len(values))]
+    tolerances=np.where(tolerances<=0.0,replacement,tolerances)
+    inv_tol=np.where(keep,np.reciprocal(tolerances),0.0)
+    return np.add.reduceat(inv_tol*values,starts)/np.add.reduceat(inv_tol,starts)
+
+def segmented_outliers_by_sigma(angles,angle_errors,starts,sigma_limit:float):
+    '''
+    Versión por segmentos de 'outliers_by_sigma'.
+
+    Parametros
+    ----------
+    angles: Array de ángulos de polarización de todas las zonas, con las filas de cada zona consecutivas.
+    angle_errors: Array de errores de medida esperados en los ángulos.
+    starts: Posición de la primera fila de cada zona (ver 'zone_boundaries').
+    sigma_limit: Número de sigmas a partir del cual queremos despreciar los puntos.
+
+    Retorno
+    -------
+    Array booleano con 'True' en los puntos que están dentro del número de sigmas establecido en su zona.
+    Si en una zona la desviación estándar es cero, o no queda ningún punto, se conservan todos los puntos de la zona.
+    '''
+    angles=np.asarray(angles,dtype=float)
+    rows_number=len(angles)
+    ids=segment_ids(starts,rows_number)
+    points=np.diff(np.append(starts,rows_number))
+    angle_average=segmented_weighted_average(angles,angle_errors,starts)
+    angle_mean=np.add.reduceat(angles,starts)/points
+    angle_sigma=np.sqrt(np.add.reduceat((angles-angle_mean[ids])**2,starts)/points) # Desviación estándar (poblacional, como 'np.std') de cada zona
+    angle_min=(angle_average-angle_sigma*sigma_limit)[ids]
+    angle_max=(angle_average+angle_sigma*sigma_limit)[ids]
+    keep=(angles>=angle_min)&(angles<=angle_max)
+    keep|=(angle_sigma==0)[ids]
+    keep|=(np.add.reduceat(keep.astype(np.int64),starts)==0)[ids] # En caso de que no haya quedado ningún punto en la zona, los devolvemos todos
+    return keep
+
+def fused_zone_statistics(polarization,polarization_error,angle,angle_error,starts,sigma_limit,zone_pol,zone_ang,points_after):
+    '''
+    Núcleo de cálculo por zonas con todas las operaciones de 'outliers_by_sigma' y 'weighted_average' fusionadas en bucles sobre
+    los arrays contiguos, sin crear arrays temporales. Se compila con 'numba' cuando se elige el motor 'numba' (ver 'set_kernel_backend').
+    Sin compilar da el mismo resultado pero es muy lento.
+
+    Parametros:
+    -----------
+    polarization,polarization_error,angle,angle_error: Arrays 'float64' de todas las zonas, con las filas de cada zona consecutivas.
+    starts: Posición de la primera fila de cada zona (ver 'zone_boundaries').
+    sigma_limit: Número de sigmas a partir del cual queremos despreciar los puntos.
+    zone_pol,zone_ang,points_after: Arrays de salida (uno por zona) que se rellenan con las medias ponderadas y los puntos que quedan tras la selección por sigmas.
+    '''
+    rows_number=len(angle)
+    for zone in range(len(starts)):
+        start=starts[zone]
+        stop=starts[zone+1] if zone+1<len(starts) else rows_number
+        points=stop-start
+        # Media ponderada del ángulo con todos los puntos (tolerancias <=0 sustituidas por la máxima de la zona)
+        max_tolerance=angle_error[start]
+        for n in range(start+1,stop):
+            max_tolerance=max(max_tolerance,angle_error[n])
+        replacement=max(max_tolerance,0.01)
+        sum_weights=0.0
+        sum_values=0.0
+        sum_angles=0.0
+        for n in range(start,stop):
+            weight=1.0/(angle_error[n] if angle_error[n]>0.0 else replacement)
+            sum_weights+=weight
+            sum_values+=weight*angle[n]
+            sum_angles+=angle[n]
+        angle_average=sum_values/sum_weights
+        # Desviación estándar poblacional
+        angle_mean=sum_angles/points
+        sum_squares=0.0
+        for n in range(start,stop):
+            sum_squares+=(angle[n]-angle_mean)**2
+        angle_sigma=np.sqrt(sum_squares/points)
+        angle_min=angle_average-angle_sigma*sigma_limit
+        angle_max=angle_average+angle_sigma*sigma_limit
+        keep_all=angle_sigma==0
+        kept=0
+        if not keep_all:
+            for n in range(start,stop):
+                if angle[n]>=angle_min and angle[n]<=angle_max:
+                    kept+=1
+            if kept==0: # En caso de que no haya quedado ningún punto, los tomamos todos
+                keep_all=True
+        if keep_all:
+            kept=points
+        # Máximas tolerancias de los puntos seleccionados
+        max_pol_tolerance=-np.inf
+        max_ang_tolerance=-np.inf
+        for n in range(start,stop):
+            if keep_all or (angle[n]>=angle_min and angle[n]<=angle_max):
+                max_pol_tolerance=max(max_pol_tolerance,polarization_error[n])
+                max_ang_tolerance=max(max_ang_tolerance,angle_error[n])
+        pol_replacement=max(max_pol_tolerance,0.01)
+        ang_replacement=max(max_ang_tolerance,0.01)
+        # Medias ponderadas de los puntos seleccionados
+        sum_pol_weights=0.0
+        sum_pol=0.0
+        sum_ang_weights=0.0
+        sum_ang=0.0
+        for n in range(start,stop):
+            if keep_all or (angle[n]>=angle_min and angle[n]<=angle_max):
+                weight=1.0/(polarization_error[n] if polarization_error[n]>0.0 else pol_replacement)
+                sum_pol_weights+=weight
+                sum_pol+=weight*polarization[n]
+                weight=1.0/(angle_error[n] if angle_error[n]>0.0 else ang_replacement)
+                sum_ang_weights+=weight
+                sum_ang+=weight*angle[n]
+        zone_pol[zone]=sum_pol/sum_pol_weights
+        zone_ang[zone]=sum_ang/sum_ang_weights
+        points_after[zone]=kept
+
+def numpy_zone_kernel(polarization,polarization_error,angle,angle_error,starts,sigma_limit:float):
+    '''
+    Motor 'numpy' del cálculo por zonas: reducciones por segmentos (ver 'segmented_outliers_by_sigma' y 'segmented_weighted_average').
+
+    Retorno:
+    --------
+    zone_pol, zone_ang, points_after: Un valor por zona.
+    '''
+    keep=segmented_outliers_by_sigma(angle,angle_error,starts,sigma_limit)
+    return (segmented_weighted_average(polarization,polarization_error,starts,keep),
+            segmented_weighted_average(angle,angle_error,starts,keep),
+            np.add.reduceat(keep.astype(np.int64),starts))
+
+compiled_kernels={} # Núcleos ya compilados con 'numba'
+
+def numba_zone_kernel(polarization,polarization_error,angle,angle_error,starts,sigma_limit:float):
+    '''
+    Motor 'numba' del cálculo por zonas: 'fused_zone_statistics' compilado la primera vez que se usa.
+
+    Retorno:
+    --------
+    zone_pol, zone_ang, points_after: Un valor por zona.
+    '''
+    if 'fused_zone_statistics' not in compiled_kernels:
+        compiled_kernels['fused_zone_statistics']=numba.njit(nogil=True,cache=True)(fused_zone_statistics)
+    zone_pol=np.empty(len(starts))
+    zone_ang=np.empty(len(starts))
+    points_after=np.empty(len(starts),dtype=np.int64)
+    compiled_kernels['fused_zone_statistics'](np.ascontiguousarray(polarization,dtype=np.float64),np.ascontiguousarray(polarization_error,dtype=np.float64),
+                                              np.ascontiguousarray(angle,dtype=np.float64),np.ascontiguousarray(angle_error,dtype=np.float64),
+                                              np.ascontiguousarray(starts,dtype=np.int64),float(sigma_limit),zone_pol,zone_ang,points_after)
+    return zone_pol,zone_ang,points_after
+
+ZONE_KERNELS={'numpy':numpy_zone_kernel,'numba':numba_zone_kernel} # Motores de cálculo por zonas disponibles
+KERNEL_OPTIONS={'backend':'numpy'} # Motor usado por 'statistics_per_zone' (ver 'set_kernel_backend')
+
+def set_kernel_backend(backend:str='numpy'):
+    '''
+    Elige el motor de cálculo por zonas usado por 'statistics_per_zone'.
+
+    Parametros:
+    -----------
+    backend: 'numpy' (reducciones por segmentos), 'numba' (núcleo fusionado compilado) o 'auto' ('numba' si está instalado).
+             Si se pide 'numba' y no está instalado se avisa y se usa 'numpy'.
+
+    Retorno:
+    --------
+    Nombre del motor elegido.
+    '''
+    if backend=='auto':
+        backend='numba' if numba is not None else 'numpy'
+    if backend not in ZONE_KERNELS:
+        raise ValueError(f"Motor '{backend}' desconocido. Motores disponibles: {list(ZONE_KERNELS)}")
+    if backend=='numba' and numba is None:
+        warnings.warn("'numba' no está instalado. Se usa el motor 'numpy'.")
+        backend='numpy'
+    KERNEL_OPTIONS['backend']=backend
+    return backend
+
+@instrumented
 def order_catalog(polarization_data:pd.DataFrame,column_name_1:int,column_name_2:int=None,csv_file=None):
     '''
     Parametros:
@@ -143,9 +613,10 @@ def order_catalog(polarization_data:pd.DataFrame,column_name_1:int,column_name_2
     csv_creator(polarization_data,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
     return polarization_data
 
-def direction_bar_coordinates(lon:float,lat:float,ang:float,bar_length:float):
+def direction_bar_coordinates(lon,lat,ang,bar_length:float):
     '''
     Calcula las coordenadas de los puntos inicial y final de la barra de dirección, siendo su largo el largo de los lados de la zona.
+    Acepta tanto valores sueltos como arrays de 'numpy' o columnas de 'pandas' (todas las barras a la vez).
 
     Parametros:
     -----------
@@ -162,8 +633,10 @@ def direction_bar_coordinates(lon:float,lat:float,ang:float,bar_length:float):
     y2: Latitud del final de la barra (º)
     colors: Color 'viridis' indicativo del ángulo de polarización
     '''
-    if ang>180:
-        ang-=180 # Cuando se representa la perpendicular a la polarización, pueden aparecer direcciones por encima de 180º por lo que lo retrasamos 180º.
+    lon=np.asarray(lon,dtype=float)
+    lat=np.asarray(lat,dtype=float)
+    ang=np.asarray(ang,dtype=float)
+    ang=np.where(ang>180,ang-180,ang) # Cuando se representa la perpendicular a la polarización, pueden aparecer direcciones por encima de 180º por lo que lo retrasamos 180º.
     colors=ang/180 #Irá de 0 a 1
     r=bar_length/2
     ang_rad=np.pi*ang/180
@@ -174,9 +647,10 @@ def direction_bar_coordinates(lon:float,lat:float,ang:float,bar_length:float):
     y2=lat+r*np.sin(ang_rad)
     return x1,y1,x2,y2,colors
 
-def direction_bar_coordinates_rad(lon:float,lat:float,ang:float,bar_length:float):
+def direction_bar_coordinates_rad(lon,lat,ang,bar_length:float):
     '''
     Calcula las coordenadas de los puntos inicial y final de la barra de dirección, siendo su largo el largo de los lados de la zona.
+    Acepta tanto valores sueltos como arrays de 'numpy' o columnas de 'pandas' (todas las barras a la vez).
 
     Parametros:
     -----------
@@ -193,8 +667,10 @@ def direction_bar_coordinates_rad(lon:float,lat:float,ang:float,bar_length:float
     y2: Latitud del final de la barra (rad)
     colors: Color 'viridis' indicativo del ángulo de polarización
     '''
-    if ang>np.pi:
-        ang-=np.pi # Cuando se representa la perpendicular a la polarización, pueden aparecer direcciones por encima de 180º por lo que lo retrasamos dichos 180º.
+    lon=np.asarray(lon,dtype=float)
+    lat=np.asarray(lat,dtype=float)
+    ang=np.asarray(ang,dtype=float)
+    ang=np.where(ang>np.pi,ang-np.pi,ang) # Cuando se representa la perpendicular a la polarización, pueden aparecer direcciones por encima de 180º por lo que lo retrasamos dichos 180º.
     colors=ang/np.pi #Irá de 0 a 1
     r=bar_length/2
     
@@ -204,66 +680,243 @@ def direction_bar_coordinates_rad(lon:float,lat:float,ang:float,bar_length:float
     y2=lat+r*np.sin(ang)
     return x1,y1,x2,y2,colors
 
-def cluster_outline(catalog_with_clusters:pd.DataFrame,perpendicular:bool):
+def draw_direction_bars(x1,y1,x2,y2,bar_colors,linewidths,ax=None):
+    '''
+    Dibuja todas las barras de dirección de una vez en una sola 'LineCollection', en lugar de un 'plt.plot' (un artista) por barra.
+
+    Parametros:
+    -----------
+    x1,y1,x2,y2: Arrays con las coordenadas de inicio y final de cada barra (ver 'direction_bar_coordinates').
+    bar_colors: Un color para todas las barras o un array con un color RGBA por barra.
+    linewidths: Un grosor para todas las barras o un array con un grosor por barra.
+    ax: 'Axes' en el que se dibuja. Por defecto el 'Axes' actual de 'pyplot'.
+
+    Retorno:
+    --------
+    La 'LineCollection' añadida al gráfico.
+    '''
+    if ax is None:
+        ax=plt.gca()
+    segments=np.stack((np.column_stack((x1,y1)),np.column_stack((x2,y2))),axis=1) # Array (barras, 2 puntos, 2 coordenadas)
+    bars=LineCollection(segments,colors=bar_colors,linewidths=linewidths)
+    ax.add_collection(bars,autolim=False) # Los límites del mapa ya están fijados
+    return bars
+
+@instrumented
+def cluster_summary(catalog_with_clusters:pd.DataFrame):
+    '''
+    Resumen de todos los clusters calculado en una sola pasada: se ordena una vez por número de cluster y se calculan
+    todas las medias y medianas con reducciones por segmentos, sin volver a filtrar el catálogo para cada cluster.
+
+    Parametros:
+    -----------
+    catalog_with_clusters: DataFrame conteniendo por lo menos las columnas 'longitude','latitude','angle','cluster'
+
+    Retorno:
+    --------
+    summary: DataFrame con una fila por cluster: 'cluster', centro de gravedad ('longitude', 'latitude'), ángulo mediano ('angle'),
+             número de puntos ('points') y la posición de sus puntos ('start', 'stop') dentro de 'order'.
+    order: Array de posiciones de las filas de 'catalog_with_clusters' ordenadas por cluster. Los puntos del cluster de la fila 'n'
+           de 'summary' son 'order[start:stop]'. Si el catálogo ya está ordenado por cluster (como lo devuelve 'cluster_catalog_creator') es 0,1,2,...
+    '''
+    cluster=catalog_with_clusters['cluster'].to_numpy()
+    longitude=catalog_with_clusters['longitude'].to_numpy(dtype=float)
+    latitude=catalog_with_clusters['latitude'].to_numpy(dtype=float)
+    angle=catalog_with_clusters['angle'].to_numpy(dtype=float)
+    order=np.argsort(cluster,kind='stable')
+    starts=zone_boundaries(cluster[order])
+    if len(starts)==0:
+        summary=pd.DataFrame({'cluster':cluster[:0],'longitude':[],'latitude':[],'angle':[],'points':starts,'start':starts,'stop':starts})
+        return summary,order
+    stops=np.append(starts[1:],len(order)).astype(np.int64)
+    points=stops-starts
+    sorted_angles=angle[np.lexsort((angle,cluster))] # Ángulos ordenados dentro de cada cluster para obtener la mediana
+    median_angle=(sorted_angles[starts+(points-1)//2]+sorted_angles[starts+points//2])/2
+    summary=pd.DataFrame({'cluster':cluster[order][starts],
+                          'longitude':np.add.reduceat(longitude[order],starts)/points,
+                          'latitude':np.add.reduceat(latitude[order],starts)/points,
+                          'angle':median_angle,
+                          'points':points,'start':starts,'stop':stops})
+    return summary,order
+
+def outline_color(cluster_angles,added_angle:float,half_turn:float):
+    '''
+    Color 'viridis' del perímetro de cada cluster según su ángulo mediano, igual que el de su barra de dirección.
+    'half_turn' es 180 si los ángulos están en grados o π si están en radianes.
+    '''
+    cluster_angles=np.asarray(cluster_angles,dtype=float)+added_angle
+    cluster_angles=np.where(cluster_angles>half_turn,cluster_angles-half_turn,cluster_angles)
+    return mtp.colormaps.get_cmap('viridis')(cluster_angles/half_turn)
+
+OUTLINE_CACHE_SIZE=100000 # Número máximo de perímetros guardados en 'outline_cache'
+outline_cache={} # Perímetros ya calculados, por clave del contenido de cada cluster (ver 'cluster_polygons')
+
+def point_outline(points):
+    '''
+    Perímetro de los clusters degenerados (menos de 3 puntos distintos o todos alineados): el segmento entre los dos puntos más
+    alejados a lo largo de su dirección principal, o el propio punto si todos coinciden.
+    '''
+    centered=points-points.mean(axis=0)
+    direction=np.linalg.svd(centered,full_matrices=False)[2][0] if len(points)>1 else np.zeros(points.shape[1])
+    position=centered@direction
+    return points[[np.argmin(position),np.argmax(position)]] if np.ptp(position)>0 else points[:1]
+
+def convex_outline(points):
+    '''
+    Envolvente convexa de los puntos como polígono cerrado (vértices en sentido antihorario). Sin excepciones con clusters degenerados.
+    '''
+    points=np.unique(points,axis=0)
+    if len(points)<3:
+        return point_outline(points)
+    try:
+        return points[ConvexHull(points).vertices]
+    except QhullError: # Todos los puntos alineados
+        return point_outline(points)
+
+def concave_outline(points,max_radius:float):
+    '''
+    Perímetro cóncavo ('alpha shape'): de la triangulación de Delaunay se conservan los triángulos cuyo círculo circunscrito tiene un radio
+    menor que 'max_radius' y el perímetro es el mayor de los contornos que forman sus aristas exteriores.
+    Si no queda ningún triángulo se usa la envolvente convexa.
+    '''
+    points=np.unique(points,axis=0)
+    if len(points)<4:
+        return convex_outline(points)
+    try:
+        triangles=Delaunay(points).simplices
+    except QhullError:
+        return point_outline(points)
+    a,b,c=(points[triangles[:,n]] for n in range(3))
+    side_a=np.hypot(*(b-c).T)
+    side_b=np.hypot(*(a-c).T)
+    side_c=np.hypot(*(a-b).T)
+    area=0.5*np.abs((b[:,0]-a[:,0])*(c[:,1]-a[:,1])-(c[:,0]-a[:,0])*(b[:,1]-a[:,1]))
+    with np.errstate(divide='ignore',invalid='ignore'):
+        radius=side_a*side_b*side_c/(4*area)
+    triangles=triangles[radius<max_radius]
+    if len(triangles)==0:
+        return convex_outline(points)
+    edges=np.sort(np.concatenate((triangles[:,[0,1]],triangles[:,[1,2]],triangles[:,[2,0]])),axis=1)
+    edges,count=np.unique(edges,axis=0,return_counts=True)
+    edges=edges[count==1] # Aristas exteriores: las que pertenecen a un solo triángulo
+    neighbours={}
+    for first,second in edges:
+        neighbours.setdefault(first,[]).append(second)
+        neighbours.setdefault(second,[]).append(first)
+    loops=[]
+    unvisited=set(neighbours)
+    while unvisited: # Recorremos cada contorno cerrado
+        loop=[unvisited.pop()]
+        previous=None
+        while True:
+            following=[vertex for vertex in neighbours[loop[-1]] if vertex!=previous and vertex in unvisited]
+            if not following:
+                break
+            previous=loop[-1]
+            loop.append(following[0])
+            unvisited.discard(following[0])
+        loops.append(loop)
+    return points[max(loops,key=len)]
+
+def cluster_polygons(catalog_with_clusters:pd.DataFrame,summary:pd.DataFrame=None,concave_radius:float=None):
+    '''
+    Perímetro de cada cluster como polígono cerrado, calculado una sola vez: se guarda en 'outline_cache' con una clave que depende
+    de las coordenadas de los puntos del cluster y del tipo de perímetro, de forma que al volver a dibujar el mismo cluster (en otro
+    gráfico, con otra orientación o en una búsqueda con otros parámetros que lo reproduce) no se repite el cálculo.
+
+    Parametros:
+    -----------
+    catalog_with_clusters: DataFrame conteniendo por lo menos las columnas 'longitude','latitude','cluster'.
+    summary: Resumen de los clusters obtenido con 'cluster_summary' (se calcula si no se entrega). 'catalog_with_clusters' debe estar ordenado por cluster.
+    concave_radius: Si se indica, perímetro cóncavo (ver 'concave_outline') con este radio máximo (en las unidades de las coordenadas). Si no, envolvente convexa.
+
+    Retorno:
+    --------
+    Lista de arrays (vértices, 2) con el polígono de cada cluster, en el orden de 'summary'. Los clusters de un solo punto o alineados
+    dan un polígono de uno o dos vértices.
+    '''
+    if summary is None:
+        summary,order=cluster_summary(catalog_with_clusters)
+        catalog_with_clusters=catalog_with_clusters.take(order)
+    coordinates=np.column_stack((catalog_with_clusters['longitude'].to_numpy(dtype=float),catalog_with_clusters['latitude'].to_numpy(dtype=float)))
+    method=b'convex' if concave_radius is None else b'concave%r'%concave_radius
+    polygons=[]
+    for start,stop in zip(summary['start'],summary['stop']):
+        points=coordinates[start:stop]
+        key=hashlib.sha256(method+points.tobytes()).hexdigest()
+        polygon=outline_cache.get(key)
+        if polygon is None:
+            polygon=convex_outline(points) if concave_radius is None else concave_outline(points,concave_radius)
+            if len(outline_cache)>=OUTLINE_CACHE_SIZE:
+                del outline_cache[next(iter(outline_cache))] # Eliminamos el más antiguo
+            outline_cache[key]=polygon
+        polygons.append(polygon)
+    return polygons
+
+def draw_cluster_outlines(ax,polygons:list,edge_colors,linewidth:float=0.3):
+    '''
+    Dibuja todos los perímetros en una sola 'PolyCollection' (un único artista) en lugar de un 'plot' por arista.
+
+    Retorno:
+    --------
+    La 'PolyCollection' añadida al gráfico.
+    '''
+    outlines=PolyCollection(polygons,closed=True,facecolors='none',edgecolors=edge_colors,linewidths=linewidth)
+    ax.add_collection(outlines,autolim=False)
+    return outlines
+
+def cluster_outline(catalog_with_clusters:pd.DataFrame,perpendicular:bool,summary:pd.DataFrame=None,ax=None,concave_radius:float=None):
     '''
     Parameters:
     -----------
     catalog_with_clusters: DataFrame conteniendo por lo menos las columnas 'longitude','latitude','angle','cluster'
     perpendicular: Si es 'True' nos representa la perpendicular, es decir la dirección del campo magnético asociado a esta polarización. Sirve para que el color del perímetro sea el mismo que el de la barra de dirección.
+    summary: Resumen de los clusters obtenido con 'cluster_summary' (se calcula si no se entrega). 'catalog_with_clusters' debe estar ordenado por cluster.
+    ax: 'Axes' en el que se dibuja. Por defecto el 'Axes' actual de 'pyplot'.
+    concave_radius: Si se indica, se dibuja el perímetro cóncavo en lugar de la envolvente convexa (ver 'cluster_polygons').
 
     Retorno:
     --------
-    El contorno de los clusteres contenidos en 'catalog_with_clusters' con el color asociado a la dirección de polarización
+    El contorno de los clusteres contenidos en 'catalog_with_clusters' con el color asociado a la dirección de polarización, dibujado en una sola 'PolyCollection' (que se devuelve)
 
     '''
     if perpendicular:
         added_angle=90
     else:
         added_angle=0
-    cmap = plt.get_cmap('viridis')
-    clusters_number=max(catalog_with_clusters['cluster'])+1
-    for clu in range(clusters_number):
-        cluster_angle=catalog_with_clusters[catalog_with_clusters['cluster']==clu]['angle'].median()
-        cluster_angle+=added_angle
-        if cluster_angle>180:
-            cluster_angle-=180
-        viridis_color=cmap(cluster_angle/180)
-        cluster_longitude=catalog_with_clusters[catalog_with_clusters['cluster']==clu]['longitude']
-        cluster_latitude=catalog_with_clusters[catalog_with_clusters['cluster']==clu]['latitude']
-        cluster_coordinates=np.column_stack((cluster_longitude.values,cluster_latitude.values))
-        hull=ConvexHull(cluster_coordinates)
-        for simplex in hull.simplices:
-            plt.plot(cluster_coordinates[simplex, 0], cluster_coordinates[simplex, 1], color=viridis_color,linewidth=0.3)
-
-def cluster_outline_rad(catalog_with_clusters:pd.DataFrame,perpendicular:bool):
+    if ax is None:
+        ax=plt.gca()
+    if summary is None:
+        summary,order=cluster_summary(catalog_with_clusters)
+        catalog_with_clusters=catalog_with_clusters.take(order)
+    polygons=cluster_polygons(catalog_with_clusters,summary,concave_radius)
+    return draw_cluster_outlines(ax,polygons,outline_color(summary['angle'],added_angle,180))
+
+def cluster_outline_rad(catalog_with_clusters:pd.DataFrame,perpendicular:bool,summary:pd.DataFrame=None,ax=None,concave_radius:float=None):
     '''
     Parameters:
     -----------
     catalog_with_clusters: DataFrame conteniendo por lo menos las columnas 'longitude','latitude','angle','cluster'. Los ángulos deben estar en radianes para poder usar la proyección Mollweide.
     perpendicular: Si es 'True' nos representa la perpendicular, es decir la dirección del campo magnético asociado a esta polarización. Sirve para que el color del perímetro sea el mismo que el de la barra de dirección.
+    summary: Resumen de los clusters obtenido con 'cluster_summary' sobre el mismo catálogo en radianes (se calcula si no se entrega). 'catalog_with_clusters' debe estar ordenado por cluster.
+    ax: 'Axes' en el que se dibuja. Por defecto el 'Axes' actual de 'pyplot'.
+    concave_radius: Si se indica, se dibuja el perímetro cóncavo en lugar de la envolvente convexa (ver 'cluster_polygons').
 
     Retorno:
     --------
-    El contorno de los clusteres contenidos en 'catalog_with_clusters' con el color asociado a la dirección de polarización
+    El contorno de los clusteres contenidos en 'catalog_with_clusters' con el color asociado a la dirección de polarización, dibujado en una sola 'PolyCollection' (que se devuelve)
     '''
     if perpendicular:
         added_angle=np.pi/2
     else:
         added_angle=0
-    cmap = plt.get_cmap('viridis')
-    clusters_number=max(catalog_with_clusters['cluster'])+1
-    for clu in range(clusters_number):
-        cluster_angle=catalog_with_clusters[catalog_with_clusters['cluster']==clu]['angle'].median()
-        cluster_angle+=added_angle
-        if cluster_angle>np.pi:
-            cluster_angle-=np.pi
-        viridis_color=cmap(cluster_angle/np.pi)
-        cluster_longitude=catalog_with_clusters[catalog_with_clusters['cluster']==clu]['longitude']
-        cluster_latitude=catalog_with_clusters[catalog_with_clusters['cluster']==clu]['latitude']
-        cluster_coordinates=np.column_stack((cluster_longitude.values,cluster_latitude.values))
-        hull=ConvexHull(cluster_coordinates)
-        for simplex in hull.simplices:
-            plt.plot(cluster_coordinates[simplex, 0], cluster_coordinates[simplex, 1], color=viridis_color,linewidth=0.3)
+    if ax is None:
+        ax=plt.gca()
+    if summary is None:
+        summary,order=cluster_summary(catalog_with_clusters)
+        catalog_with_clusters=catalog_with_clusters.take(order)
+    polygons=cluster_polygons(catalog_with_clusters,summary,concave_radius)
+    return draw_cluster_outlines(ax,polygons,outline_color(summary['angle'],added_angle,np.pi))
 
 def color_bar_values(number_of_sectors):
     bar_values=[i/number_of_sectors for i in range(number_of_sectors)]+[1.0]
@@ -273,7 +926,125 @@ def color_bar_values(number_of_sectors):
         bar_labels=[str(round(i*180,1))+"º" for i in bar_values]
     return bar_values,bar_labels
 
-def read_catalog(url="https://cdsarc.cds.unistra.fr/viz-bin/nph-Cat/fits?II/226/catalog.dat.gz",head=1,lon_name="GLON",lat_name="GLAT",pol_name="Pol",ang_name="PA",pol_err_name="e_Pol",ang_err_name="e_PA",csv_file=None):
+CATALOG_COLUMNS=['longitude','latitude','polarization','angle','polarization_error','angle_error'] # Columnas normalizadas de los catálogos de polarización
+CATALOG_CACHE_VERSION=1 # Se incrementa si cambia el formato de las entradas de la caché
+
+def native_byte_order(column):
+    '''
+    Devuelve la columna con el orden de bytes nativo. Los datos 'fits' suelen ser 'big-endian' y 'pandas' no opera con ellos.
+    '''
+    column=np.asarray(column)
+    return column.astype(column.dtype.newbyteorder('='),copy=False)
+
+def catalog_cache_key(url:str,head:int,column_names:list):
+    '''
+    Clave de la caché del catálogo: 'hash' SHA-256 de la dirección, la cabecera y la correspondencia de nombres de columnas.
+    '''
+    content=json.dumps({'version':CATALOG_CACHE_VERSION,'url':url,'head':head,'columns':list(column_names)},sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def load_cached_catalog(cache_dir:str,key:str,mmap_mode=None):
+    '''
+    Parametros:
+    -----------
+    cache_dir: Directorio de la caché.
+    key: Clave de la entrada (ver 'catalog_cache_key').
+    mmap_mode: Si es 'r' las columnas se proyectan en memoria desde el disco en lugar de leerse completas.
+
+    Retorno:
+    --------
+    DataFrame con las columnas normalizadas del catálogo o 'None' si la entrada no existe.
+    '''
+    entry_dir=os.path.join(cache_dir,key)
+    meta_file=os.path.join(entry_dir,'meta.json')
+    if not os.path.isfile(meta_file):
+        return None
+    polarization_data=pd.DataFrame({name:np.load(os.path.join(entry_dir,name+'.npy'),mmap_mode=mmap_mode) for name in CATALOG_COLUMNS},copy=False)
+    os.utime(meta_file) # La fecha de modificación de 'meta.json' indica el último uso de la entrada (para la eliminación LRU)
+    return polarization_data
+
+def store_cached_catalog(cache_dir:str,key:str,polarization_data:pd.DataFrame,metadata:dict=None):
+    '''
+    Graba en la caché las seis columnas normalizadas del catálogo, cada una en un fichero binario '.npy'.
+    La entrada se escribe en un directorio temporal que después se renombra, de forma que nunca queda una entrada a medio grabar.
+    '''
+    os.makedirs(cache_dir,exist_ok=True)
+    entry_dir=os.path.join(cache_dir,key)
+    temporary_dir=entry_dir+'.tmp%d'%os.getpid()
+    shutil.rmtree(temporary_dir,ignore_errors=True)
+    os.makedirs(temporary_dir)
+    for name in CATALOG_COLUMNS:
+        column=polarization_data[name].to_numpy()
+        np.save(os.path.join(temporary_dir,name+'.npy'),native_byte_order(column))
+    meta=dict(metadata or {})
+    meta.update({'version':CATALOG_CACHE_VERSION,'rows':len(polarization_data),'created':time.time()})
+    with open(os.path.join(temporary_dir,'meta.json'),'w') as meta_file:
+        json.dump(meta,meta_file)
+    shutil.rmtree(entry_dir,ignore_errors=True)
+    os.replace(temporary_dir,entry_dir)
+
+def clear_catalog_cache(cache_dir:str,url:str=None):
+    '''
+    Invalida entradas de la caché. Si se indica 'url' solo se borran las entradas de esta dirección; si no, se borra toda la caché.
+
+    Retorno:
+    --------
+    Número de entradas borradas.
+    '''
+    removed=0
+    for key,meta,size in catalog_cache_entries(cache_dir):
+        if url is None or meta.get('url')==url:
+            shutil.rmtree(os.path.join(cache_dir,key),ignore_errors=True)
+            removed+=1
+    return removed
+
+def catalog_cache_entries(cache_dir:str):
+    '''
+    Lista de las entradas de la caché como tuplas (clave, metadatos, tamaño en bytes) ordenadas de la menos a la más recientemente usada.
+    '''
+    entries=[]
+    if not os.path.isdir(cache_dir):
+        return entries
+    for key in os.listdir(cache_dir):
+        meta_file=os.path.join(cache_dir,key,'meta.json')
+        if not os.path.isfile(meta_file):
+            continue
+        with open(meta_file) as file:
+            meta=json.load(file)
+        meta['last_used']=os.path.getmtime(meta_file)
+        size=sum(os.path.getsize(os.path.join(cache_dir,key,name)) for name in os.listdir(os.path.join(cache_dir,key)))
+        entries.append((key,meta,size))
+    return sorted(entries,key=lambda entry:entry[1]['last_used'])
+
+def evict_catalog_cache(cache_dir:str,max_bytes:int=None,max_age:float=None):
+    '''
+    Elimina entradas de la caché.
+
+    Parametros:
+    -----------
+    cache_dir: Directorio de la caché.
+    max_bytes: Tamaño máximo de la caché. Se eliminan las entradas usadas hace más tiempo hasta no superarlo.
+    max_age: Edad máxima (segundos desde el último uso) de las entradas que se conservan.
+
+    Retorno:
+    --------
+    Número de entradas eliminadas.
+    '''
+    entries=catalog_cache_entries(cache_dir)
+    total_size=sum(size for key,meta,size in entries)
+    now=time.time()
+    removed=0
+    for key,meta,size in entries:
+        too_old=max_age is not None and now-meta['last_used']>max_age
+        too_big=max_bytes is not None and total_size>max_bytes
+        if too_old or too_big:
+            shutil.rmtree(os.path.join(cache_dir,key),ignore_errors=True)
+            total_size-=size
+            removed+=1
+    return removed
+
+@instrumented
+def read_catalog(url="https://cdsarc.cds.unistra.fr/viz-bin/nph-Cat/fits?II/226/catalog.dat.gz",head=1,lon_name="GLON",lat_name="GLAT",pol_name="Pol",ang_name="PA",pol_err_name="e_Pol",ang_err_name="e_PA",csv_file=None,cache_dir=None,offline=False,refresh=False):
     '''
     Parametros:
     -----------
@@ -288,6 +1059,9 @@ def read_catalog(url="https://cdsarc.cds.unistra.fr/viz-bin/nph-Cat/fits?II/226/
     pol_err_name: Nombre de la variable del error estimado del porcentaje de polarización.
     ang_err_name: Nombre de la variable del error estimado del ángulo de polarización.
     csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+    cache_dir: Si se indica un directorio, la tabla normalizada se guarda en él y las siguientes lecturas con la misma 'url', 'head' y nombres de columnas la leen de allí sin descargar el 'fits'.
+    offline: Si es 'True' no se accede a 'url': el catálogo debe estar en la caché (hace falta 'cache_dir'). Si no lo está se produce un 'FileNotFoundError'.
+    refresh: Si es 'True' se ignora la entrada de la caché y se vuelve a leer el catálogo de 'url'. No se puede combinar con 'offline'.
 
     Retorno:
     --------
@@ -299,86 +1073,522 @@ def read_catalog(url="https://cdsarc.cds.unistra.fr/viz-bin/nph-Cat/fits?II/226/
      - error estimado del porcentaje de polarización 'polarization_error'
      - error estimado de la dirección de polarización 'angle_error'
     '''
-    #Todo lo que contiene el 'fits'
-    all_catalog_data=fits.open(url)
-    #Tabla de todos los datos que contiene la cabecera 'head'
-    all_data=pd.DataFrame(all_catalog_data[head].data)
-    #Subtabla con solo los campos necesarios para generar el mapa de polarización
-    polarization_data=all_data[[lon_name,lat_name,pol_name,ang_name,pol_err_name,ang_err_name]]#seleccionamos solo las columnas que nos interesan
-    old_columns_name=list(polarization_data.columns)
-    new_columns_name=['longitude','latitude','polarization','angle','polarization_error','angle_error']
-    #creamos un diccionario en el que la clave son el nombre actual de las columnas 'old_columns_name' y los valores el nuevo nombre 'new_columns_name'.
-    changing_names=dict(zip(old_columns_name,new_columns_name))
-    polarization_data=polarization_data.rename(columns=changing_names)
-
-    #Si los valores de longitud van de 0º a 360º paso los superiores a 180º a ángulos negativos de forma que el centro del mapa esté situado en el centro galáctico.
-    if polarization_data["longitude"].max()>180:
-        polarization_data.loc[polarization_data["longitude"]>180,'longitude']=polarization_data.loc[polarization_data["longitude"]>180,'longitude']-360
+    if offline and cache_dir is None:
+        raise ValueError("Sin conexión ('offline') el catálogo solo puede leerse de la caché: indique 'cache_dir'")
+    if offline and refresh:
+        raise ValueError("'refresh' vuelve a leer el catálogo de 'url' y no se puede combinar con 'offline'")
+    old_columns_name=[lon_name,lat_name,pol_name,ang_name,pol_err_name,ang_err_name]
+    polarization_data=None
+    if cache_dir is not None:
+        key=catalog_cache_key(url,head,old_columns_name)
+        if not refresh:
+            polarization_data=load_cached_catalog(cache_dir,key)
+    if polarization_data is None:
+        if offline:
+            raise FileNotFoundError(f"El catálogo '{url}' no está en la caché '{cache_dir}' y se ha pedido trabajar sin conexión")
+        #Todo lo que contiene el 'fits'
+        all_catalog_data=fits.open(url)
+        #Tabla de todos los datos que contiene la cabecera 'head'
+        all_data=all_catalog_data[head].data
+        #Tabla con solo los campos necesarios para generar el mapa de polarización, con el nombre nuevo de cada columna. No convertimos a DataFrame el resto de columnas de la cabecera.
+        polarization_data=pd.DataFrame({new_name:native_byte_order(all_data[old_name]) for old_name,new_name in zip(old_columns_name,CATALOG_COLUMNS)})
+
+        #Si los valores de longitud van de 0º a 360º paso los superiores a 180º a ángulos negativos de forma que el centro del mapa esté situado en el centro galáctico.
+        if polarization_data["longitude"].max()>180:
+            polarization_data.loc[polarization_data["longitude"]>180,'longitude']=polarization_data.loc[polarization_data["longitude"]>180,'longitude']-360
+        if cache_dir is not None:
+            store_cached_catalog(cache_dir,key,polarization_data,{'url':url,'head':head,'columns':old_columns_name})
     csv_creator(polarization_data,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
     return polarization_data
 
-def space_cutout(polarization_data:pd.DataFrame,lon_min:float,lon_max:float,lat_min:float,lat_max:float,csv_file=None):
+def read_catalog_chunks(url="https://cdsarc.cds.unistra.fr/viz-bin/nph-Cat/fits?II/226/catalog.dat.gz",head=1,lon_name="GLON",lat_name="GLAT",pol_name="Pol",ang_name="PA",pol_err_name="e_Pol",ang_err_name="e_PA",chunk_rows:int=1000000,cache_dir=None):
     '''
-    Devuelve un mapa con los puntos que se hallen dentro del rectángulo definido por (lon_min,lat_min) y (lon_max,lat_max)
+    Lee el catálogo por bloques de filas, sin cargarlo entero en memoria.
 
-    Parametros
-    ----------
-    polarization_data: DataFrame de los datos de polarización con las columnas: longitude,latitude,polarization,angle,polarization_error,angle_error.
-    lon_min: Longitud mínima del submapa a devolver
-    lat_min: Latitud mínima del submapa a devolver
-    lon_max: Longitud maxima del submapa a devolver
-    lat_max: Latitud maxima del submapa a devolver
-    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+    Parametros:
+    -----------
+    url, head, lon_name, lat_name, pol_name, ang_name, pol_err_name, ang_err_name: Ver 'read_catalog'.
+    chunk_rows: Número de filas de cada bloque.
+    cache_dir: Si el catálogo está en la caché de 'read_catalog', las columnas se proyectan en memoria desde allí. Si no, se lee el 'fits' con 'memmap'.
 
-    Retorno
-    -------
-    Submapa del 'DataFrame' delimitado por el rectángulo entre la esquina inferior izquierda (lon_min,lat_min) y la superior derecha (lon_max,lat_max).
+    Retorno:
+    --------
+    Generador de DataFrames con las columnas normalizadas de 'read_catalog' ('longitude' entre -180º y 180º).
     '''
-    
-    for n in range(len(polarization_data)):
-        if polarization_data.loc[n,'longitude']>=lon_min and polarization_data.loc[n,'longitude']<=lon_max and polarization_data.loc[n,'latitude']>=lat_min and polarization_data.loc[n,'latitude']<=lat_max:
-            pass
-        else:
-            polarization_data.drop(n,inplace=True)
-    polarization_data.reset_index(drop=True,inplace=True) #Debo eliminar el índice para reenumerar las filas. Si no se hace, el índice continua apuntando a la posición de cada punto en el catálogo.
-    csv_creator(polarization_data,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
-    return polarization_data
+    old_columns_name=[lon_name,lat_name,pol_name,ang_name,pol_err_name,ang_err_name]
+    polarization_data=None
+    if cache_dir is not None:
+        polarization_data=load_cached_catalog(cache_dir,catalog_cache_key(url,head,old_columns_name),mmap_mode='r')
+    if polarization_data is not None:
+        columns=[polarization_data[name].to_numpy() for name in CATALOG_COLUMNS]
+    else:
+        all_data=fits.open(url,memmap=True)[head].data
+        columns=[all_data[name] for name in old_columns_name]
+    for start in range(0,len(columns[0]),chunk_rows):
+        chunk=pd.DataFrame({name:native_byte_order(column[start:start+chunk_rows]) for name,column in zip(CATALOG_COLUMNS,columns)}) # Solo este bloque se lee del disco
+        longitude=chunk['longitude'].to_numpy()
+        chunk['longitude']=np.where(longitude>180,longitude-360,longitude) # Igual que en 'read_catalog'
+        yield chunk
 
-def values_cutout(polarization_data,pol_min,ang_err_max,csv_file=None):
+LABEL_DTYPES=(np.int8,np.int16,np.int32,np.int64) # Tipos enteros posibles de las etiquetas de zona y de cluster del catálogo compacto
+
+def label_dtype(max_value:int,min_value:int=-1):
     '''
-    Elimina los puntos que estan fuera de los límites indicados.
+    Tipo entero más pequeño de 'LABEL_DTYPES' que puede contener los valores entre 'min_value' y 'max_value'.
+    '''
+    return next(dtype for dtype in LABEL_DTYPES if np.iinfo(dtype).min<=min_value and max_value<=np.iinfo(dtype).max)
+
+def catalog_float_dtype(polarization_data:pd.DataFrame):
+    '''
+    Tipo de coma flotante de las columnas del catálogo (el de 'longitude'). Las columnas que añaden las etapas usan este mismo tipo.
+    '''
+    dtype=polarization_data['longitude'].dtype
+    return dtype if dtype.kind=='f' else np.dtype(np.float64)
+
+def is_compact(polarization_data:pd.DataFrame):
+    '''
+    'True' si el catálogo es compacto (ver 'compact_catalog'): sus columnas son de menos de 64 bits y las etiquetas se guardan con el tipo entero más pequeño posible.
+    '''
+    return catalog_float_dtype(polarization_data).itemsize<8
+
+def compact_catalog(polarization_data:pd.DataFrame,dtype=np.float32,copy:bool=True):
+    '''
+    Catálogo compacto: un DataFrame con cada columna en un array contiguo propio de tipo 'dtype' (por defecto 'float32', la mitad de memoria
+    por estrella que 'float64') y las columnas enteras (por ejemplo 'zone_id' o 'cluster') con el tipo entero más pequeño que las contiene.
+    Todas las etapas aceptan el catálogo compacto y conservan sus tipos en las columnas que añaden.
+
+    Parametros:
+    -----------
+    polarization_data: DataFrame del catálogo.
+    dtype: Tipo de coma flotante de las columnas.
+    copy: Política de copia. Si es 'False' las columnas que ya tienen el tipo pedido no se copian: el catálogo compacto comparte su memoria
+          con 'polarization_data' (una vista); con el 'copy-on-write' de pandas, modificar una de las dos tablas no altera la otra. Si es 'True' todas las columnas son copias propias.
+
+    Retorno:
+    --------
+    DataFrame compacto con las mismas columnas y filas que 'polarization_data'.
+    '''
+    columns={}
+    for name in polarization_data.columns:
+        column=polarization_data[name].to_numpy()
+        if column.dtype.kind=='f':
+            column=column.astype(dtype,copy=copy)
+        elif column.dtype.kind in 'iu' and len(column):
+            column=column.astype(label_dtype(column.max(),min(column.min(),-1)),copy=copy)
+        elif copy:
+            column=column.copy()
+        columns[name]=np.ascontiguousarray(column)
+    return pd.DataFrame(columns,copy=False)
+
+def cutout_mask(polarization_data:pd.DataFrame,lon_min:float=None,lon_max:float=None,lat_min:float=None,lat_max:float=None,pol_min:float=None,ang_err_max:float=None,positive_error:bool=False,mask=None):
+    '''
+    Calcula en una sola pasada la máscara booleana de los puntos que cumplen todos los límites indicados.
+    Los límites que se dejan en 'None' no se aplican, de forma que se puede combinar cualquier recorte espacial y de valores.
 
     Parametros
     ----------
     polarization_data: DataFrame de los datos de polarización con las columnas: longitude,latitude,polarization,angle,polarization_error,angle_error.
+    lon_min, lon_max: Límites (incluidos) de longitud.
+    lat_min, lat_max: Límites (incluidos) de latitud.
     pol_min: Porcentaje de polarización por debajo del cual se eliminan los puntos.
     ang_err_max: Error de ángulo por encima del cual se eliminan los puntos.
-    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+    positive_error: Si es 'True' solo se conservan los puntos con un error de ángulo definido (mayor que 0).
+    mask: Máscara previa con la que se combina el resultado. Permite encadenar varios recortes sin crear copias intermedias del 'DataFrame'.
 
     Retorno
     -------
-    'DataFrame' de la polarización sin los puntos que estén fuera de los límites especificados.
+    Array booleano de 'numpy' con un valor por fila de 'polarization_data'. Los valores 'NaN' nunca cumplen un límite.
     '''
-    for n in range(len(polarization_data)):
-        if polarization_data.loc[n,'polarization']>=pol_min and polarization_data.loc[n,'angle_error']<=ang_err_max and polarization_data.loc[n,'angle_error']>0: #Solo elegimos los que tengan un error de ángulo definido 
-            pass
-        else:
-            polarization_data.drop(n,inplace=True)
-    polarization_data.reset_index(drop=True,inplace=True) #Debo eliminar el índice para reenumerar las filas. Si no se hace, el índice continua apuntando a la posición de cada punto en el catálogo.
+    if mask is None:
+        mask=np.ones(len(polarization_data),dtype=bool)
+    else:
+        mask=np.array(mask,dtype=bool) # Copia para no modificar la máscara recibida
+    limits=[('longitude',lon_min,np.greater_equal),('longitude',lon_max,np.less_equal),
+            ('latitude',lat_min,np.greater_equal),('latitude',lat_max,np.less_equal),
+            ('polarization',pol_min,np.greater_equal),('angle_error',ang_err_max,np.less_equal)]
+    for column_name,limit,comparison in limits:
+        if limit is not None:
+            mask&=comparison(polarization_data[column_name].to_numpy(),limit)
+    if positive_error:
+        mask&=polarization_data['angle_error'].to_numpy()>0
+    return mask
+
+@instrumented
+def apply_mask(polarization_data:pd.DataFrame,mask,csv_file=None):
+    '''
+    Parametros
+    ----------
+    polarization_data: DataFrame de los datos de polarización.
+    mask: Array booleano obtenido con 'cutout_mask'.
+    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+
+    Retorno
+    -------
+    Nuevo 'DataFrame' con solo las filas seleccionadas por la máscara y el índice reenumerado desde 0.
+    '''
+    polarization_data=polarization_data[mask].reset_index(drop=True) #Debo eliminar el índice para reenumerar las filas. Si no se hace, el índice continua apuntando a la posición de cada punto en el catálogo.
     csv_creator(polarization_data,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
     return polarization_data
 
-def add_coords_of_zone_center(polarization_data:pd.DataFrame,zone_size:float,csv_file=None):
+def unit_vectors(longitude,latitude):
+    '''
+    Vectores unitarios (x,y,z) de las posiciones en la esfera (º).
+    '''
+    lon=np.radians(np.asarray(longitude,dtype=float))
+    lat=np.radians(np.asarray(latitude,dtype=float))
+    return np.column_stack((np.cos(lat)*np.cos(lon),np.cos(lat)*np.sin(lon),np.sin(lat)))
+
+def build_catalog_index(polarization_data:pd.DataFrame,cell_size:float=1.0):
+    '''
+    Índice espacial del catálogo, para seleccionar regiones del cielo sin recorrer todas las filas. Se construye una vez por catálogo y
+    sirve para todas las consultas: rectángulos ('box_query', también como 'index' de 'space_cutout'), círculos ('cone_query') y polígonos
+    esféricos ('polygon_query'). Todas devuelven los números de fila (ordenados) en lugar de copias del catálogo.
+
+    Parametros:
+    -----------
+    polarization_data: DataFrame con 'longitude' (entre -180º y 180º) y 'latitude'.
+    cell_size: Lado (º) de las celdas en longitud y latitud en las que se agrupan las filas para las consultas de rectángulos.
+
+    Retorno:
+    --------
+    Diccionario con:
+     - 'rows': número de filas del catálogo.
+     - 'longitude', 'latitude': las columnas del catálogo (sin copiar), también para comprobar que el índice corresponde al catálogo consultado (ver 'index_matches').
+     - 'cell_size', 'lon_cells', 'lat_cells': dimensiones de la rejilla de celdas.
+     - 'order', 'cell_starts': filas ordenadas por celda (las de la celda 'n' son 'order[cell_starts[n]:cell_starts[n+1]]').
+     - 'tree', 'tree_rows': árbol 'cKDTree' de los vectores unitarios de las filas con coordenadas válidas y su número de fila.
+    '''
+    longitude=polarization_data['longitude'].to_numpy()
+    latitude=polarization_data['latitude'].to_numpy()
+    lon_cells=int(np.ceil(360/cell_size))
+    lat_cells=int(np.ceil(180/cell_size))
+    valid=np.isfinite(longitude)&np.isfinite(latitude)
+    cell=np.full(len(longitude),lon_cells*lat_cells,dtype=np.int64) # Las filas sin coordenadas van a una celda final que nunca se consulta
+    cell[valid]=(np.clip(np.floor((latitude[valid]+90)/cell_size),0,lat_cells-1).astype(np.int64)*lon_cells+
+                 np.clip(np.floor((longitude[valid]+180)/cell_size),0,lon_cells-1).astype(np.int64)) # Celdas ordenadas por latitud y, dentro de cada fila, por longitud
+    order=np.argsort(cell,kind='stable')
+    cell_starts=np.searchsorted(cell[order],np.arange(lon_cells*lat_cells+1))
+    tree_rows=np.flatnonzero(valid)
+    return {'rows':len(longitude),'longitude':longitude,'latitude':latitude,'cell_size':cell_size,'lon_cells':lon_cells,'lat_cells':lat_cells,
+            'order':order,'cell_starts':cell_starts,'tree':cKDTree(unit_vectors(longitude[valid],latitude[valid])),'tree_rows':tree_rows}
+
+def index_ranges(order,starts,stops):
+    '''
+    Concatena 'order[start:stop]' de todos los rangos sin recorrerlos en Python.
+    '''
+    lengths=stops-starts
+    if lengths.sum()==0:
+        return np.zeros(0,dtype=order.dtype)
+    offsets=np.repeat(starts-np.concatenate(([0],np.cumsum(lengths)[:-1])),lengths)
+    return order[np.arange(lengths.sum())+offsets]
+
+def box_query(index:dict,lon_min:float=None,lon_max:float=None,lat_min:float=None,lat_max:float=None):
+    '''
+    Filas con longitud entre 'lon_min' y 'lon_max' y latitud entre 'lat_min' y 'lat_max' (límites incluidos, igual que 'cutout_mask').
+    Solo se examinan las filas de las celdas que tocan el rectángulo: por cada fila de celdas en latitud, un único rango contiguo de 'order'.
+    Como en 'cutout_mask', un límite 'None' no se aplica: las filas sin coordenadas válidas (celda final del índice) también se examinan
+    y se conservan si cumplen los límites indicados.
+
+    Retorno:
+    --------
+    Array ordenado de números de fila.
+    '''
+    lon_low=-np.inf if lon_min is None else lon_min
+    lon_high=np.inf if lon_max is None else lon_max
+    lat_low=-np.inf if lat_min is None else lat_min
+    lat_high=np.inf if lat_max is None else lat_max
+    if lon_low>lon_high or lat_low>lat_high:
+        return np.zeros(0,dtype=np.int64)
+    cell_size,lon_cells,lat_cells=index['cell_size'],index['lon_cells'],index['lat_cells']
+    first_lon,last_lon=[int(np.clip(np.floor((value+180)/cell_size),0,lon_cells-1)) for value in (max(lon_low,-180),min(lon_high,180))]
+    first_lat,last_lat=[int(np.clip(np.floor((value+90)/cell_size),0,lat_cells-1)) for value in (max(lat_low,-90),min(lat_high,90))]
+    lat_rows=np.arange(first_lat,last_lat+1)*lon_cells
+    candidates=np.concatenate((index_ranges(index['order'],index['cell_starts'][lat_rows+first_lon],index['cell_starts'][lat_rows+last_lon+1]),
+                               index['order'][index['cell_starts'][-1]:])) # Filas sin coordenadas válidas
+    longitude=index['longitude'][candidates]
+    latitude=index['latitude'][candidates]
+    inside=np.ones(len(candidates),dtype=bool)
+    for values,limit,comparison in ((longitude,lon_min,np.greater_equal),(longitude,lon_max,np.less_equal),
+                                    (latitude,lat_min,np.greater_equal),(latitude,lat_max,np.less_equal)):
+        if limit is not None:
+            inside&=comparison(values,limit)
+    return np.sort(candidates[inside])
+
+def cone_query(index:dict,longitude:float,latitude:float,radius:float):
+    '''
+    Filas a una distancia angular menor o igual que 'radius' (º) del punto ('longitude','latitude').
+
+    Retorno:
+    --------
+    Array ordenado de números de fila.
+    '''
+    chord=2*np.sin(np.radians(min(radius,180))/2) # Distancia en línea recta entre dos puntos de la esfera unidad separados 'radius'
+    neighbours=index['tree'].query_ball_point(unit_vectors(longitude,latitude)[0],chord*(1+1e-12))
+    return np.sort(index['tree_rows'][np.asarray(neighbours,dtype=np.int64)])
+
+def polygon_query(index:dict,vertex_longitudes,vertex_latitudes):
+    '''
+    Filas dentro de un polígono esférico (lados sobre círculos máximos) menor que un hemisferio, convexo o no.
+    Se buscan primero las filas del círculo que contiene todos los vértices ('cone_query') y después se comprueba cada una en la
+    proyección gnomónica centrada en el polígono, en la que los lados del polígono son rectas.
+
+    Parametros:
+    -----------
+    index: Índice de 'build_catalog_index'.
+    vertex_longitudes, vertex_latitudes: Vértices del polígono (º), en orden.
+
+    Retorno:
+    --------
+    Array ordenado de números de fila.
+    '''
+    vertices=unit_vectors(vertex_longitudes,vertex_latitudes)
+    center=vertices.sum(axis=0)
+    center/=np.linalg.norm(center)
+    radius=np.degrees(np.arccos(np.clip(vertices@center,-1,1)).max())
+    if radius>=90:
+        raise ValueError(f'El polígono no cabe en un hemisferio: sus vértices están hasta a {radius:.1f}º de su centro')
+    candidates=cone_query(index,np.degrees(np.arctan2(center[1],center[0])),np.degrees(np.arcsin(center[2])),radius)
+    east=np.cross([0.0,0.0,1.0],center)
+    if np.linalg.norm(east)<1e-12: # Polígono centrado en un polo
+        east=np.array([1.0,0.0,0.0])
+    east/=np.linalg.norm(east)
+    north=np.cross(center,east)
+    def gnomonic(vectors):
+        return np.column_stack((vectors@east,vectors@north))/(vectors@center)[:,None]
+    points=gnomonic(unit_vectors(index['longitude'][candidates],index['latitude'][candidates]))
+    inside=mtp.path.Path(gnomonic(vertices)).contains_points(points)
+    return candidates[inside]
+
+def index_matches(index:dict,polarization_data:pd.DataFrame):
+    '''
+    'True' si 'index' se construyó con las coordenadas de 'polarization_data'. Si las columnas son las mismas (sin copiar) basta con
+    comparar su posición en memoria; si no, se comparan sus valores.
+    '''
+    if index['rows']!=len(polarization_data):
+        return False
+    for name in ('longitude','latitude'):
+        column=polarization_data[name].to_numpy()
+        same_array=column.__array_interface__['data'][0]==index[name].__array_interface__['data'][0] and column.strides==index[name].strides
+        if not same_array and not np.array_equal(column,index[name],equal_nan=True):
+            return False
+    return True
+
+@instrumented
+def space_cutout(polarization_data:pd.DataFrame,lon_min:float,lon_max:float,lat_min:float,lat_max:float,csv_file=None,index:dict=None):
+    '''
+    Devuelve un mapa con los puntos que se hallen dentro del rectángulo definido por (lon_min,lat_min) y (lon_max,lat_max)
+
+    Parametros
+    ----------
+    polarization_data: DataFrame de los datos de polarización con las columnas: longitude,latitude,polarization,angle,polarization_error,angle_error.
+    lon_min: Longitud mínima del submapa a devolver
+    lat_min: Latitud mínima del submapa a devolver
+    lon_max: Longitud maxima del submapa a devolver
+    lat_max: Latitud maxima del submapa a devolver
+    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+    index: Índice de 'build_catalog_index' de este mismo catálogo. Si se introduce, solo se examinan las filas cercanas al rectángulo en lugar de todo el catálogo (mismo resultado).
+
+    Retorno
+    -------
+    Submapa del 'DataFrame' delimitado por el rectángulo entre la esquina inferior izquierda (lon_min,lat_min) y la superior derecha (lon_max,lat_max).
+    '''
+    if index is None:
+        mask=cutout_mask(polarization_data,lon_min=lon_min,lon_max=lon_max,lat_min=lat_min,lat_max=lat_max)
+        return apply_mask(polarization_data,mask,csv_file)
+    if not index_matches(index,polarization_data):
+        raise ValueError("El índice se construyó con otro catálogo. Vuelva a construirlo con 'build_catalog_index'")
+    polarization_data=polarization_data.take(box_query(index,lon_min,lon_max,lat_min,lat_max)).reset_index(drop=True)
+    csv_creator(polarization_data,csv_file)
+    return polarization_data
+
+@instrumented
+def values_cutout(polarization_data,pol_min,ang_err_max,csv_file=None):
+    '''
+    Elimina los puntos que estan fuera de los límites indicados.
+
+    Parametros
+    ----------
+    polarization_data: DataFrame de los datos de polarización con las columnas: longitude,latitude,polarization,angle,polarization_error,angle_error.
+    pol_min: Porcentaje de polarización por debajo del cual se eliminan los puntos.
+    ang_err_max: Error de ángulo por encima del cual se eliminan los puntos.
+    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+
+    Retorno
+    -------
+    'DataFrame' de la polarización sin los puntos que estén fuera de los límites especificados.
+    '''
+    mask=cutout_mask(polarization_data,pol_min=pol_min,ang_err_max=ang_err_max,positive_error=True) #Solo elegimos los que tengan un error de ángulo definido 
+    return apply_mask(polarization_data,mask,csv_file)
+
+def finite_coordinates(longitude,latitude):
+    '''
+    Convierte las coordenadas en arrays 'float' y comprueba que todas son finitas: un valor 'NaN' o infinito no pertenece a ninguna zona.
+    '''
+    longitude=np.asarray(longitude,dtype=float)
+    latitude=np.asarray(latitude,dtype=float)
+    invalid=~(np.isfinite(longitude)&np.isfinite(latitude))
+    if invalid.any():
+        raise ValueError(f'Hay {int(invalid.sum())} puntos con longitud o latitud no finita (la primera en la posición {int(np.argmax(invalid))}). Elimínelos antes de asignarles una zona.')
+    return longitude,latitude
+
+def grid_zones(longitude,latitude,zone_size:float):
+    '''
+    Zonificación rectangular en longitud y latitud (la usada hasta ahora por 'add_coords_of_zone_center').
+
+    Parametros
+    ----------
+    longitude: Array de longitudes (º) entre -180º y 180º.
+    latitude: Array de latitudes (º) entre -90º y 90º.
+    zone_size: Dimensión en grados de los lados de las zonas.
+
+    Retorno
+    -------
+    zone_id: Número entero (int64) de la zona. Ordenar por 'zone_id' es lo mismo que ordenar por 'zone_lon' y después por 'zone_lat'.
+    zone_lon: Longitud del centro de la zona de cada punto (º).
+    zone_lat: Latitud del centro de la zona de cada punto (º).
+    '''
+    '''
+    Los cuadrantes los identifico con dos valores, el primero (zone_lon_num) es el número de cuadrantes
+    que debo desplazarme en longitud (es decir en horizontal) para llegar al que contiene el punto.
+    El segundo (zone_lat_num), el número de cuadrantes que debo desplazarme en latitud (es decir
+    en vertical) para llegar al cuadrante que contiene el punto.
+    El primer cuadrante siempre es el número cero.
+    '''
+    longitude,latitude=finite_coordinates(longitude,latitude)
+    zone_lon_num=np.trunc((longitude-(-180))/zone_size).astype(np.int64) # '-180' es el valor de longitud mas pequeño posible.
+    zone_lat_num=np.trunc((latitude-(-90))/zone_size).astype(np.int64) # '-90' es el valor de latitud mas pequeño posible.
+    lat_zones=int(180/zone_size)+1 # Número de cuadrantes en latitud (incluido el que contiene el polo norte cuando 'zone_size' divide a 180)
+    zone_id=zone_lon_num*lat_zones+zone_lat_num
+    '''
+    Ahora tan solo tenemos que calcular cual es el centro de este cuadrante (zone).
+    '''
+    zone_lon=zone_lon_num*zone_size+(-180)+zone_size/2
+    zone_lat=zone_lat_num*zone_size+(-90)+zone_size/2
+    return zone_id,zone_lon,zone_lat
+
+def healpix_nside(zone_size:float):
+    '''
+    Devuelve el parámetro 'nside' de la pixelización HEALPix cuyos píxeles tienen un lado medio lo más próximo posible a 'zone_size' (º).
+    El lado medio de un píxel es sqrt(4π/(12·nside²)) radianes, es decir unos 58.6º/nside.
+    '''
+    return max(1,int(round(np.degrees(np.sqrt(np.pi/3))/zone_size)))
+
+def healpix_ang2pix(nside:int,longitude,latitude):
+    '''
+    Número de píxel HEALPix (esquema 'RING') de cada punto. Todos los píxeles tienen la misma área.
+
+    Parametros
+    ----------
+    nside: Resolución de la pixelización. El cielo se divide en 12·nside² píxeles.
+    longitude: Array de longitudes (º).
+    latitude: Array de latitudes (º).
+
+    Retorno
+    -------
+    Array 'int64' con el número de píxel de cada punto.
+    '''
+    z=np.sin(np.radians(np.asarray(latitude,dtype=float)))
+    za=np.abs(z)
+    tt=np.mod(np.radians(np.asarray(longitude,dtype=float))/(np.pi/2),4.0) # Entre 0 y 4
+    nl4=4*nside
+    ncap=2*nside*(nside-1)
+    npix=12*nside*nside
+    # Región ecuatorial
+    temp1=nside*(0.5+tt)
+    temp2=nside*z*0.75
+    jp=np.floor(temp1-temp2).astype(np.int64) # Índice de la línea de borde ascendente
+    jm=np.floor(temp1+temp2).astype(np.int64) # Índice de la línea de borde descendente
+    ir=nside+1+jp-jm # Anillo contado desde z=2/3, entre 1 y 2·nside+1
+    kshift=1-(ir&1)
+    ip=((jp+jm-nside+kshift+1+2*nl4)>>1)%nl4
+    equatorial_pixel=ncap+(ir-1)*nl4+ip
+    # Casquetes polares
+    tp=tt-np.floor(tt)
+    tmp=nside*np.sqrt(3*(1-za))
+    jp=np.floor(tp*tmp).astype(np.int64)
+    jm=np.floor((1.0-tp)*tmp).astype(np.int64)
+    ir=jp+jm+1 # Anillo contado desde el polo más próximo
+    ip=np.minimum(np.floor(tt*ir).astype(np.int64),4*ir-1)
+    polar_pixel=np.where(z>0,2*ir*(ir-1)+ip,npix-2*ir*(ir+1)+ip)
+    return np.where(za<=2/3,equatorial_pixel,polar_pixel)
+
+def healpix_pix2ang(nside:int,pixels):
+    '''
+    Coordenadas del centro de cada píxel HEALPix (esquema 'RING').
+
+    Parametros
+    ----------
+    nside: Resolución de la pixelización.
+    pixels: Array de números de píxel.
+
+    Retorno
+    -------
+    longitude: Longitud del centro de cada píxel (º), entre -180º y 180º.
+    latitude: Latitud del centro de cada píxel (º).
+    '''
+    pixels=np.asarray(pixels,dtype=np.int64)
+    ncap=2*nside*(nside-1)
+    npix=12*nside*nside
+    z=np.empty(len(pixels))
+    phi=np.empty(len(pixels))
+    north=pixels<ncap
+    south=pixels>=npix-ncap
+    equator=~(north|south)
+    # Casquete norte
+    pix=pixels[north]
+    iring=(1+np.floor(np.sqrt(1+2*pix)).astype(np.int64))>>1
+    iphi=(pix+1)-2*iring*(iring-1)
+    z[north]=1.0-iring*iring*4/npix
+    phi[north]=(iphi-0.5)*(np.pi/2)/iring
+    # Región ecuatorial
+    ip=pixels[equator]-ncap
+    tmp=ip//(4*nside)
+    iring=tmp+nside
+    iphi=ip-4*nside*tmp+1
+    fodd=np.where((iring+nside)&1,1.0,0.5)
+    z[equator]=(2*nside-iring)*2/(3*nside)
+    phi[equator]=(iphi-fodd)*np.pi/(2*nside)
+    # Casquete sur
+    ip=npix-pixels[south]
+    iring=(1+np.floor(np.sqrt(2*ip-1)).astype(np.int64))>>1
+    iphi=4*iring+1-(ip-2*iring*(iring-1))
+    z[south]=-1.0+iring*iring*4/npix
+    phi[south]=(iphi-0.5)*(np.pi/2)/iring
+    longitude=np.degrees(phi)
+    longitude[longitude>180]-=360 # El centro galáctico en el centro del mapa, igual que en 'read_catalog'
+    return longitude,np.degrees(np.arcsin(z))
+
+def healpix_zones(longitude,latitude,zone_size:float):
+    '''
+    Zonificación de igual área (HEALPix, esquema 'RING') con píxeles de lado aproximado 'zone_size'.
+
+    Retorno
+    -------
+    zone_id: Número de píxel (int64).
+    zone_lon: Longitud del centro del píxel de cada punto (º).
+    zone_lat: Latitud del centro del píxel de cada punto (º).
+    '''
+    longitude,latitude=finite_coordinates(longitude,latitude)
+    nside=healpix_nside(zone_size)
+    zone_id=healpix_ang2pix(nside,longitude,latitude)
+    zone_lon,zone_lat=healpix_pix2ang(nside,zone_id)
+    return zone_id,zone_lon,zone_lat
+
+ZONE_SCHEMES={'grid':grid_zones,'healpix':healpix_zones} # Esquemas de zonificación disponibles en 'add_coords_of_zone_center'
+
+@instrumented
+def add_coords_of_zone_center(polarization_data:pd.DataFrame,zone_size:float,csv_file=None,zone_scheme:str='grid'):
     '''
     Parametros
     ----------
     polarization_data: 'DataFrame' de 'pandas' con las columnas de datos de polarización. Debe contener las columnas "longitude", "latitude", "polarization", "angle", "polarization_error" y "angle_error".
     zone_size: Dimensión de las zonas en las que queremos dividir el mapa. Por ejemplo si 'zone_size'=3, se dividirá el mapa en zonas de 3°x3°.
     csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+    zone_scheme: Esquema de zonificación (ver 'ZONE_SCHEMES'). 'grid' divide el mapa en rectángulos de 'zone_size'x'zone_size' grados. 'healpix' usa píxeles de igual área con un lado aproximado de 'zone_size' grados, de forma que las zonas cercanas a los polos no tienen menos estrellas que las ecuatoriales.
     
     Retorno
     -------
-    El mismo 'DataFrame' de entrada a la función pero añadiendo las columnas 'zone_lon' y 'zone_lat' conteniendo los datos del centro de la zona a la que pertenece cada punto (fila). Este nuevo DataFrame se devuelve ordenado por zonas.
+    El mismo 'DataFrame' de entrada a la función pero añadiendo las columnas 'zone_lon' y 'zone_lat' conteniendo los datos del centro de la zona a la que pertenece cada punto (fila) y 'zone_id' con el número entero de la zona. Este nuevo DataFrame se devuelve ordenado por zonas.
     
     Ejemplo
     -------
@@ -394,83 +1604,815 @@ def add_coords_of_zone_center(polarization_data:pd.DataFrame,zone_size:float,csv
             └─────┘
      (-80,10)     (-70,10)
     '''
-    zone_lon_center=[]
-    zone_lat_center=[]
-    for n in range(len(polarization_data)):
-        '''
-        Los cuadrantes los identifico con dos valores, el primero (zone_lon_num) es el número de cuadrantes
-        que debo desplazarme en longitud (es decir en horizontal) para llegar al que contiene el punto.
-        El segundo (zone_lat_num), el número de cuadrantes que debo desplazarme en latitud (es decir
-        en vertical) para llegar al cuadrante que contiene el punto.
-        El primer cuadrante siempre es el número cero.
-        Si calculamos el resultado de las dos ecuaciones siguientes con nuestro ejemplo nos situamos en el
-        cuadrante n°3 si nos desplazamos en longitud (horizontalmente) y el n°1 si nos desplazamos en
-        latitud (verticalmente)
-        '''
-        zone_lon_num = int((polarization_data.loc[n,"longitude"]-(-180)) / zone_size) # '-180' es el valor de longitud mas pequeño posible.
-        zone_lat_num = int((polarization_data.loc[n,"latitude"]-(-90)) / zone_size) # '-90' es el valor de latitud mas pequeño posible.
-        
-        '''
-        Ahora tan solo tenemos que calcular cual es el centro de este cuadrante (zone).
-        En nuestro caso el centro del cuadrante (3,1) es el (-145,-75)
-        '''
-        zone_lon_center.append(zone_lon_num * zone_size + (-180) + zone_size / 2) # '-180' es el valor de longitud mas pequeño posible.
-        zone_lat_center.append(zone_lat_num * zone_size + (-90) + zone_size / 2) # '-90' es el valor de latitud mas pequeño posible.
-        
-    polarization_data['zone_lon']=zone_lon_center
-    polarization_data['zone_lat']=zone_lat_center
+    zone_id,zone_lon_center,zone_lat_center=ZONE_SCHEMES[zone_scheme](polarization_data['longitude'].to_numpy(),polarization_data['latitude'].to_numpy(),zone_size)
+    float_dtype=catalog_float_dtype(polarization_data) # Las nuevas columnas conservan el tipo del catálogo (ver 'compact_catalog')
+    polarization_data['zone_lon']=zone_lon_center.astype(float_dtype,copy=False)
+    polarization_data['zone_lat']=zone_lat_center.astype(float_dtype,copy=False)
+    polarization_data['zone_id']=zone_id.astype(label_dtype(zone_count(zone_size,zone_scheme)),copy=False) if is_compact(polarization_data) else zone_id
     csv_creator(polarization_data,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
-    return polarization_data.sort_values(['zone_lon','zone_lat'],ascending=[True,True],ignore_index=True)
+    order=np.argsort(zone_id,kind='stable') # Ordenamos por las claves enteras en lugar de por las parejas de coordenadas del centro
+    return polarization_data.take(order).reset_index(drop=True)
 
-def statistics_per_zone(polarization_data_with_zones:pd.DataFrame,sigma_limit:float,csv_file=None):
+BOOTSTRAP_BATCH_ROWS=2**22 # Filas remuestreadas por lote (remuestreos del lote por filas del catálogo) si no se indica 'batch_size'
+
+def bootstrap_batch(polarization,polarization_error,angle,angle_error,starts,sigma_limit:float,seed_sequences:list,backend:str='numpy'):
+    '''
+    Un lote de remuestreos 'bootstrap' de todas las zonas a la vez, uno por semilla de 'seed_sequences'. Cada remuestreo sustituye cada fila
+    por otra de su misma zona elegida al azar (con reemplazamiento), de modo que la matriz de índices (remuestreos, filas) conserva la ordenación
+    por zonas. Los remuestreos se ponen uno detrás de otro y se calculan con una sola llamada al motor por zonas (selección por sigmas y medias ponderadas).
+
+    Retorno:
+    --------
+    Estadísticos de las medias de los remuestreos del lote, un valor por zona, para combinarlos con los de otros lotes (ver 'combine_bootstrap'):
+    número de remuestreos, media y suma de cuadrados de las desviaciones de 'zone_pol' y de 'zone_ang'.
+    '''
+    rows_number=len(angle)
+    points=np.diff(np.append(starts,rows_number))
+    ids=segment_ids(starts,rows_number)
+    resamples=len(seed_sequences)
+    draws=np.empty((resamples,rows_number),dtype=np.int64) # Matriz de índices: la fila 'n' de cada remuestreo es una fila al azar de la zona de 'n'
+    for resample,seed_sequence in enumerate(seed_sequences): # Cada remuestreo con su propio generador: no depende de cómo se agrupen en lotes
+        draws[resample]=starts[ids]+np.random.default_rng(seed_sequence).integers(0,points[ids],size=rows_number)
+    batch_starts=(starts+rows_number*np.arange(resamples)[:,None]).ravel()
+    zone_pol,zone_ang=ZONE_KERNELS[backend](polarization[draws].ravel(),polarization_error[draws].ravel(),angle[draws].ravel(),angle_error[draws].ravel(),batch_starts,sigma_limit)[:2]
+    zone_pol=zone_pol.reshape(resamples,-1)
+    zone_ang=zone_ang.reshape(resamples,-1)
+    return (resamples,zone_pol.mean(axis=0),((zone_pol-zone_pol.mean(axis=0))**2).sum(axis=0),
+            zone_ang.mean(axis=0),((zone_ang-zone_ang.mean(axis=0))**2).sum(axis=0))
+
+def combine_bootstrap(first,second):
+    '''
+    Combina los estadísticos de dos lotes de 'bootstrap_batch' (fórmula de Chan et al., como en 'combine_zone_accumulators').
+    '''
+    if first is None:
+        return second
+    count=first[0]+second[0]
+    combined=[count]
+    for mean_position in (1,3):
+        delta=second[mean_position]-first[mean_position]
+        combined.append(first[mean_position]+delta*second[0]/count)
+        combined.append(first[mean_position+1]+second[mean_position+1]+delta**2*first[0]*second[0]/count)
+    return tuple(combined)
+
+bootstrap_arrays={} # Arrays de las zonas de cada proceso de 'bootstrap_zone_errors'
+
+def attach_bootstrap_arrays(arrays:tuple,starts):
+    '''
+    Inicialización de cada proceso de 'bootstrap_zone_errors': los arrays se envían una sola vez por proceso y no con cada lote.
+    '''
+    bootstrap_arrays['arrays']=arrays
+    bootstrap_arrays['starts']=starts
+
+def bootstrap_task(parameters:tuple):
+    '''
+    Ejecuta en un proceso un lote de 'bootstrap_zone_errors'.
+    '''
+    return bootstrap_batch(*bootstrap_arrays['arrays'],bootstrap_arrays['starts'],*parameters)
+
+def bootstrap_zone_errors(polarization,polarization_error,angle,angle_error,starts,sigma_limit:float,resamples:int=200,seed=None,batch_size:int=None,processes:int=1):
+    '''
+    Incertidumbre 'bootstrap' de la polarización y del ángulo de todas las zonas: desviación estándar de 'zone_pol' y 'zone_ang' calculados
+    con 'resamples' remuestreos de los puntos de cada zona, repitiendo en cada uno la selección por sigmas y las medias ponderadas.
+
+    Parametros:
+    -----------
+    polarization,polarization_error,angle,angle_error: Arrays de todas las zonas, con las filas de cada zona consecutivas.
+    starts: Posición de la primera fila de cada zona (ver 'zone_boundaries').
+    sigma_limit: Número de sigmas a partir del cual queremos despreciar los puntos.
+    resamples: Número de remuestreos (al menos 2).
+    seed: Semilla ('int' o 'np.random.SeedSequence'). Cada remuestreo usa su propia semilla derivada de esta, así que el resultado no depende
+          de 'batch_size' ni de 'processes' (salvo por el redondeo al combinar los lotes).
+    batch_size: Remuestreos por lote. La memoria usada es proporcional a 'batch_size' por el número de filas. Por defecto los que quepan en 'BOOTSTRAP_BATCH_ROWS' filas.
+    processes: Número de procesos entre los que se reparten los lotes. Con 'None' uno por procesador; con 1 se calculan en este proceso.
+
+    Retorno:
+    --------
+    zone_pol_err, zone_ang_err: Un valor por zona (0 en las zonas de un solo punto).
+    '''
+    if resamples<2:
+        raise ValueError(f'Número de remuestreos {resamples} no válido: deben ser al menos 2')
+    arrays=tuple(np.ascontiguousarray(array,dtype=np.float64) for array in (polarization,polarization_error,angle,angle_error))
+    starts=np.asarray(starts,dtype=np.int64)
+    if batch_size is None:
+        batch_size=max(1,BOOTSTRAP_BATCH_ROWS//max(len(arrays[2]),1))
+    batch_size=min(batch_size,resamples)
+    seed_sequence=seed if isinstance(seed,np.random.SeedSequence) else np.random.SeedSequence(seed)
+    children=seed_sequence.spawn(resamples)
+    tasks=[(sigma_limit,children[first:first+batch_size],KERNEL_OPTIONS['backend']) for first in range(0,resamples,batch_size)]
+    statistics=None
+    if processes==1 or len(tasks)==1:
+        for task in tasks:
+            statistics=combine_bootstrap(statistics,bootstrap_batch(*arrays,starts,*task))
+    else:
+        with ProcessPoolExecutor(max_workers=processes,initializer=attach_bootstrap_arrays,initargs=(arrays,starts)) as executor:
+            for batch in executor.map(bootstrap_task,tasks):
+                statistics=combine_bootstrap(statistics,batch)
+    single=np.diff(np.append(starts,len(arrays[2])))==1 # Zonas de un solo punto: todos los remuestreos son iguales
+    return (np.where(single,0.0,np.sqrt(statistics[2]/(resamples-1))),
+            np.where(single,0.0,np.sqrt(statistics[4]/(resamples-1)))) # Desviación estándar muestral de los remuestreos
+
+@instrumented
+def statistics_per_zone(polarization_data_with_zones:pd.DataFrame,sigma_limit:float,csv_file=None,bootstrap:int=0,seed=None,batch_size:int=None,processes:int=1):
     '''
     Parametros
     ----------
-    polarization_data_with_zones: 'DataFrame' de 'pandas'. Debe contener la longitud (zone_lon) y la latitud (zone_lat) del centro de la zona a la que pertenece cada punto. Asimismo las filas deben estar ordenadas primero por 'zone_lon' y segundo por 'zone_lat'.
+    polarization_data_with_zones: 'DataFrame' de 'pandas'. Debe contener la longitud (zone_lon) y la latitud (zone_lat) del centro de la zona a la que pertenece cada punto. Asimismo las filas deben estar ordenadas primero por 'zone_lon' y segundo por 'zone_lat'. Si contiene la columna 'zone_id' (ver 'add_coords_of_zone_center') las zonas se identifican por este número entero y basta con que las filas estén ordenadas por él.
     sigma_limit: Número de sigmas a partir del cual queremos despreciar los puntos.
     csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+    bootstrap: Número de remuestreos 'bootstrap' para estimar la incertidumbre de cada zona (ver 'bootstrap_zone_errors'). Con 0 no se calcula.
+    seed, batch_size, processes: Semilla, remuestreos por lote y número de procesos del 'bootstrap'.
     
     Retorno
     -------
-    'DataFrame' con los centros de cada zona ('zone_lon', 'zone_lat'), su porcentaje y ángulo de polarización ('zone_pol', 'zone_ang') y los puntos por zona antes y después de la seleccion por número de sigmas ('points_before', 'points_after').
-    '''
-    polarization_dataxzone=pd.DataFrame() # DataFrame vacio
-    polxzone=[polarization_data_with_zones.loc[0,'polarization']] # iniciamos los vectores de acumulacion con el primer valor de la primera zona
-    pol_errxzone=[polarization_data_with_zones.loc[0,'polarization_error']]
-    angxzone=[polarization_data_with_zones.loc[0,'angle']] 
-    ang_errxzone=[polarization_data_with_zones.loc[0,'angle_error']]
-    current_longitude=polarization_data_with_zones.loc[0,'zone_lon']
-    current_latitude=polarization_data_with_zones.loc[0,'zone_lat']
-    for n in range(1,len(polarization_data_with_zones)): # Puesto que ya hemos inicializado los vectores de acumulación con el primer valor, empezamos desde el segundo (el 1).
-        if polarization_data_with_zones.loc[n,'zone_lon']==current_longitude and polarization_data_with_zones.loc[n,'zone_lat']==current_latitude:
-            polxzone.append(polarization_data_with_zones.loc[n,'polarization']) # Añadimos al vector 'polxzone' un nuevo valor de la zona en estudio
-            pol_errxzone.append(polarization_data_with_zones.loc[n,'polarization_error']) # Añadimos al vector 'pol_errxzone' un nuevo valor de la zona en estudio
-            angxzone.append(polarization_data_with_zones.loc[n,'angle']) # Añadimos al vector 'angxzone' un nuevo valor de la zona en estudio
-            ang_errxzone.append(polarization_data_with_zones.loc[n,'angle_error']) # Añadimos al vector 'ang_errxzone' un nuevo valor de la zona en estudio
+    'DataFrame' con los centros de cada zona ('zone_lon', 'zone_lat'), su porcentaje y ángulo de polarización ('zone_pol', 'zone_ang') y los puntos por zona antes y después de la seleccion por número de sigmas ('points_before', 'points_after'), más 'zone_id' si la entrada la contiene.
+    Con 'bootstrap' añade la incertidumbre de la polarización y del ángulo ('zone_pol_err', 'zone_ang_err').
+    '''
+    zone_lon=polarization_data_with_zones['zone_lon'].to_numpy()
+    zone_lat=polarization_data_with_zones['zone_lat'].to_numpy()
+    polarization=polarization_data_with_zones['polarization'].to_numpy(dtype=float)
+    polarization_error=polarization_data_with_zones['polarization_error'].to_numpy(dtype=float)
+    angle=polarization_data_with_zones['angle'].to_numpy(dtype=float)
+    angle_error=polarization_data_with_zones['angle_error'].to_numpy(dtype=float)
+    if 'zone_id' in polarization_data_with_zones.columns:
+        zone_id=polarization_data_with_zones['zone_id'].to_numpy()
+        starts=zone_boundaries(zone_id) # Primera fila de cada zona. Todas las zonas se calculan a la vez mediante reducciones por segmentos.
+    else:
+        zone_id=None
+        starts=zone_boundaries(zone_lon,zone_lat)
+    if len(starts)==0:
+        polarization_dataxzone=pd.DataFrame({'zone_lon':[],'zone_lat':[],'zone_pol':[],'zone_ang':[],'points_before':np.zeros(0,dtype=np.int64),'points_after':np.zeros(0,dtype=np.int64)})
+    else:
+        zone_pol,zone_ang,points_after=ZONE_KERNELS[KERNEL_OPTIONS['backend']](polarization,polarization_error,angle,angle_error,starts,sigma_limit) # Eliminamos los puntos que tengan un angulo fuera del limite de sigmas establecido y calculamos las medias
+        polarization_dataxzone=pd.DataFrame({'zone_lon':zone_lon[starts],
+                                             'zone_lat':zone_lat[starts],
+                                             'zone_pol':zone_pol,
+                                             'zone_ang':zone_ang,
+                                             'points_before':np.diff(np.append(starts,len(angle))),
+                                             'points_after':points_after})
+    if bootstrap:
+        if len(starts):
+            zone_pol_err,zone_ang_err=bootstrap_zone_errors(polarization,polarization_error,angle,angle_error,starts,sigma_limit,bootstrap,seed,batch_size,processes)
         else:
-            points_before=len(polxzone)
-            polxzone,pol_errxzone,angxzone,ang_errxzone=outliers_by_sigma(polxzone,pol_errxzone,angxzone,ang_errxzone,sigma_limit) # Eliminamos los puntos que tengan un angulo fuera del limite de sigmas establecido
-            points_after=len(polxzone)
-            average_polarizationxzone=weighted_average(polxzone,pol_errxzone) # Hemos encontrado el primer punto de una nueva zona por lo que calculamos las medias de los valores encontrados en la zona anterior
-            average_anglexzone=weighted_average(angxzone,ang_errxzone)
-            new_zone=pd.DataFrame({'zone_lon':[current_longitude],'zone_lat':[current_latitude],'zone_pol':[average_polarizationxzone],'zone_ang':[average_anglexzone],'points_before':[points_before],'points_after':[points_after]})
-            polarization_dataxzone=pd.concat([polarization_dataxzone,new_zone]) # Añadimos los valores encontrados para la zona anterior al DataFrame 'polarization_dataxzone'
-            polxzone=[polarization_data_with_zones.loc[n,'polarization']] # iniciamos de nuevo los vectores de acumulacion con el primer valor de esta nueva zona
-            pol_errxzone=[polarization_data_with_zones.loc[n,'polarization_error']]
-            angxzone=[polarization_data_with_zones.loc[n,'angle']] 
-            ang_errxzone=[polarization_data_with_zones.loc[n,'angle_error']]
-            current_longitude=polarization_data_with_zones.loc[n,'zone_lon'] # Nueva posición para la nueva zona
-            current_latitude=polarization_data_with_zones.loc[n,'zone_lat']
-    
-    polxzone,pol_errxzone,angxzone,ang_errxzone=outliers_by_sigma(polxzone,pol_errxzone,angxzone,ang_errxzone,sigma_limit) # Eliminamos los puntos que tengan un angulo fuera del limite de sigmas establecido
-    average_polarizationxzone=weighted_average(polxzone,pol_errxzone) # Hemos encontrado el primer punto de una nueva zona por lo que calculamos las medias de los valores encontrados en la zona anterior
-    average_anglexzone=weighted_average(angxzone,ang_errxzone)
-    new_zone=pd.DataFrame({'zone_lon':[current_longitude],'zone_lat':[current_latitude],'zone_pol':[average_polarizationxzone],'zone_ang':[average_anglexzone],'points_before':[points_before],'points_after':[points_after]})
-    polarization_dataxzone=pd.concat([polarization_dataxzone,new_zone]) # Añadimos los valores encontrados para la zona anterior al DataFrame 'polarization_dataxzone'
-    polarization_dataxzone=polarization_dataxzone.reset_index(drop=True)
+            zone_pol_err=zone_ang_err=np.zeros(0)
+        polarization_dataxzone.insert(4,'zone_pol_err',zone_pol_err)
+        polarization_dataxzone.insert(5,'zone_ang_err',zone_ang_err)
+    if zone_id is not None:
+        polarization_dataxzone['zone_id']=zone_id[starts] if len(starts) else np.zeros(0,dtype=np.int64)
     csv_creator(polarization_dataxzone,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.        
     return polarization_dataxzone
 
+def stokes_parameters(polarization,angle):
+    '''
+    Parámetros de Stokes normalizados (Q, U) de cada punto a partir de su porcentaje y ángulo de polarización (º).
+    A diferencia de los ángulos, Q y U se pueden promediar directamente: dos ángulos de 1º y 179º dan un ángulo medio de 0º y no de 90º.
+    '''
+    polarization=np.asarray(polarization,dtype=float)
+    double_angle=np.radians(2*np.asarray(angle,dtype=float))
+    return polarization*np.cos(double_angle),polarization*np.sin(double_angle)
+
+def gaussian_kernel_spectrum(length:int,sigma:float,truncate:float=4.0,axis_length:int=None):
+    '''
+    Transformada de Fourier de un núcleo gaussiano circular de 'length' píxeles (valor 1 en el centro, cero a más de 'truncate' sigmas).
+    Si se indica 'axis_length' la transformada es la de 'rfft' (eje de longitud); si no, la de 'fft' (eje de latitud).
+    '''
+    distance=np.minimum(np.arange(length),length-np.arange(length))
+    kernel=np.where(distance<=truncate*sigma,np.exp(-0.5*(distance/sigma)**2),0.0) if sigma>0 else (distance==0).astype(float)
+    return np.fft.rfft(kernel).real if axis_length is not None else np.fft.fft(kernel).real # El núcleo es simétrico: su transformada es real
+
+@instrumented
+def stokes_field_map(polarization_data:pd.DataFrame,pixel_size:float=1.0,smoothing:float=3.0,min_points:float=1.0,csv_file=None):
+    '''
+    Mapa continuo del campo de polarización. Cada punto se convierte en sus parámetros de Stokes (Q, U), que se acumulan en una rejilla
+    regular de 'pixel_size' grados ponderados por la inversa del error de la polarización (igual que en 'weighted_average'). Las rejillas se
+    suavizan con un núcleo gaussiano mediante la transformada de Fourier (periódica en longitud y con relleno de ceros en latitud) y se
+    normalizan por la rejilla de pesos suavizada (convolución normalizada). El porcentaje y el ángulo de cada píxel se obtienen de Q y U.
+    El coste del suavizado depende del tamaño de la rejilla y no del número de puntos.
+
+    Parametros:
+    -----------
+    polarization_data: DataFrame con las columnas 'longitude','latitude','polarization','angle' y 'polarization_error'.
+    pixel_size: Lado de los píxeles (º). 180 debe ser múltiplo de 'pixel_size'.
+    smoothing: Sigma del núcleo gaussiano (º, medido en longitud y latitud como en el mapa cartesiano). Con 0 no se suaviza.
+    min_points: Solo se devuelven los píxeles con al menos este número efectivo de puntos cercanos ('points_before').
+    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+
+    Retorno:
+    --------
+    'DataFrame' con las mismas columnas que 'statistics_per_zone' para que lo dibujen los mismos gráficos con 'zone_size' igual a 'pixel_size':
+    centro del píxel ('zone_lon', 'zone_lat'), porcentaje y ángulo de polarización ('zone_pol', 'zone_ang'), número efectivo de puntos
+    (suma de los puntos ponderados por el núcleo, que vale 1 en el centro) en 'points_before' y 'points_after', y 'zone_id' del esquema 'grid'.
+    '''
+    lon_pixels=int(round(360/pixel_size))
+    lat_pixels=int(round(180/pixel_size))
+    if not np.isclose(lat_pixels*pixel_size,180):
+        raise ValueError(f'El tamaño de píxel {pixel_size} no es un divisor de 180º')
+    longitude=polarization_data['longitude'].to_numpy(dtype=float)
+    latitude=polarization_data['latitude'].to_numpy(dtype=float)
+    polarization_error=polarization_data['polarization_error'].to_numpy(dtype=float)
+    stokes_q,stokes_u=stokes_parameters(polarization_data['polarization'].to_numpy(),polarization_data['angle'].to_numpy())
+    valid=np.isfinite(longitude)&np.isfinite(latitude)&np.isfinite(stokes_q)
+    replacement=max(polarization_error[valid].max(initial=0.0),0.01)
+    weights=np.reciprocal(np.where(polarization_error>0.0,polarization_error,replacement))[valid] # Tolerancias <=0 sustituidas por la máxima, como en 'weighted_average'
+    pixel=(np.clip(np.floor((latitude[valid]+90)/pixel_size),0,lat_pixels-1).astype(np.int64)*lon_pixels+
+           np.clip(np.floor((longitude[valid]+180)/pixel_size),0,lon_pixels-1).astype(np.int64))
+    grids=np.stack([np.bincount(pixel,grid_weights,minlength=lat_pixels*lon_pixels).reshape(lat_pixels,lon_pixels)
+                    for grid_weights in (weights,weights*stokes_q[valid],weights*stokes_u[valid],np.ones(len(pixel)))]) # Pesos, Q y U ponderados y número de puntos
+    sigma=smoothing/pixel_size
+    padded_lat=lat_pixels+int(np.ceil(4.0*sigma)) # Relleno en latitud para que el suavizado no pase de un polo al otro
+    spectrum=gaussian_kernel_spectrum(padded_lat,sigma)[:,None]*gaussian_kernel_spectrum(lon_pixels,sigma,axis_length=lon_pixels)[None,:]
+    grids=np.fft.irfft2(np.fft.rfft2(grids,s=(padded_lat,lon_pixels))*spectrum,s=(padded_lat,lon_pixels))[:,:lat_pixels]
+    weight_grid,q_grid,u_grid,points_grid=grids
+    lat_index,lon_index=np.nonzero((points_grid>=min_points-1e-9)&(weight_grid>1e-12*weight_grid.max(initial=0.0))) # Los píxeles vacíos no valen exactamente 0 tras la transformada
+    stokes_q=q_grid[lat_index,lon_index]/weight_grid[lat_index,lon_index]
+    stokes_u=u_grid[lat_index,lon_index]/weight_grid[lat_index,lon_index]
+    order=np.lexsort((lat_index,lon_index)) # Mismo orden que las zonas de 'statistics_per_zone' ('zone_id' creciente)
+    lat_index,lon_index=lat_index[order],lon_index[order]
+    field=pd.DataFrame({'zone_lon':lon_index*pixel_size-180+pixel_size/2,
+                        'zone_lat':lat_index*pixel_size-90+pixel_size/2,
+                        'zone_pol':np.hypot(stokes_q,stokes_u)[order],
+                        'zone_ang':np.mod(np.degrees(0.5*np.arctan2(stokes_u,stokes_q)),180)[order],
+                        'points_before':points_grid[lat_index,lon_index],
+                        'points_after':points_grid[lat_index,lon_index],
+                        'zone_id':lon_index*(int(180/pixel_size)+1)+lat_index}) # Numeración de 'add_coords_of_zone_center' con el esquema 'grid'
+    csv_creator(field,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
+    return field
+
+shared_catalog={} # Catálogo compartido de cada proceso de 'zone_parameter_sweep'
+
+def attach_shared_catalog(memory_name:str,shape:tuple,dtype:str):
+    '''
+    Inicialización de cada proceso de 'zone_parameter_sweep': se conecta a la memoria compartida que contiene el catálogo
+    y crea un DataFrame de solo lectura sobre ella, sin copiar los datos.
+    '''
+    memory=shared_memory.SharedMemory(name=memory_name)
+    columns=np.ndarray(shape,dtype=dtype,buffer=memory.buf) # Array (columnas, filas): cada columna es contigua en memoria
+    columns.flags.writeable=False
+    shared_catalog['memory']=memory # Mantenemos la referencia para que no se libere la memoria compartida
+    shared_catalog['data']=pd.DataFrame(columns.T,columns=CATALOG_COLUMNS,copy=False)
+
+def zone_sweep_task(parameters:dict):
+    '''
+    Ejecuta en un proceso la cadena de recortes, zonificación y estadística por zonas con una combinación de parámetros de 'zone_parameter_sweep'.
+    '''
+    polarization_data=shared_catalog['data']
+    mask=cutout_mask(polarization_data,parameters['lon_min'],parameters['lon_max'],parameters['lat_min'],parameters['lat_max'],parameters['pol_min'],parameters['ang_err_max'],positive_error=True)
+    polarization_data=apply_mask(polarization_data,mask)
+    polarization_data=add_coords_of_zone_center(polarization_data,parameters['zone_size'],zone_scheme=parameters['zone_scheme'])
+    polarizationxzones=statistics_per_zone(polarization_data,parameters['sigma_limit'])
+    for position,name in enumerate(['zone_size','sigma_limit','pol_min','ang_err_max']):
+        polarizationxzones.insert(position,name,parameters[name])
+    return polarizationxzones
+
+@instrumented
+def zone_parameter_sweep(polarization_data:pd.DataFrame,zone_sizes:list,sigma_limits:list,pol_mins:list,ang_err_maxs:list,lon_min:float=-180,lon_max:float=180,lat_min:float=-90,lat_max:float=90,zone_scheme:str='grid',processes:int=None,csv_file=None):
+    '''
+    Calcula la polarización por zonas para todas las combinaciones de parámetros repartiéndolas entre varios procesos.
+    El catálogo se copia una sola vez a memoria compartida y todos los procesos lo leen de allí, sin enviar una copia a cada uno.
+
+    Parametros:
+    -----------
+    polarization_data: DataFrame del catálogo leído con 'read_catalog'.
+    zone_sizes: Lista de tamaños de zona.
+    sigma_limits: Lista de números de sigmas.
+    pol_mins: Lista de porcentajes de polarización mínimos.
+    ang_err_maxs: Lista de errores de ángulo máximos.
+    lon_min, lon_max, lat_min, lat_max: Recorte espacial común a todas las combinaciones.
+    zone_scheme: Esquema de zonificación (ver 'add_coords_of_zone_center').
+    processes: Número de procesos. Por defecto tantos como procesadores.
+    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+
+    Retorno:
+    --------
+    Un solo DataFrame con el resultado de 'statistics_per_zone' de todas las combinaciones, precedido por las columnas 'zone_size', 'sigma_limit', 'pol_min' y 'ang_err_max' de la combinación.
+    '''
+    columns=np.vstack([polarization_data[name].to_numpy(dtype=float) for name in CATALOG_COLUMNS])
+    memory=shared_memory.SharedMemory(create=True,size=max(columns.nbytes,1))
+    try:
+        np.ndarray(columns.shape,dtype=columns.dtype,buffer=memory.buf)[:]=columns
+        del columns
+        tasks=[{'zone_size':zone_size,'sigma_limit':sigma_limit,'pol_min':pol_min,'ang_err_max':ang_err_max,'zone_scheme':zone_scheme,
+                'lon_min':lon_min,'lon_max':lon_max,'lat_min':lat_min,'lat_max':lat_max}
+               for zone_size in zone_sizes for sigma_limit in sigma_limits for pol_min in pol_mins for ang_err_max in ang_err_maxs]
+        with ProcessPoolExecutor(max_workers=processes,initializer=attach_shared_catalog,initargs=(memory.name,(len(CATALOG_COLUMNS),len(polarization_data)),'float64')) as executor:
+            results=list(executor.map(zone_sweep_task,tasks))
+    finally:
+        memory.close()
+        memory.unlink()
+    sweep_results=pd.concat(results,ignore_index=True)
+    csv_creator(sweep_results,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
+    return sweep_results
+
+def zone_count(zone_size:float,zone_scheme:str='grid'):
+    '''
+    Número de zonas posibles del esquema 'zone_scheme' (los 'zone_id' van de 0 a este número menos 1).
+    '''
+    if zone_scheme=='healpix':
+        return 12*healpix_nside(zone_size)**2
+    return (int(360/zone_size)+1)*(int(180/zone_size)+1)
+
+def zone_centers(zone_id,zone_size:float,zone_scheme:str='grid'):
+    '''
+    Coordenadas del centro de las zonas a partir de su número 'zone_id' (ver 'add_coords_of_zone_center').
+
+    Retorno:
+    --------
+    zone_lon, zone_lat: Longitud y latitud del centro de cada zona (º).
+    '''
+    zone_id=np.asarray(zone_id,dtype=np.int64)
+    if zone_scheme=='healpix':
+        return healpix_pix2ang(healpix_nside(zone_size),zone_id)
+    lat_zones=int(180/zone_size)+1
+    return (zone_id//lat_zones)*zone_size+(-180)+zone_size/2,(zone_id%lat_zones)*zone_size+(-90)+zone_size/2
+
+ACCUMULATOR_FIELDS={'points':'sum','angle_mean':'mean','angle_m2':'m2',
+                    'pol_sum_weights':'sum','pol_sum_values':'sum','pol_nonpositive':'sum','pol_sum_nonpositive':'sum','pol_max_tolerance':'max',
+                    'ang_sum_weights':'sum','ang_sum_values':'sum','ang_nonpositive':'sum','ang_sum_nonpositive':'sum','ang_max_tolerance':'max'} # Campos de los acumuladores por zona y cómo se combinan
+
+def zone_accumulators(zone_id,polarization,polarization_error,angle,angle_error,keep=None):
+    '''
+    Estadísticos suficientes por zona de un grupo de puntos. Se pueden combinar con los de otros grupos ('combine_zone_accumulators')
+    y con ellos se obtienen las mismas medias que con 'weighted_average' y la misma desviación estándar que con 'np.std'.
+
+    Parametros:
+    -----------
+    zone_id: Número de zona de cada punto.
+    polarization,polarization_error,angle,angle_error: Valores de cada punto.
+    keep: Array booleano opcional. Solo se acumulan los puntos con valor 'True'.
+
+    Retorno:
+    --------
+    Diccionario de arrays, uno por campo de 'ACCUMULATOR_FIELDS' más 'zone_id', con una posición por zona ordenadas por 'zone_id':
+     - 'points', 'angle_mean', 'angle_m2': número de puntos, media y suma de cuadrados de las desviaciones del ángulo.
+     - '<pol/ang>_sum_weights', '<pol/ang>_sum_values': sumas de 1/tolerancia y valor/tolerancia de los puntos con tolerancia positiva.
+     - '<pol/ang>_nonpositive', '<pol/ang>_sum_nonpositive': número y suma de valores de los puntos con tolerancia <=0.
+     - '<pol/ang>_max_tolerance': tolerancia máxima.
+    '''
+    if keep is not None:
+        zone_id,polarization,polarization_error,angle,angle_error=[np.asarray(column)[keep] for column in (zone_id,polarization,polarization_error,angle,angle_error)]
+    rows={'zone_id':np.asarray(zone_id,dtype=np.int64),'points':np.ones(len(zone_id)),'angle_mean':np.asarray(angle,dtype=float),'angle_m2':np.zeros(len(zone_id))} # Cada punto es un acumulador de un solo punto
+    for prefix,values,tolerances in (('pol',polarization,polarization_error),('ang',angle,angle_error)):
+        values=np.asarray(values,dtype=float)
+        tolerances=np.asarray(tolerances,dtype=float)
+        positive=tolerances>0.0
+        inv_tol=np.where(positive,1.0/np.where(positive,tolerances,1.0),0.0)
+        rows[prefix+'_sum_weights']=inv_tol
+        rows[prefix+'_sum_values']=inv_tol*values
+        rows[prefix+'_nonpositive']=(~positive).astype(float)
+        rows[prefix+'_sum_nonpositive']=np.where(positive,0.0,values)
+        rows[prefix+'_max_tolerance']=tolerances
+    return combine_zone_accumulators(rows)
+
+def combine_zone_accumulators(accumulators,zone_id=None):
+    '''
+    Combina acumuladores por zona.
+
+    Parametros:
+    -----------
+    accumulators: Un diccionario de acumuladores (ver 'zone_accumulators') o una lista de ellos, por ejemplo los de varios bloques del catálogo.
+    zone_id: Si se indica, número de zona nuevo de cada posición (por ejemplo la zona de menor resolución que contiene a cada zona).
+             Por defecto se combinan las posiciones con el mismo 'zone_id'.
+
+    Retorno:
+    --------
+    Diccionario de acumuladores con una posición por zona, ordenadas por 'zone_id'.
+    '''
+    if isinstance(accumulators,(list,tuple)):
+        accumulators={name:np.concatenate([accumulator[name] for accumulator in accumulators]) for name in ['zone_id']+list(ACCUMULATOR_FIELDS)}
+    if zone_id is None:
+        zone_id=accumulators['zone_id']
+    order=np.argsort(zone_id,kind='stable')
+    zone_id=np.asarray(zone_id,dtype=np.int64)[order]
+    starts=zone_boundaries(zone_id)
+    if len(starts)==0:
+        return {name:accumulators[name][:0] for name in ['zone_id']+list(ACCUMULATOR_FIELDS)}
+    ids=segment_ids(starts,len(zone_id))
+    points=accumulators['points'][order]
+    angle_mean=accumulators['angle_mean'][order]
+    combined={'zone_id':zone_id[starts]}
+    combined['points']=np.add.reduceat(points,starts)
+    combined['angle_mean']=np.add.reduceat(points*angle_mean,starts)/combined['points']
+    combined['angle_m2']=np.add.reduceat(accumulators['angle_m2'][order]+points*(angle_mean-combined['angle_mean'][ids])**2,starts) # Combinación de varianzas de Chan et al.
+    for name,reduction in ACCUMULATOR_FIELDS.items():
+        if reduction=='sum' and name!='points':
+            combined[name]=np.add.reduceat(accumulators[name][order],starts)
+        elif reduction=='max':
+            combined[name]=np.maximum.reduceat(accumulators[name][order],starts)
+    return combined
+
+def accumulator_weighted_average(accumulators,prefix:str):
+    '''
+    Media ponderada por zona ('prefix' es 'pol' o 'ang') a partir de los acumuladores, igual que 'weighted_average':
+    las tolerancias inferiores o iguales a 0 se igualan a la máxima tolerancia de la zona (0.01 si esta no es positiva).
+    '''
+    replacement=np.maximum(accumulators[prefix+'_max_tolerance'],0.01)
+    return (accumulators[prefix+'_sum_values']+accumulators[prefix+'_sum_nonpositive']/replacement)/(accumulators[prefix+'_sum_weights']+accumulators[prefix+'_nonpositive']/replacement)
+
+def sigma_window(accumulators,sigma_limit:float):
+    '''
+    Límites de ángulo de la selección por número de sigmas de cada zona (ver 'outliers_by_sigma').
+
+    Retorno:
+    --------
+    angle_min, angle_max: Límites de cada zona.
+    keep_all: 'True' en las zonas con desviación estándar cero, en las que se conservan todos los puntos.
+    '''
+    angle_average=accumulator_weighted_average(accumulators,'ang')
+    angle_sigma=np.sqrt(accumulators['angle_m2']/accumulators['points'])
+    return angle_average-angle_sigma*sigma_limit,angle_average+angle_sigma*sigma_limit,angle_sigma==0
+
+def zone_statistics_table(all_points,kept_points,zone_size:float,zone_scheme:str='grid'):
+    '''
+    Tabla de 'statistics_per_zone' a partir de los acumuladores de todos los puntos y de los puntos que quedan tras la selección por sigmas.
+    En las zonas en las que no queda ningún punto se usan todos, igual que en 'outliers_by_sigma'.
+    '''
+    position=np.searchsorted(kept_points['zone_id'],all_points['zone_id'])
+    found=position<len(kept_points['zone_id'])
+    found[found]=kept_points['zone_id'][position[found]]==all_points['zone_id'][found]
+    chosen={}
+    for name in ACCUMULATOR_FIELDS:
+        chosen[name]=all_points[name].copy()
+        chosen[name][found]=kept_points[name][position[found]]
+    zone_lon,zone_lat=zone_centers(all_points['zone_id'],zone_size,zone_scheme)
+    return pd.DataFrame({'zone_lon':zone_lon,'zone_lat':zone_lat,
+                         'zone_pol':accumulator_weighted_average(chosen,'pol'),
+                         'zone_ang':accumulator_weighted_average(chosen,'ang'),
+                         'points_before':all_points['points'].astype(np.int64),
+                         'points_after':chosen['points'].astype(np.int64),
+                         'zone_id':all_points['zone_id']})
+
+@instrumented
+def streaming_statistics_per_zone(chunks,zone_size:float,sigma_limit:float,lon_min:float=-180,lon_max:float=180,lat_min:float=-90,lat_max:float=90,pol_min:float=None,ang_err_max:float=None,zone_scheme:str='grid',csv_file=None):
+    '''
+    Calcula la tabla de 'statistics_per_zone' leyendo el catálogo por bloques, para catálogos que no caben en memoria.
+    Cada bloque pasa por los recortes y la zonificación, y sus estadísticos suficientes por zona se combinan con los de los bloques anteriores.
+    La memoria usada depende del tamaño del bloque y del número de zonas, no del tamaño del catálogo.
+    Se hacen dos pasadas sobre los bloques: la primera obtiene la media y la desviación estándar de cada zona y la segunda acumula los puntos
+    que quedan dentro del número de sigmas.
+
+    Parametros:
+    -----------
+    chunks: Función sin parámetros que devuelve un iterador nuevo de bloques cada vez que se llama, por ejemplo 'lambda: read_catalog_chunks(url)'.
+    zone_size: Dimensión de las zonas (ver 'add_coords_of_zone_center').
+    sigma_limit: Número de sigmas a partir del cual queremos despreciar los puntos.
+    lon_min, lon_max, lat_min, lat_max: Recorte espacial (ver 'space_cutout').
+    pol_min, ang_err_max: Recorte de valores (ver 'values_cutout'). Como en 'values_cutout', solo se usan los puntos con error de ángulo positivo.
+    zone_scheme: Esquema de zonificación (ver 'add_coords_of_zone_center').
+    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+
+    Retorno:
+    --------
+    El mismo DataFrame que 'statistics_per_zone' aplicada a 'add_coords_of_zone_center' del catálogo completo recortado.
+    '''
+    def selected_chunks():
+        for chunk in chunks():
+            mask=cutout_mask(chunk,lon_min,lon_max,lat_min,lat_max,pol_min,ang_err_max,positive_error=True)
+            zone_id,zone_lon,zone_lat=ZONE_SCHEMES[zone_scheme](chunk['longitude'].to_numpy()[mask],chunk['latitude'].to_numpy()[mask],zone_size)
+            yield zone_id,[chunk[name].to_numpy(dtype=float)[mask] for name in ['polarization','polarization_error','angle','angle_error']]
+
+    all_points=zone_accumulators(*[np.zeros(0)]*5)
+    for zone_id,columns in selected_chunks(): # Primera pasada: todos los puntos
+        all_points=combine_zone_accumulators([all_points,zone_accumulators(zone_id,*columns)])
+    angle_min,angle_max,keep_all=sigma_window(all_points,sigma_limit)
+    kept_points=zone_accumulators(*[np.zeros(0)]*5)
+    for zone_id,columns in selected_chunks(): # Segunda pasada: puntos dentro del número de sigmas
+        position=np.searchsorted(all_points['zone_id'],zone_id)
+        angle=columns[2]
+        keep=((angle>=angle_min[position])&(angle<=angle_max[position]))|keep_all[position]
+        kept_points=combine_zone_accumulators([kept_points,zone_accumulators(zone_id,*columns,keep=keep)])
+    polarization_dataxzone=zone_statistics_table(all_points,kept_points,zone_size,zone_scheme)
+    csv_creator(polarization_dataxzone,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
+    return polarization_dataxzone
+
+def grid_parent_zones(zone_id,zone_size:float,parent_size:float):
+    '''
+    Número de la zona de tamaño 'parent_size' (rejilla 'grid') que contiene a cada zona de tamaño 'zone_size'.
+    'parent_size' debe ser un múltiplo entero de 'zone_size'.
+    '''
+    factor=int(round(parent_size/zone_size))
+    if factor<1 or abs(factor*zone_size-parent_size)>1e-9*parent_size:
+        raise ValueError(f'El tamaño de zona {parent_size} no es un múltiplo entero de {zone_size}')
+    zone_id=np.asarray(zone_id,dtype=np.int64)
+    lat_zones=int(180/zone_size)+1
+    return (zone_id//lat_zones//factor)*(int(180/parent_size)+1)+(zone_id%lat_zones)//factor
+
+@instrumented
+def zone_pyramid(polarization_data:pd.DataFrame,zone_sizes,sigma_limit:float):
+    '''
+    Calcula la tabla de 'statistics_per_zone' para varios tamaños de zona (rejilla 'grid') asignando cada punto una sola vez a la zona más pequeña.
+    Las zonas grandes se obtienen combinando los acumuladores de sus zonas hijas (ver 'combine_zone_accumulators') y para cada nivel
+    solo se repite la selección por sigmas, sobre los puntos ya ordenados por zona fina.
+
+    Parametros:
+    -----------
+    polarization_data: DataFrame del catálogo, ya recortado.
+    zone_sizes: Lista de tamaños de zona (º). Todos deben ser múltiplos enteros del más pequeño (por ejemplo 1, 2, 3 y 6).
+    sigma_limit: Número de sigmas a partir del cual queremos despreciar los puntos.
+
+    Retorno:
+    --------
+    Diccionario con 'sigma_limit' y 'levels', un diccionario cuya clave es el tamaño de zona y su valor la tabla de estadísticas por zona.
+    Ver 'pyramid_level' para leer un nivel o una región del cielo.
+    '''
+    zone_sizes=sorted(set(zone_sizes))
+    finest=zone_sizes[0]
+    for zone_size in zone_sizes:
+        grid_parent_zones(np.zeros(0),finest,zone_size) # Comprueba que los tamaños son múltiplos del más pequeño
+    zone_id,zone_lon,zone_lat=grid_zones(polarization_data['longitude'].to_numpy(),polarization_data['latitude'].to_numpy(),finest)
+    order=np.argsort(zone_id,kind='stable')
+    zone_id=zone_id[order]
+    columns=[polarization_data[name].to_numpy(dtype=float)[order] for name in ['polarization','polarization_error','angle','angle_error']]
+    fine_points=zone_accumulators(zone_id,*columns)
+    fine_position=segment_ids(zone_boundaries(zone_id),len(zone_id)) # Posición de la zona fina de cada punto
+    levels={}
+    for zone_size in zone_sizes:
+        parent_id=grid_parent_zones(fine_points['zone_id'],finest,zone_size)
+        all_points=combine_zone_accumulators(fine_points,parent_id)
+        angle_min,angle_max,keep_all=sigma_window(all_points,sigma_limit)
+        position=np.searchsorted(all_points['zone_id'],parent_id)[fine_position] # Posición de la zona de este nivel de cada punto
+        angle=columns[2]
+        keep=((angle>=angle_min[position])&(angle<=angle_max[position]))|keep_all[position]
+        kept_fine=zone_accumulators(zone_id,*columns,keep=keep)
+        kept_points=combine_zone_accumulators(kept_fine,grid_parent_zones(kept_fine['zone_id'],finest,zone_size))
+        levels[zone_size]=zone_statistics_table(all_points,kept_points,zone_size)
+    return {'sigma_limit':sigma_limit,'levels':levels}
+
+def pyramid_level(pyramid:dict,zone_size:float=None,lon_min:float=-180,lon_max:float=180,lat_min:float=-90,lat_max:float=90,csv_file=None):
+    '''
+    Devuelve un nivel de 'zone_pyramid', opcionalmente solo las zonas cuyo centro está en una región del cielo.
+
+    Parametros:
+    -----------
+    pyramid: Resultado de 'zone_pyramid'.
+    zone_size: Tamaño de zona del nivel. Por defecto el más pequeño.
+    lon_min, lon_max, lat_min, lat_max: Región del cielo (º).
+    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+
+    Retorno:
+    --------
+    DataFrame con el formato de 'statistics_per_zone'.
+    '''
+    if zone_size is None:
+        zone_size=min(pyramid['levels'])
+    polarization_dataxzone=pyramid['levels'][zone_size]
+    polarization_dataxzone=polarization_dataxzone[polarization_dataxzone['zone_lon'].between(lon_min,lon_max)&
+                                                  polarization_dataxzone['zone_lat'].between(lat_min,lat_max)].reset_index(drop=True)
+    csv_creator(polarization_dataxzone,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
+    return polarization_dataxzone
+
+def zone_map_rows(members:dict,zone_ids,zone_size:float,sigma_limit:float,zone_scheme:str='grid'):
+    '''
+    Calcula las filas de 'statistics_per_zone' de las zonas 'zone_ids' a partir de sus puntos.
+
+    Parametros:
+    -----------
+    members: Diccionario cuya clave es el número de zona y su valor el array (puntos, columnas de 'CATALOG_COLUMNS') de sus puntos.
+    zone_ids: Zonas que se quieren calcular.
+    zone_size, sigma_limit, zone_scheme: Ver 'statistics_per_zone' y 'add_coords_of_zone_center'.
+
+    Retorno:
+    --------
+    DataFrame con una fila por zona, indexado por 'zone_id'.
+    '''
+    zone_ids=np.sort(np.asarray(list(zone_ids),dtype=np.int64))
+    points=np.array([len(members[zone]) for zone in zone_ids],dtype=np.int64)
+    rows=np.concatenate([members[zone] for zone in zone_ids]) if len(zone_ids) else np.zeros((0,len(CATALOG_COLUMNS)))
+    starts=np.concatenate(([0],np.cumsum(points)[:-1])).astype(np.int64) if len(zone_ids) else np.zeros(0,dtype=np.int64)
+    zone_lon,zone_lat=zone_centers(zone_ids,zone_size,zone_scheme)
+    if len(zone_ids):
+        zone_pol,zone_ang,points_after=ZONE_KERNELS[KERNEL_OPTIONS['backend']](rows[:,2],rows[:,4],rows[:,3],rows[:,5],starts,sigma_limit)
+    else:
+        zone_pol,zone_ang,points_after=np.zeros(0),np.zeros(0),np.zeros(0,dtype=np.int64)
+    return pd.DataFrame({'zone_lon':zone_lon,'zone_lat':zone_lat,'zone_pol':zone_pol,'zone_ang':zone_ang,
+                         'points_before':points,'points_after':points_after,'zone_id':zone_ids},index=pd.Index(zone_ids,name=None))
+
+def group_by_zone(polarization_data:pd.DataFrame,zone_size:float,zone_scheme:str='grid'):
+    '''
+    Reparte los puntos por zonas.
+
+    Retorno:
+    --------
+    Diccionario cuya clave es el número de zona y su valor el array (puntos, columnas de 'CATALOG_COLUMNS') de sus puntos, en el orden de entrada.
+    '''
+    zone_id,zone_lon,zone_lat=ZONE_SCHEMES[zone_scheme](polarization_data['longitude'].to_numpy(),polarization_data['latitude'].to_numpy(),zone_size)
+    order=np.argsort(zone_id,kind='stable')
+    rows=np.column_stack([polarization_data[name].to_numpy(dtype=float) for name in CATALOG_COLUMNS])[order]
+    starts=zone_boundaries(zone_id[order])
+    return dict(zip(zone_id[order][starts].tolist(),np.split(rows,starts[1:])))
+
+def create_zone_map(polarization_data:pd.DataFrame,zone_size:float,sigma_limit:float,zone_scheme:str='grid',directory:str=None):
+    '''
+    Crea un mapa por zonas que se puede actualizar con nuevas observaciones ('append_to_zone_map') recalculando solo las zonas afectadas.
+
+    Parametros:
+    -----------
+    polarization_data: DataFrame del catálogo, ya recortado (ver 'space_cutout' y 'values_cutout').
+    zone_size, sigma_limit, zone_scheme: Ver 'statistics_per_zone' y 'add_coords_of_zone_center'.
+    directory: Si se indica, el mapa se graba en este directorio y se puede recuperar con 'load_zone_map'.
+
+    Retorno:
+    --------
+    Diccionario con los parámetros del mapa, los puntos de cada zona ('members'), la tabla de estadísticas por zona ('statistics')
+    y, si tiene directorio, el índice por zonas de cada lote grabado ('batches', ver 'write_zone_batch').
+    '''
+    members=group_by_zone(polarization_data,zone_size,zone_scheme)
+    zone_map={'zone_size':zone_size,'sigma_limit':sigma_limit,'zone_scheme':zone_scheme,'directory':directory,'deltas':0,'members':members,
+              'statistics':zone_map_rows(members,members.keys(),zone_size,sigma_limit,zone_scheme),'batches':[]}
+    if directory is not None:
+        os.makedirs(directory,exist_ok=True)
+        zone_map['batches'].append(write_zone_batch(directory,'base',members))
+        table_writer(zone_map['statistics'].reset_index(drop=True),os.path.join(directory,'statistics.npz'))
+        write_zone_map_meta(zone_map)
+    return zone_map
+
+def write_zone_batch(directory:str,name:str,members:dict):
+    '''
+    Graba los puntos de un lote ordenados por zona ('name.npy') y su índice ('name_zones.npy': número de cada zona y posición final de
+    sus puntos), de forma que los puntos de una zona se pueden leer sin leer ni reagrupar el resto del lote.
+
+    Retorno:
+    --------
+    name, zone_ids, stops: Nombre del lote y su índice.
+    '''
+    zone_ids=np.sort(np.asarray(list(members),dtype=np.int64))
+    rows=np.concatenate([members[zone] for zone in zone_ids]) if len(zone_ids) else np.zeros((0,len(CATALOG_COLUMNS)))
+    stops=np.cumsum([len(members[zone]) for zone in zone_ids],dtype=np.int64)
+    np.save(os.path.join(directory,name+'.npy'),rows)
+    np.save(os.path.join(directory,name+'_zones.npy'),np.vstack((zone_ids,stops)))
+    return name,zone_ids,stops
+
+def read_zone_batch_index(directory:str,name:str):
+    '''
+    Índice de un lote grabado con 'write_zone_batch'.
+    '''
+    zone_ids,stops=np.load(os.path.join(directory,name+'_zones.npy'))
+    return name,zone_ids,stops
+
+def stored_zone_members(zone_map:dict,zone_ids):
+    '''
+    Lee del directorio del mapa los puntos de las zonas 'zone_ids' de todos los lotes, en el orden en que se añadieron.
+    Cada lote se abre como 'memmap' y solo se copian las filas de las zonas pedidas.
+
+    Retorno:
+    --------
+    Diccionario (como 'members') con las zonas que tienen puntos grabados.
+    '''
+    zone_ids=np.asarray(list(zone_ids),dtype=np.int64)
+    parts={}
+    for name,batch_zones,stops in zone_map['batches']:
+        positions=np.searchsorted(batch_zones,zone_ids)
+        found=positions<len(batch_zones)
+        found[found]=batch_zones[positions[found]]==zone_ids[found]
+        if not found.any():
+            continue
+        rows=np.load(os.path.join(zone_map['directory'],name+'.npy'),mmap_mode='r')
+        starts=np.concatenate(([0],stops[:-1]))
+        for zone,position in zip(zone_ids[found].tolist(),positions[found]):
+            parts.setdefault(zone,[]).append(np.array(rows[starts[position]:stops[position]]))
+    return {zone:np.concatenate(arrays) for zone,arrays in parts.items()}
+
+def write_zone_map_meta(zone_map:dict):
+    '''
+    Graba los parámetros del mapa y el número de actualizaciones en su directorio. Se graba al final de cada actualización.
+    '''
+    with open(os.path.join(zone_map['directory'],'meta.json'),'w') as meta_file:
+        json.dump({name:zone_map[name] for name in ['zone_size','sigma_limit','zone_scheme','deltas']},meta_file)
+
+def append_to_zone_map(zone_map:dict,new_rows:pd.DataFrame):
+    '''
+    Añade nuevas observaciones al mapa y recalcula (incluida la selección por sigmas) solo las zonas que las contienen.
+    Si el mapa tiene directorio, solo se graban las filas nuevas ('delta_n.npy') y las filas recalculadas de la tabla de estadísticas
+    ('statistics_n.npz'): el coste depende de las zonas afectadas y no del tamaño del mapa.
+
+    Parametros:
+    -----------
+    zone_map: Mapa creado con 'create_zone_map' o leído con 'load_zone_map'.
+    new_rows: DataFrame con las nuevas observaciones (columnas de 'CATALOG_COLUMNS'), ya recortadas.
+
+    Retorno:
+    --------
+    DataFrame con las filas recalculadas (una por zona afectada).
+    '''
+    new_members=group_by_zone(new_rows,zone_map['zone_size'],zone_map['zone_scheme'])
+    members=zone_map['members']
+    if zone_map['directory'] is not None: # Los puntos de las zonas que no están en memoria se leen del directorio (ver 'load_zone_map')
+        members.update(stored_zone_members(zone_map,[zone for zone in new_members if zone not in members]))
+    for zone,rows in new_members.items():
+        members[zone]=np.concatenate((members[zone],rows)) if zone in members else rows
+    updated=zone_map_rows(members,new_members.keys(),zone_map['zone_size'],zone_map['sigma_limit'],zone_map['zone_scheme'])
+    zone_map['statistics']=merge_zone_statistics(zone_map['statistics'],updated)
+    if zone_map['directory'] is not None:
+        zone_map['deltas']+=1
+        zone_map['batches'].append(write_zone_batch(zone_map['directory'],'delta_%06d'%zone_map['deltas'],new_members))
+        table_writer(updated.reset_index(drop=True),os.path.join(zone_map['directory'],'statistics_%06d.npz'%zone_map['deltas']))
+        write_zone_map_meta(zone_map)
+    return updated.reset_index(drop=True)
+
+def merge_zone_statistics(statistics:pd.DataFrame,updated:pd.DataFrame):
+    '''
+    Sustituye en 'statistics' las filas de las zonas de 'updated' y añade las zonas nuevas. Ambas tablas están indexadas por 'zone_id'.
+    '''
+    existing=updated.index.isin(statistics.index)
+    statistics.loc[updated.index[existing]]=updated[existing]
+    if not existing.all(): # Zonas nuevas
+        statistics=pd.concat([statistics,updated[~existing]]).sort_index()
+    return statistics
+
+def load_zone_map(directory:str):
+    '''
+    Lee un mapa grabado con 'create_zone_map', incluidas todas las actualizaciones de 'append_to_zone_map'.
+    La tabla de estadísticas se reconstruye con la inicial y las filas recalculadas en cada actualización. Los puntos de cada zona
+    no se leen: 'append_to_zone_map' lee del directorio solo los de las zonas que actualiza.
+    '''
+    with open(os.path.join(directory,'meta.json')) as meta_file:
+        meta=json.load(meta_file)
+    statistics=table_reader(os.path.join(directory,'statistics.npz'))
+    statistics.index=statistics['zone_id'].to_numpy()
+    for delta in range(1,meta['deltas']+1):
+        updated=table_reader(os.path.join(directory,'statistics_%06d.npz'%delta))
+        updated.index=updated['zone_id'].to_numpy()
+        statistics=merge_zone_statistics(statistics,updated)
+    batches=[read_zone_batch_index(directory,'base')]+[read_zone_batch_index(directory,'delta_%06d'%delta) for delta in range(1,meta['deltas']+1)]
+    return dict(meta,directory=directory,members={},statistics=statistics,batches=batches)
+
+def zone_map_statistics(zone_map:dict,csv_file=None):
+    '''
+    Tabla de estadísticas del mapa, con el mismo formato que 'statistics_per_zone'.
+    '''
+    polarization_dataxzone=zone_map['statistics'].reset_index(drop=True)
+    csv_creator(polarization_dataxzone,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
+    return polarization_dataxzone
+
+def zone_map_extent(zone_polarization_data:pd.DataFrame,zone_size:float):
+    '''
+    Límites en longitud y latitud del mapa por zonas. Puesto que también puede representarse un submapa, se calculan a partir del 'DataFrame'.
+
+    Retorno:
+    --------
+    lon_min, lon_max, lat_min, lat_max
+    '''
+    lon_min=int(min(zone_polarization_data.loc[:,'zone_lon']))-zone_size/2
+    lat_min=int(min(zone_polarization_data.loc[:,'zone_lat']))-zone_size/2
+    lon_max=int(max(zone_polarization_data.loc[:,'zone_lon']))+zone_size/2
+    lat_max=int(max(zone_polarization_data.loc[:,'zone_lat']))+zone_size/2
+    return lon_min,lon_max,lat_min,lat_max
+
+def draw_cartesian_by_zones(fig,zone_polarization_data:pd.DataFrame,zone_size:float,perpendicular:bool):
+    '''
+    Dibuja en la figura 'fig' el mapa de 'cartesian_plot_by_zones' sin usar el estado global de 'pyplot'.
+
+    Parametros:
+    -----------
+    fig: 'Figure' de 'matplotlib' (creada con 'plt.figure' o con 'new_figure'). Se le ajusta el tamaño a la relación de aspecto del mapa.
+    zone_polarization_data, zone_size, perpendicular: Ver 'cartesian_plot_by_zones'.
+
+    Retorno:
+    --------
+    El 'Axes' del mapa.
+    '''
+    if perpendicular:
+        added_angle=90
+    else:
+        added_angle=0
+    
+    #Establece una gradacion de colores 'viridis' en formato hexadecimal para poder utilizarlo en matplotlib.
+    viridis = mtp.colormaps.get_cmap('viridis')
+    
+    #Para determinar el color para el vector de cada zona, necesitamos que el valor de la polarización en todas las zonas esté entre 0 y 1. Para hacerlo necesitamos tener el mínimo y el máximo de polarización.
+    pol_min=min(zone_polarization_data.loc[:,'zone_pol'])
+    pol_max=max(zone_polarization_data.loc[:,'zone_pol'])
+    
+    lon_min,lon_max,lat_min,lat_max=zone_map_extent(zone_polarization_data,zone_size)
+
+    #Fijamos el ancho y alto del grafico (en pulgadas)
+    if lon_max-lon_min>lat_max-lat_min:
+        fig.set_size_inches(10,10*(lat_max-lat_min)/(lon_max-lon_min))
+    else:
+        fig.set_size_inches(10*(lon_max-lon_min)/(lat_max-lat_min),10)
+    ax=fig.add_subplot(111)
+    
+    #Establece el color de fondo de la figura
+    ax.set_facecolor('black')
+
+    #Establecemos los límites del mapa
+    ax.set_xlim(lon_min,lon_max)
+    ax.set_ylim(lat_min,lat_max)
+
+    '''
+    Leemos los parámetros de todas las zonas
+    '''
+    lonz=zone_polarization_data['zone_lon'].to_numpy()
+    latz=zone_polarization_data['zone_lat'].to_numpy()
+    angz=zone_polarization_data['zone_ang'].to_numpy()+added_angle
+    polz=(zone_polarization_data['zone_pol'].to_numpy()-pol_min)/(pol_max-pol_min) #Para dar un color a la flecha en función de la escala de colores 'viridis' ajustamos el valor de la polarización a un valor entre 0 y 1.
+    x1,y1,x2,y2,color=direction_bar_coordinates(lonz,latz,angz,zone_size) #Coordenadas de inicio y final de las barras de dirección.
+    '''
+    Dibujamos las barras de todas las zonas. El color, según la escala 'viridis', y el grosor
+    de cada barra dependen del porcentaje de polarizacion
+    '''
+    draw_direction_bars(x1,y1,x2,y2,viridis(polz),polz,ax=ax)
+    return ax
+
+@instrumented
 def cartesian_plot_by_zones(zone_polarization_data:pd.DataFrame,zone_size:float,perpendicular:bool,image_file:chr=None):
     '''
     Esta función crea una representación de los vectores de polarización por zonas.
@@ -490,71 +2432,302 @@ def cartesian_plot_by_zones(zone_polarization_data:pd.DataFrame,zone_size:float,
     Se retorna una imagen en la ventana de representación de Python y, si se ha introducido el nombre de un fichero,
     se graba una imagen con este nombre en el directorio de trabajo.
     '''
+    draw_cartesian_by_zones(plt.figure(),zone_polarization_data,zone_size,perpendicular)
+    '''
+    salvamos el gráfico en un fichero de imagen y también lo representamos en 
+    el 'plot' de Python
+    '''
+    jpg_creator(image_file)
+    plt.show()
 
-    if perpendicular:
-        added_angle=90
+TILE_CACHE_VERSION=2 # Cambia cuando cambia el dibujo de las teselas, para no reutilizar teselas antiguas
+TILE_POL_RANGE=(0.0,5.0) # Escala de color (porcentaje de polarización mínimo y máximo) de las teselas por defecto
+
+def tile_bounds(zoom:int,x:int,y:int):
+    '''
+    Límites (º) de la tesela 'x','y' del nivel 'zoom'. En el nivel 'zoom' hay 2**(zoom+1) teselas en longitud y 2**zoom en latitud,
+    todas de 180/2**zoom grados de lado. 'x' cuenta desde longitud -180º y 'y' desde latitud 90º (hacia abajo).
+
+    Retorno:
+    --------
+    lon_min, lon_max, lat_min, lat_max
+    '''
+    side=180/2**zoom
+    return -180+x*side,-180+(x+1)*side,90-(y+1)*side,90-y*side
+
+def tile_cache_key(lonz,latz,angz,polz,parameters:dict,zoom:int,x:int,y:int):
+    '''
+    Clave de la caché de teselas: 'hash' SHA-256 de los datos de las zonas que se dibujan en la tesela, los parámetros de dibujo y la posición de la tesela
+    ('zoom', 'x' e 'y' iguales a 'None' en la tesela en blanco común a todas las teselas vacías).
+    '''
+    key=hashlib.sha256(json.dumps(dict(parameters,version=TILE_CACHE_VERSION,tile=[zoom,x,y]),sort_keys=True).encode('utf-8'))
+    for column in (lonz,latz,angz,polz):
+        key.update(np.ascontiguousarray(column,dtype=np.float64).tobytes())
+    return key.hexdigest()
+
+def render_tile(x1,y1,x2,y2,polz,bounds,tile_size:int=256):
+    '''
+    Dibuja una tesela con las barras de dirección indicadas, sin 'pyplot' (una 'Figure' con su propio 'canvas' Agg).
+
+    Retorno:
+    --------
+    La tesela en formato 'png' (bytes).
+    '''
+    figure=Figure(figsize=(tile_size/100,tile_size/100),dpi=100)
+    FigureCanvasAgg(figure)
+    figure.patch.set_facecolor('black')
+    ax=figure.add_axes((0,0,1,1))
+    ax.set_facecolor('black')
+    ax.set_axis_off()
+    ax.set_xlim(bounds[0],bounds[1])
+    ax.set_ylim(bounds[2],bounds[3])
+    draw_direction_bars(x1,y1,x2,y2,mtp.colormaps.get_cmap('viridis')(polz),polz,ax=ax)
+    image=io.BytesIO()
+    figure.savefig(image,format='png',dpi=100,facecolor='black')
+    return image.getvalue()
+
+@instrumented
+def render_tiles(zone_polarization_data:pd.DataFrame,zone_size:float,perpendicular:bool,zooms,tile_dir:str,cache_dir:str=None,tile_size:int=256,pol_range:tuple=None):
+    '''
+    Divide el mapa de 'cartesian_plot_by_zones' en teselas de 'tile_size' píxeles para cada nivel de 'zooms' y las graba como 'tile_dir/zoom/x/y.png'.
+    Cada tesela se guarda también en una caché cuya clave depende solo de las zonas que se dibujan en ella y de los parámetros de dibujo,
+    de forma que al regenerar el mapa (por ejemplo con otro 'sigma_limit') solo se vuelven a dibujar las teselas cuyas zonas han cambiado.
+    Las teselas sin ninguna zona comparten una sola entrada de la caché, que se dibuja una vez.
+
+    Parametros:
+    -----------
+    zone_polarization_data: DataFrame con la polarización por zonas (ver 'statistics_per_zone').
+    zone_size: Tamaño en grados de la zona.
+    perpendicular: Si es 'True' se representa la perpendicular a la polarización.
+    zooms: Lista de niveles de zoom (ver 'tile_bounds').
+    tile_dir: Directorio en el que se graban las teselas.
+    cache_dir: Directorio de la caché. Por defecto 'tile_dir/.cache'.
+    tile_size: Lado de las teselas en píxeles.
+    pol_range: Porcentajes de polarización (mínimo, máximo) de la escala de color y del grosor de las barras. Por defecto 'TILE_POL_RANGE'.
+               La escala es fija (no depende de las zonas) para que al cambiar una zona no cambie el dibujo de las demás teselas.
+
+    Retorno:
+    --------
+    Diccionario con el número de teselas dibujadas ('rendered') y reutilizadas de la caché ('reused').
+    '''
+    if cache_dir is None:
+        cache_dir=os.path.join(tile_dir,'.cache')
+    os.makedirs(cache_dir,exist_ok=True)
+    added_angle=90 if perpendicular else 0
+    lonz=zone_polarization_data['zone_lon'].to_numpy(dtype=float)
+    latz=zone_polarization_data['zone_lat'].to_numpy(dtype=float)
+    angz=zone_polarization_data['zone_ang'].to_numpy(dtype=float)+added_angle
+    pol=zone_polarization_data['zone_pol'].to_numpy(dtype=float)
+    pol_min,pol_max=TILE_POL_RANGE if pol_range is None else pol_range
+    if not pol_max>pol_min:
+        raise ValueError(f'Escala de polarización {pol_range} no válida: el máximo debe ser mayor que el mínimo')
+    polz=np.clip((pol-pol_min)/(pol_max-pol_min),0,1) # Escala de color común a todas las teselas
+    parameters={'zone_size':zone_size,'tile_size':tile_size,'pol_range':[float(pol_min),float(pol_max)]}
+    counts={'rendered':0,'reused':0}
+    for zoom in zooms:
+        for x in range(2**(zoom+1)):
+            for y in range(2**zoom):
+                bounds=tile_bounds(zoom,x,y)
+                inside=((lonz>=bounds[0]-zone_size)&(lonz<=bounds[1]+zone_size)& # Zonas cuyas barras pueden entrar en la tesela
+                        (latz>=bounds[2]-zone_size)&(latz<=bounds[3]+zone_size))
+                if inside.any():
+                    key=tile_cache_key(lonz[inside],latz[inside],angz[inside],pol[inside],parameters,zoom,x,y)
+                else: # Todas las teselas vacías son iguales: se comparte una sola tesela en blanco
+                    key=tile_cache_key(lonz[inside],latz[inside],angz[inside],pol[inside],parameters,None,None,None)
+                cached_file=os.path.join(cache_dir,key+'.png')
+                if os.path.isfile(cached_file):
+                    os.utime(cached_file) # La fecha de modificación indica el último uso (para la eliminación LRU)
+                    counts['reused']+=1
+                else:
+                    x1,y1,x2,y2,color=direction_bar_coordinates(lonz[inside],latz[inside],angz[inside],zone_size)
+                    with open(cached_file+'.tmp%d'%os.getpid(),'wb') as file:
+                        file.write(render_tile(x1,y1,x2,y2,polz[inside],bounds,tile_size))
+                    os.replace(cached_file+'.tmp%d'%os.getpid(),cached_file)
+                    counts['rendered']+=1
+                os.makedirs(os.path.join(tile_dir,str(zoom),str(x)),exist_ok=True)
+                shutil.copyfile(cached_file,os.path.join(tile_dir,str(zoom),str(x),'%d.png'%y))
+    return counts
+
+def evict_tile_cache(cache_dir:str,max_bytes:int=None,max_age:float=None):
+    '''
+    Elimina teselas de la caché, empezando por las usadas hace más tiempo (ver 'evict_catalog_cache').
+
+    Retorno:
+    --------
+    Número de teselas eliminadas.
+    '''
+    if not os.path.isdir(cache_dir):
+        return 0
+    tiles=[os.path.join(cache_dir,name) for name in os.listdir(cache_dir) if name.endswith('.png')]
+    tiles=sorted(((os.path.getmtime(tile),os.path.getsize(tile),tile) for tile in tiles))
+    total_size=sum(size for last_used,size,tile in tiles)
+    now=time.time()
+    removed=0
+    for last_used,size,tile in tiles:
+        too_old=max_age is not None and now-last_used>max_age
+        too_big=max_bytes is not None and total_size>max_bytes
+        if too_old or too_big:
+            os.remove(tile)
+            total_size-=size
+            removed+=1
+    return removed
+
+def serve_tiles(tile_dir:str,port:int=8000,block:bool=True):
+    '''
+    Servidor 'http' local de las teselas grabadas por 'render_tiles' ('http://localhost:port/zoom/x/y.png').
+
+    Parametros:
+    -----------
+    tile_dir: Directorio de las teselas.
+    port: Puerto del servidor.
+    block: Si es 'True' atiende peticiones hasta que se interrumpe el programa. Si es 'False' el servidor funciona en un hilo aparte.
+
+    Retorno:
+    --------
+    El servidor ('server.shutdown()' lo detiene).
+    '''
+    server=http.server.ThreadingHTTPServer(('localhost',port),functools.partial(http.server.SimpleHTTPRequestHandler,directory=tile_dir))
+    if block:
+        server.serve_forever()
     else:
-        added_angle=0
-    
-    #Establece una gradacion de colores 'viridis' en formato hexadecimal para poder utilizarlo en matplotlib.
-    #viridis = cm.get_cmap('viridis', 256)
-    viridis = mtp.colormaps.get_cmap('viridis')
-    
-    #Para determinar el color para el vector de cada zona, necesitamos que el valor de la polarización en todas las zonas esté entre 0 y 1. Para hacerlo necesitamos tener el mínimo y el máximo de polarización.
-    pol_min=min(zone_polarization_data.loc[:,'zone_pol'])
-    pol_max=max(zone_polarization_data.loc[:,'zone_pol'])
-    
-    #Puesto que también puede representarse un submapa, debemos ver cuales son los límites en longitud y latitud del 'DataFrame'
-    lon_min=int(min(zone_polarization_data.loc[:,'zone_lon']))-zone_size/2
-    lat_min=int(min(zone_polarization_data.loc[:,'zone_lat']))-zone_size/2
-    lon_max=int(max(zone_polarization_data.loc[:,'zone_lon']))+zone_size/2
-    lat_max=int(max(zone_polarization_data.loc[:,'zone_lat']))+zone_size/2
+        threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
+
+MOLLWEIDE_ITERATIONS=8 # Máximo de iteraciones de Newton del ángulo auxiliar de la proyección Mollweide (con 7 se alcanza la precisión de 'float64' hasta 85º de latitud)
+MOLLWEIDE_GEOMETRY_COLUMNS=['moll_x','moll_y','moll_x1','moll_y1','moll_x2','moll_y2','moll_color'] # Columnas con la geometría proyectada (punto y barra de dirección) y el valor de color de la barra
+
+def mollweide_projection(longitude,latitude,iterations:int=MOLLWEIDE_ITERATIONS):
+    '''
+    Proyección Mollweide de arrays completos de coordenadas, sin pasar por la transformación de 'matplotlib' en cada dibujo.
+    El ángulo auxiliar θ (2θ+sin 2θ=π·sin φ) se resuelve a la vez para todos los puntos con un número acotado de iteraciones de Newton.
+    Cerca de los polos (a menos de 5º), donde Newton converge mal, se usa la aproximación por serie de Taylor, igual que 'matplotlib'.
+
+    Parametros:
+    -----------
+    longitude, latitude: Coordenadas (º). Un valor, un array de 'numpy' o una columna de 'pandas'.
+    iterations: Número máximo de iteraciones de Newton.
+
+    Retorno:
+    --------
+    x, y: Coordenadas proyectadas. La elipse completa va de -2√2 a 2√2 en 'x' y de -√2 a √2 en 'y' (las mismas unidades que los ejes 'mollweide' de 'matplotlib').
+    '''
+    longitude=np.radians(np.asarray(longitude,dtype=float))
+    latitude=np.radians(np.asarray(latitude,dtype=float))
+    colatitude=np.pi/2-np.abs(latitude)
+    near_pole=colatitude<0.087
+    target=np.pi*np.sin(latitude)
+    target=np.where(near_pole,0.0,target)
+    theta=np.where(near_pole,0.0,2.0*latitude) # 2θ. Los puntos cercanos a los polos no se iteran
+    for _ in range(iterations):
+        delta=-(theta+np.sin(theta)-target)/(1+np.cos(theta))
+        theta+=delta
+        if np.all(np.abs(delta)<1e-12):
+            break
+    auxiliary=np.where(near_pole,(np.pi/2-0.5*(3*np.pi*colatitude**2)**(1.0/3))*np.sign(latitude),theta/2)
+    return (2.0*np.sqrt(2.0)/np.pi)*longitude*np.cos(auxiliary),np.sqrt(2.0)*np.sin(auxiliary)
+
+def mollweide_geometry(table:pd.DataFrame,bar_length:float,added_angle:float=0,lon_name:str='longitude',lat_name:str='latitude',ang_name:str='angle'):
+    '''
+    Añade a una copia de 'table' su geometría en proyección Mollweide: la posición de cada fila ('moll_x','moll_y') y el inicio y final
+    de su barra de dirección ('moll_x1','moll_y1','moll_x2','moll_y2') con su valor de color entre 0 y 1 ('moll_color', ver 'direction_bar_coordinates').
+    La geometría queda guardada con la tabla, de forma que volver a dibujarla (o cambiar solo el estilo) no repite la proyección.
+    Los parámetros usados se guardan en 'attrs['mollweide']' para saber si la geometría sigue siendo válida (ver 'has_mollweide_geometry').
+
+    Parametros:
+    -----------
+    table: DataFrame con longitud, latitud y ángulo (º), por ejemplo el de 'statistics_per_zone' o el de 'clusters_center'.
+    bar_length: Longitud de la barra de dirección (º).
+    added_angle: Ángulo que se suma al de la tabla (90 para representar la perpendicular).
+    lon_name, lat_name, ang_name: Nombres de las columnas de longitud, latitud y ángulo.
+
+    Retorno:
+    --------
+    Copia de 'table' con las columnas de 'MOLLWEIDE_GEOMETRY_COLUMNS'.
+    '''
+    x1,y1,x2,y2,bar_colors=direction_bar_coordinates(table[lon_name],table[lat_name],table[ang_name].to_numpy(dtype=float)+added_angle,bar_length)
+    x,y=mollweide_projection(table[lon_name],table[lat_name])
+    x1,y1=mollweide_projection(x1,y1)
+    x2,y2=mollweide_projection(x2,y2)
+    table=table.assign(**dict(zip(MOLLWEIDE_GEOMETRY_COLUMNS,(x,y,x1,y1,x2,y2,bar_colors))))
+    table.attrs['mollweide']={'bar_length':bar_length,'added_angle':added_angle}
+    return table
+
+def has_mollweide_geometry(table:pd.DataFrame,bar_length:float,added_angle:float=0):
+    '''
+    'True' si 'table' ya contiene la geometría de 'mollweide_geometry' calculada con estos parámetros.
+    '''
+    return table.attrs.get('mollweide')=={'bar_length':bar_length,'added_angle':added_angle} and all(name in table.columns for name in MOLLWEIDE_GEOMETRY_COLUMNS)
+
+def draw_mollweide_frame(ax,labelsize:float=2):
+    '''
+    Prepara un 'Axes' normal para dibujar coordenadas ya proyectadas con 'mollweide_projection': la elipse del cielo con fondo blanco,
+    la cuadrícula (meridianos cada 30º y paralelos cada 15º) y sus etiquetas, como en los ejes 'mollweide' de 'matplotlib'.
+
+    Retorno:
+    --------
+    La elipse ('Ellipse'), para recortar con ella lo que se dibuje después ('set_clip_path').
+    '''
+    ax.set_xlim(-2*np.sqrt(2),2*np.sqrt(2))
+    ax.set_ylim(-np.sqrt(2),np.sqrt(2))
+    ax.set_aspect('equal')
+    ax.set_axis_off()
+    sky=Ellipse((0,0),4*np.sqrt(2),2*np.sqrt(2),facecolor='white',edgecolor='black',linewidth=0.5,zorder=0)
+    ax.add_patch(sky)
+    latitudes=np.linspace(-90,90,181)
+    longitudes=np.linspace(-180,180,361)
+    grid_lines=[np.column_stack(mollweide_projection(np.full(len(latitudes),lon),latitudes)) for lon in range(-150,151,30)]
+    grid_lines+=[np.column_stack(mollweide_projection(longitudes,np.full(len(longitudes),lat))) for lat in range(-75,76,15)]
+    ax.add_collection(LineCollection(grid_lines,colors='black',linewidths=0.1,zorder=1),autolim=False)
+    for lon in range(-150,151,30):
+        x,y=mollweide_projection(lon,0)
+        ax.text(x,y,f'{lon}°',fontsize=labelsize,ha='center',va='bottom',color='black')
+    for lat in range(-75,76,15):
+        x,y=mollweide_projection(-180,lat)
+        ax.text(x,y,f'{lat}°',fontsize=labelsize,ha='right',va='center',color='black')
+    return sky
+
+def draw_mollweide_by_zones(fig,zone_polarization_data:pd.DataFrame,zone_size:float,perpendicular:bool):
+    '''
+    Dibuja en la figura 'fig' el mapa de 'mollweide_plot_by_zones' sin usar el estado global de 'pyplot'.
+    Las barras se proyectan de una vez con 'mollweide_projection' y se dibujan en un 'Axes' normal (ver 'draw_mollweide_frame').
+    Si 'zone_polarization_data' ya contiene su geometría ('mollweide_geometry' con 'zone_size' y la misma orientación) no se vuelve a proyectar.
 
-    #Fijamos el ancho y alto del grafico (en pulgadas)
-    if lon_max-lon_min>lat_max-lat_min:
-        plt.figure(figsize=(10,10*(lat_max-lat_min)/(lon_max-lon_min)))
+    Retorno:
+    --------
+    El 'Axes' del mapa.
+    '''
+    if perpendicular:
+        added_angle=90
+        chosen_color=(0,0,1,1) #Azul
     else:
-        plt.figure(figsize=(10*(lon_max-lon_min)/(lat_max-lat_min),10))
-    
-    #Establece el color de fondo de la figura
-    plt.gca().set_facecolor('black')
-
-    #Establecemos los límites del mapa
-    plt.xlim(lon_min,lon_max)
-    plt.ylim(lat_min,lat_max)
+        added_angle=0
+        chosen_color=(1,0,0,1) #Rojo
 
-    for pos in range(len(zone_polarization_data.loc[:,'zone_lon'])):
-        '''
-        Leemos los parámetros de la zona n°'pos'
-        '''
-        lonz=zone_polarization_data.loc[pos,'zone_lon']
-        latz=zone_polarization_data.loc[pos,'zone_lat']
-        angz=zone_polarization_data.loc[pos,'zone_ang']+added_angle
-        
-        polz=(zone_polarization_data.loc[pos,'zone_pol']-pol_min)/(pol_max-pol_min) #Para dar un color a la flecha en función de la escala de colores 'viridis' ajustamos el valor de la polarización a un valor entre 0 y 1.
-        
-        x1,y1,x2,y2,color=direction_bar_coordinates(lonz,latz,angz,zone_size) #Coordenadas de inicio y final de la barra de dirección.
-        '''
-        Valor del color segun la escala 'viridis' para un valor 'polz' entre 0 y 1.
-        '''
-        color = viridis(polz)
-        hex_color = colors.to_hex(color)
-        '''
-        Dibujamos la flecha para cada zona
-        '''
-        plt.plot((x1,x2),(y1,y2),hex_color,linewidth=polz) # Color y grosor de la barra de dirección en función del porcentaje de polarizacion
-        
+    ax=fig.add_subplot(111)
+    sky=draw_mollweide_frame(ax,labelsize=2)
+    
+    #Para determinar el grosor de la barra de dirección, necesitamos que el valor de la polarización en todas las zonas esté entre 0 y 1. Para hacerlo necesitamos tener el mínimo y el máximo de polarización.
+    pol_min=(min(zone_polarization_data.loc[:,'zone_pol']))
+    pol_max=(max(zone_polarization_data.loc[:,'zone_pol']))
     '''
-    salvamos el gráfico en un fichero de imagen y también lo representamos en 
-    el 'plot' de Python
+    Para dar un color a la flecha en función de la escala de colores 'viridis'
+    ajustamos el valor de la polarización a un valor entre 0 y 1.
     '''
-    if image_file!=None and image_file!="":
-        if image_file[-4]!=".":
-            image_file=image_file+".jpg"
-        plt.savefig(image_file,bbox_inches='tight',dpi=1200)
-    jpg_creator(image_file)
-    plt.show()
+    polz=(zone_polarization_data['zone_pol'].to_numpy()-pol_min)/(pol_max-pol_min)
+    '''
+    La longitud de la flecha no puede superar los límites de la zona.
+    '''
+    if not has_mollweide_geometry(zone_polarization_data,zone_size,added_angle):
+        zone_polarization_data=mollweide_geometry(zone_polarization_data,zone_size,added_angle,'zone_lon','zone_lat','zone_ang')
+    visible=polz>0.2 # Solo se dibujan las zonas con suficiente polarización
+    x1,y1,x2,y2=[zone_polarization_data[name].to_numpy()[visible] for name in MOLLWEIDE_GEOMETRY_COLUMNS[2:6]]
+    '''
+    Dibujamos las barras de dirección de todas las zonas. El grosor depende de la polarización.
+    '''
+    draw_direction_bars(x1,y1,x2,y2,chosen_color,polz[visible],ax=ax).set_clip_path(sky)
+    return ax
 
+@instrumented
 def mollweide_plot_by_zones(zone_polarization_data:pd.DataFrame,zone_size:float,perpendicular:bool,image_file:chr=None):
     '''
     Esta función crea una representación de los vectores de polarización por zonas.
@@ -574,57 +2747,7 @@ def mollweide_plot_by_zones(zone_polarization_data:pd.DataFrame,zone_size:float,
     Se retorna una imagen en la ventana de representación de Python y, si se ha introducido el nombre de un fichero,
     se graba una imagen con este nombre en el directorio de trabajo.
     '''
-    if perpendicular:
-        added_angle=90
-        chosen_color=(0,0,1,1) #Azul
-    else:
-        added_angle=0
-        chosen_color=(1,0,0,1) #Rojo
-    
-    # Crear una figura
-    plt.figure()
-
-    # Crear un subplot con la proyección de Mollweide
-    plt.subplot(111, projection="mollweide")
-
-    # Añadir una cuadrícula
-    plt.grid(True,color='black',linewidth=0.1)
-    plt.tick_params(axis='x',colors='black',labelsize=2)
-    plt.tick_params(axis='y',colors='black',labelsize=2)
-    
-    #Para determinar el grosor de la barra de dirección, necesitamos que el valor de la polarización en todas las zonas esté entre 0 y 1. Para hacerlo necesitamos tener el mínimo y el máximo de polarización.
-    pol_min=(min(zone_polarization_data.loc[:,'zone_pol']))
-    pol_max=(max(zone_polarization_data.loc[:,'zone_pol']))
-    
-    #Establece el color de fondo de la figura
-    plt.gca().set_facecolor('white')
-    
-    for pos in range(len(zone_polarization_data.loc[:,'zone_lon'])):
-        '''
-        Leemos los parámetros de la zona n°'pos'
-        '''
-        lonz=zone_polarization_data.loc[pos,'zone_lon']
-        latz=zone_polarization_data.loc[pos,'zone_lat']
-        angz=(zone_polarization_data.loc[pos,'zone_ang']+added_angle)
-        '''
-        Para dar un color a la flecha en función de la escala de colores 'viridis'
-        ajustamos el valor de la polarización a un valor entre 0 y 1.
-        '''
-        polz=((zone_polarization_data.loc[pos,'zone_pol'])-pol_min)/(pol_max-pol_min)
-        '''
-        La longitud de la flecha no puede superar los límites de la zona.
-        '''
-        x1,y1,x2,y2,color=direction_bar_coordinates(lonz,latz,angz,zone_size) #Coordenadas de inicio y final de la barra de dirección.
-        x1_rad=deg_to_rad(x1)
-        y1_rad=deg_to_rad(y1)
-        x2_rad=deg_to_rad(x2)
-        y2_rad=deg_to_rad(y2)
-
-        '''
-        Dibujamos la barra de dirección para cada zona
-        '''
-        if polz>0.2:
-            plt.plot((x1_rad,x2_rad),(y1_rad,y2_rad),color=chosen_color,linewidth=polz) # linewidth => Grosor de la barra
+    draw_mollweide_by_zones(plt.figure(),zone_polarization_data,zone_size,perpendicular)
     '''
     salvamos el gráfico en un fichero de imagen y también lo representamos en 
     el 'plot' de Python
@@ -632,7 +2755,62 @@ def mollweide_plot_by_zones(zone_polarization_data:pd.DataFrame,zone_size:float,
     jpg_creator(image_file)
     plt.show()
 
-def cluster_catalog_creator(catalog:pd.DataFrame,max_separation:float,min_num_points:int,csv_file=None):
+CLUSTER_METRICS=('euclidean','spherical') # Espacios en los que 'cluster_catalog_creator' puede buscar los clusters
+
+def cluster_features(catalog:pd.DataFrame,metric:str='euclidean',angle_weight:float=1.0):
+    '''
+    Coordenadas de cada punto en el espacio en el que se buscan los clusters.
+
+    Parametros:
+    -----------
+    catalog: DataFrame conteniendo al menos 'longitude', 'latitude' y 'angle' (º).
+    metric: 'euclidean' usa directamente (longitud, latitud, ángulo) en grados, como hasta ahora.
+            'spherical' usa la posición sobre la esfera unidad (x,y,z) y el ángulo como dirección axial (cos 2·ángulo, sin 2·ángulo).
+            Así las distancias no se cortan en las costuras de ±180º de longitud ni en 0º/180º de ángulo, y no se deforman cerca de los polos.
+    angle_weight: Peso del término del ángulo respecto al de la posición (solo con 'spherical').
+
+    Retorno:
+    --------
+    Array (puntos, dimensiones) de 'numpy'. Con 'spherical' las coordenadas se escalan de forma que, para separaciones pequeñas,
+    la distancia equivale a grados de arco en el cielo y a grados de diferencia de ángulo, por lo que 'max_separation' conserva su significado.
+    '''
+    if metric=='euclidean':
+        return catalog[['longitude','latitude','angle']].to_numpy(dtype=float)
+    if metric!='spherical':
+        raise ValueError(f"Métrica '{metric}' desconocida. Métricas disponibles: {CLUSTER_METRICS}")
+    scale=180/np.pi # La cuerda entre dos puntos próximos de la esfera unidad es igual a su separación en radianes
+    lon=np.radians(catalog['longitude'].to_numpy(dtype=float))
+    lat=np.radians(catalog['latitude'].to_numpy(dtype=float))
+    ang2=2*np.radians(catalog['angle'].to_numpy(dtype=float)) # Duplicar el ángulo hace que 0º y 180º sean la misma dirección
+    angle_scale=angle_weight*scale/2 # La cuerda entre 2·a1 y 2·a2 es aproximadamente 2·(a1-a2)
+    return np.column_stack((scale*np.cos(lat)*np.cos(lon),scale*np.cos(lat)*np.sin(lon),scale*np.sin(lat),
+                            angle_scale*np.cos(ang2),angle_scale*np.sin(ang2)))
+
+def catalog_with_cluster_labels(catalog:pd.DataFrame,clusters,csv_file=None):
+    '''
+    Parametros:
+    -----------
+    catalog: DataFrame conteniendo 'longitude', 'latitude' y 'angle'.
+    clusters: Array con el número de cluster de cada punto ('-1' si no pertenece a ninguno), por ejemplo el resultado de 'DBSCAN'.
+    csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+
+    Retorno:
+    --------
+    DataFrame con 'longitude', 'latitude', 'angle' y 'cluster' de los puntos que pertenecen a algún cluster, ordenado por cluster, longitud y latitud.
+    '''
+    clusters=np.asarray(clusters)
+    if is_compact(catalog) and len(clusters):
+        clusters=clusters.astype(label_dtype(clusters.max()),copy=False)
+    longitude=catalog['longitude'].to_numpy()
+    latitude=catalog['latitude'].to_numpy()
+    rows=np.flatnonzero(clusters>=0) # Eliminamos los puntos con un valor de cluster igual a -1, es decir, los puntos que no pertenecen a ningun cluster.
+    rows=rows[np.lexsort((latitude[rows],longitude[rows],clusters[rows]))] #Ordenamos por cluster, longitud y latitud
+    catalog_with_clusters=pd.DataFrame({'longitude':longitude[rows],'latitude':latitude[rows],'angle':catalog['angle'].to_numpy()[rows],'cluster':clusters[rows]},copy=False) # Nuevo DataFrame incluyendo el nº de cluster, copiando cada columna una sola vez
+    csv_creator(catalog_with_clusters,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
+    return catalog_with_clusters
+
+@instrumented
+def cluster_catalog_creator(catalog:pd.DataFrame,max_separation:float,min_num_points:int,csv_file=None,metric:str='euclidean',angle_weight:float=1.0,n_jobs:int=None,leaf_size:int=40):
     '''
     Parametros:
     -----------
@@ -640,223 +2818,570 @@ def cluster_catalog_creator(catalog:pd.DataFrame,max_separation:float,min_num_po
     max_separation: separación máxima entre dos puntos para considerar que están dentro de un mismo clúster. Por ejemplo 3.5º.
     min_num_points: mínimo número de puntos vecinos para considerar que un punto forma parte de un clúster. Por ejemplo 10.
     csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+    metric: Espacio en el que se buscan los clusters (ver 'cluster_features'). Con 'spherical' los vecinos se buscan con un 'ball tree'.
+    angle_weight: Peso del ángulo respecto a la posición (solo con 'spherical').
+    n_jobs: Número de procesadores usados en la búsqueda de vecinos ('-1' para usar todos).
+    leaf_size: Tamaño de las hojas del árbol de búsqueda de vecinos.
         
     Retorno:
     --------
     Devuelve un nuevo DataFrame con solo los puntos que pertenecen a algun cluster de cada sector así como el ángulo medio del cluster al que pertenecen.
     '''
-    catalog_3D=catalog.drop(columns=['polarization','polarization_error','angle_error']) # Dejo solo las columnas 'longitude', 'latitude', 'angle'
-    clusters=DBSCAN(eps=max_separation,min_samples=min_num_points).fit_predict(catalog_3D) # Busco los clusters a partir de estas tres dimensiones. 'clusters' es una lista de python.
-    catalog_with_clusters=pd.DataFrame({'longitude':catalog_3D['longitude'],'latitude':catalog_3D['latitude'],'angle':catalog_3D['angle'],'cluster':clusters[:]}) # Nuevo DataFrame incluyendo el nº de cluster
-    catalog_with_clusters=catalog_with_clusters[catalog_with_clusters['cluster']>=0] # Eliminamos los puntos con un valor de cluster igual a -1, es decir, los puntos que no pertenecen a ningun cluster.
-    catalog_with_clusters=catalog_with_clusters.sort_values(by=['cluster','longitude','latitude'],ascending=[True,True,True]) #Ordenamos el DataFrame por la columna 'cluster' 
-    catalog_with_clusters=catalog_with_clusters.reset_index(drop=True) #Rehacemos el indice
-    csv_creator(catalog_with_clusters,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
-    return catalog_with_clusters
+    features=cluster_features(catalog,metric,angle_weight) # Con 'euclidean' solo las columnas 'longitude', 'latitude', 'angle'
+    algorithm='auto' if metric=='euclidean' else 'ball_tree'
+    clusters=DBSCAN(eps=max_separation,min_samples=min_num_points,algorithm=algorithm,leaf_size=leaf_size,n_jobs=n_jobs).fit_predict(features) # Busco los clusters a partir de estas dimensiones.
+    return catalog_with_cluster_labels(catalog,clusters,csv_file)
+
+def neighbors_graph(catalog:pd.DataFrame,max_separation:float,metric:str='euclidean',angle_weight:float=1.0,cache_dir:str=None,n_jobs:int=None):
+    '''
+    Grafo disperso de vecinos: para cada punto, la distancia a todos los puntos que están a menos de 'max_separation' en el espacio de 'cluster_features'.
+    Con este grafo se pueden buscar los clusters con cualquier separación menor o igual y cualquier número mínimo de vecinos sin volver a buscar vecinos.
+
+    Parametros:
+    -----------
+    catalog: DataFrame conteniendo al menos 'longitude', 'latitude' y 'angle' (ya filtrado con los recortes deseados).
+    max_separation: Mayor separación que se quiere estudiar.
+    metric: Espacio en el que se buscan los clusters (ver 'cluster_features').
+    angle_weight: Peso del ángulo respecto a la posición (solo con 'spherical').
+    cache_dir: Si se indica un directorio, el grafo se graba en él con una clave calculada a partir de los datos del catálogo, y se reutiliza
+               en las siguientes llamadas con los mismos datos y una 'max_separation' igual o menor.
+    n_jobs: Número de procesadores usados en la búsqueda de vecinos ('-1' para usar todos).
+
+    Retorno:
+    --------
+    Matriz dispersa 'scipy.sparse.csr_matrix' (puntos x puntos) con las distancias entre vecinos.
+    '''
+    features=cluster_features(catalog,metric,angle_weight)
+    if cache_dir is not None:
+        key=hashlib.sha256(np.ascontiguousarray(features).tobytes()+json.dumps([features.shape,metric,angle_weight]).encode('utf-8')).hexdigest()
+        graph_file=os.path.join(cache_dir,key+'.npz')
+        meta_file=os.path.join(cache_dir,key+'.json')
+        if os.path.isfile(graph_file) and os.path.isfile(meta_file):
+            with open(meta_file) as file:
+                cached_separation=json.load(file)['max_separation']
+            if cached_separation>=max_separation:
+                return sparse.load_npz(graph_file)
+    algorithm='auto' if metric=='euclidean' else 'ball_tree'
+    graph=NearestNeighbors(radius=max_separation,algorithm=algorithm,n_jobs=n_jobs).fit(features).radius_neighbors_graph(mode='distance')
+    if cache_dir is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        sparse.save_npz(graph_file,graph,compressed=False)
+        with open(meta_file,'w') as file:
+            json.dump({'max_separation':max_separation,'metric':metric,'angle_weight':angle_weight,'points':len(features)},file)
+    return graph
+
+def clusters_from_graph(graph,max_separation:float,min_num_points:int):
+    '''
+    Parametros:
+    -----------
+    graph: Grafo de vecinos obtenido con 'neighbors_graph' con una separación mayor o igual a 'max_separation'.
+    max_separation: separación máxima entre dos puntos para considerar que están dentro de un mismo clúster.
+    min_num_points: mínimo número de puntos vecinos para considerar que un punto forma parte de un clúster.
+
+    Retorno:
+    --------
+    Array con el número de cluster de cada punto ('-1' si no pertenece a ninguno), igual al que daría 'DBSCAN' sobre los datos originales.
+    '''
+    return DBSCAN(eps=max_separation,min_samples=min_num_points,metric='precomputed').fit_predict(graph)
+
+@instrumented
+def clusters_parameter_sweep(catalog:pd.DataFrame,max_separations:list,min_nums_points:list,metric:str='euclidean',angle_weight:float=1.0,cache_dir:str=None,n_jobs:int=None):
+    '''
+    Busca los clusters para todas las combinaciones de 'max_separations' y 'min_nums_points' con una sola búsqueda de vecinos.
+
+    Parametros:
+    -----------
+    catalog: DataFrame conteniendo al menos 'longitude', 'latitude' y 'angle'.
+    max_separations: Lista de separaciones máximas a estudiar.
+    min_nums_points: Lista de números mínimos de vecinos a estudiar.
+    metric, angle_weight, cache_dir, n_jobs: Ver 'neighbors_graph'.
+
+    Retorno:
+    --------
+    Diccionario cuya clave es la pareja (max_separation, min_num_points) y su valor el array de números de cluster de cada punto.
+    Con 'catalog_with_cluster_labels' se obtiene el DataFrame de cualquiera de las combinaciones.
+    '''
+    graph=neighbors_graph(catalog,max(max_separations),metric,angle_weight,cache_dir,n_jobs)
+    return {(max_separation,min_num_points):clusters_from_graph(graph,max_separation,min_num_points) for max_separation in max_separations for min_num_points in min_nums_points}
 
-def clusters_center(catalog_with_clusters:pd.DataFrame,csv_file=None):
+@instrumented
+def clusters_center(catalog_with_clusters:pd.DataFrame,csv_file=None,summary:pd.DataFrame=None):
     '''
     Parametros:
     -----------
     catalog_with_clusters: DataFrame conteniendo como mínimo 'longitude', 'latitude', 'angle' y 'cluster'.
     csv_file: Si se ha introducido un nombre, graba una hoja de cálculo con este nombre en formato 'csv'
+    summary: Resumen de los clusters obtenido con 'cluster_summary' (se calcula si no se entrega).
 
     Retorno:
     --------
     Devuelve un nuevo DataFrame con solo las coordenadas de cada cluster ('longitude' y 'latitude') calculadas como el centro de gravedad de los puntos del cluster, así como su ángulo medio ('angle').
     '''
-    clusters_number=max(catalog_with_clusters['cluster'])+1
-    clusters_catalog=pd.DataFrame()
-    for clu in range(clusters_number): #Iremos seleccionando las coordenadas y el ángulo medio de cada cluster.
-        cluster_angle=catalog_with_clusters[catalog_with_clusters['cluster']==clu]['angle'].median() #Angulo medio de los puntos de cada cluster.
-        cluster_longitude=catalog_with_clusters[catalog_with_clusters['cluster']==clu]['longitude'].mean() #Longitudes de los puntos de cada cluster.
-        cluster_latitude=catalog_with_clusters[catalog_with_clusters['cluster']==clu]['latitude'].mean() #Latitudes de los puntos de cada cluster.
-        new_cluster=pd.DataFrame({'longitude':[cluster_longitude],'latitude':[cluster_latitude],'angle':[cluster_angle]})
-        clusters_catalog=pd.concat([clusters_catalog,new_cluster]) #Vamos añadiendo las coordenadas del centro de gravedad de cada cluster y su ángulo medio..
-    clusters_catalog=clusters_catalog.reset_index(drop=True) #Rehacemos el índice.
+    if summary is None:
+        summary,order=cluster_summary(catalog_with_clusters)
+    clusters_catalog=summary[['longitude','latitude','angle']].reset_index(drop=True) #Coordenadas del centro de gravedad de cada cluster y su ángulo medio (mediana).
     csv_creator(clusters_catalog,csv_file) #Si 'csv_file' contiene un nombre, se graba un fichero 'csv' con este nombre.
     return clusters_catalog
 
-def cartesian_plot_3D_clusters(catalog_with_clusters:pd.DataFrame,clusters_catalog:pd.DataFrame,perpendicular:bool,image_file:chr=None):
+def add_angle_color_bar(fig,ax,labelsize:float=None):
     '''
-    Parametros:
-    -----------
-    catalog_with_clusters: DataFrame de pandas. Debe contener al menos longitud 'longitude', latitud 'latitude' y angulo de polarización de su sector 'angle' y el número de cluster 'cluster'.
-    clusters_catalog:  DataFrame de pandas. Debe contener al menos la longitud 'longitude' y latitud 'latitude' del centro de gravedad de cada cluster así como el ángulo medio del cluster al que pertenece.
-    perpendicular: Si es 'True' nos representa la perpendicular, es decir la dirección del campo magnético asociado a esta polarización.
-    image_file: Si se introduce un nombre, se graba una imagen con este nombre en el directorio de trabajo.
-    
+    Añade a 'fig' la barra de colores 'viridis' del ángulo de polarización (de 0º a 180º) junto a 'ax'.
+    '''
+    cbar=fig.colorbar(mtp.cm.ScalarMappable(norm=colors.Normalize(0,1),cmap=mtp.colormaps.get_cmap('viridis')),ax=ax)
+    bar_values,bar_labels=color_bar_values(6)
+    # Establecer las posiciones de las etiquetas
+    cbar.set_ticks(bar_values)
+    # Establecer las etiquetas
+    cbar.set_ticklabels(bar_labels)
+    if labelsize is not None:
+        cbar.ax.tick_params(labelsize=labelsize)# Cambiamos el tamaño de las etiquetas de la barra de colores
+    return cbar
+
+def draw_cartesian_3D_clusters(fig,catalog_with_clusters:pd.DataFrame,clusters_catalog:pd.DataFrame,perpendicular:bool,summary:pd.DataFrame=None):
+    '''
+    Dibuja en la figura 'fig' el mapa de 'cartesian_plot_3D_clusters' sin usar el estado global de 'pyplot'.
+
     Retorno:
     --------
-    Muestra el mapa del plano galáctico con la dirección de polarización del sector al que pertenece así como el perímetro del cluster.
+    El 'Axes' del mapa.
     '''
     if perpendicular:
         added_angle=90
     else:
         added_angle=0
-    plt.figure(figsize=(13,5)) #Relación de aspecto del mapa
-    plt.gca().set_facecolor('black') #Color de fondo del mapa
+    fig.set_size_inches(13,5) #Relación de aspecto del mapa
+    ax=fig.add_subplot(111)
+    ax.set_facecolor('black') #Color de fondo del mapa
     #establecemos los límites del gráfico
-    plt.xlim(-180,180)
-    plt.ylim(-90,90)
+    ax.set_xlim(-180,180)
+    ax.set_ylim(-90,90)
     # Crear un mapa de colores 'viridis'
-    cmap = plt.get_cmap('viridis')
-    plt.xlabel("Galactic longitude (°)")
-    plt.ylabel("Galactic latitude (°)")
+    cmap = mtp.colormaps.get_cmap('viridis')
+    ax.set_xlabel("Galactic longitude (°)")
+    ax.set_ylabel("Galactic latitude (°)")
     #Dibujamos la cuadrícula. Si utilizo el 'grid' de matplotlib no acepta ni la relación de aspecto ni el fondo de color
     for y in range(-80,81,10):
-        plt.plot((-180,180),(y,y),'white',linewidth=0.1,linestyle=(30, (10, 20))) #Cuadrícula horizontal (lineas de 10 separadas 20)
+        ax.plot((-180,180),(y,y),'white',linewidth=0.1,linestyle=(30, (10, 20))) #Cuadrícula horizontal (lineas de 10 separadas 20)
     
     for x in range(-180,181,10):
-        plt.plot((x,x),(-90,90),'white',linewidth=0.1,linestyle=(0, (10, 20))) #Cuadrícula vertical (lineas de 10 separadas 20)
+        ax.plot((x,x),(-90,90),'white',linewidth=0.1,linestyle=(0, (10, 20))) #Cuadrícula vertical (lineas de 10 separadas 20)
     # Dibujar la dirección de cada cluster
     
-    for n in range(len(clusters_catalog)):
-        x1,y1,x2,y2,colors=direction_bar_coordinates(clusters_catalog.loc[n,'longitude'],clusters_catalog.loc[n,'latitude'],clusters_catalog.loc[n,'angle']+added_angle,8)
-        plt.scatter(clusters_catalog.loc[n,'longitude'], clusters_catalog.loc[n,'latitude'], color=cmap(colors),marker="o",s=0.1)
-        plt.plot((x1,x2),(y1,y2),color=cmap(colors),linewidth=0.25)
+    x1,y1,x2,y2,bar_colors=direction_bar_coordinates(clusters_catalog['longitude'],clusters_catalog['latitude'],clusters_catalog['angle']+added_angle,8)
+    ax.scatter(clusters_catalog['longitude'], clusters_catalog['latitude'], color=cmap(bar_colors),marker="o",s=0.1)
+    draw_direction_bars(x1,y1,x2,y2,cmap(bar_colors),0.25,ax=ax)
     
-    cluster_outline(catalog_with_clusters,perpendicular)
-    plt.title("Polarization direction")
-    cbar=plt.colorbar()
-    bar_values,bar_labels=color_bar_values(6)
-    # Establecer las posiciones de las etiquetas
-    cbar.set_ticks(bar_values)
-    # Establecer las etiquetas
-    cbar.set_ticklabels(bar_labels)
-    jpg_creator(image_file)
-    plt.show()
+    cluster_outline(catalog_with_clusters,perpendicular,summary,ax=ax)
+    ax.set_title("Polarization direction")
+    add_angle_color_bar(fig,ax)
+    return ax
 
-def mollweide_plot_3D_clusters(catalog_with_clusters:pd.DataFrame,clusters_catalog:pd.DataFrame,perpendicular:bool,image_file=None):
+@instrumented
+def cartesian_plot_3D_clusters(catalog_with_clusters:pd.DataFrame,clusters_catalog:pd.DataFrame,perpendicular:bool,image_file:chr=None,summary:pd.DataFrame=None):
     '''
     Parametros:
     -----------
     catalog_with_clusters: DataFrame de pandas. Debe contener al menos longitud 'longitude', latitud 'latitude' y angulo de polarización de su sector 'angle' y el número de cluster 'cluster'.
-    clusters_catalog:  DataFrame de pandas. Debe contener al menos la longitud 'longitude' y latitud 'latitude' del centro de gravedad de cada cluster así como el ángulo del sector al que pertenece.
-    number_of_sectors: Número de sectores utilizados para deteminar los puntos que pertenecen a un cluster. Se usa para poder indicar la toleráncia de ángulo usada para seleccionar los puntos que pertenecen a un cluster.
+    clusters_catalog:  DataFrame de pandas. Debe contener al menos la longitud 'longitude' y latitud 'latitude' del centro de gravedad de cada cluster así como el ángulo medio del cluster al que pertenece.
     perpendicular: Si es 'True' nos representa la perpendicular, es decir la dirección del campo magnético asociado a esta polarización.
     image_file: Si se introduce un nombre, se graba una imagen con este nombre en el directorio de trabajo.
+    summary: Resumen de los clusters obtenido con 'cluster_summary' para dibujar los perímetros sin volver a recorrer el catálogo.
     
     Retorno:
     --------
     Muestra el mapa del plano galáctico con la dirección de polarización del sector al que pertenece así como el perímetro del cluster.
     '''
+    draw_cartesian_3D_clusters(plt.figure(),catalog_with_clusters,clusters_catalog,perpendicular,summary)
+    jpg_creator(image_file)
+    plt.show()
+
+def draw_mollweide_3D_clusters(fig,catalog_with_clusters:pd.DataFrame,clusters_catalog:pd.DataFrame,perpendicular:bool,summary:pd.DataFrame=None):
     '''
-    Para trabajar con la proyección Mollweide necesitamos que los ángulos estén en radianes.
-    Para ello modificamos tanto la longitud y latitud como el ángulo de polarización.
+    Dibuja en la figura 'fig' el mapa de 'mollweide_plot_3D_clusters' sin usar el estado global de 'pyplot'.
+    A diferencia de 'mollweide_plot_3D_clusters', no modifica los DataFrames de entrada (en grados).
+    Los puntos, las barras y los perímetros se proyectan de una vez con 'mollweide_projection' y se dibujan en un 'Axes' normal.
+    Si 'clusters_catalog' ya contiene su geometría ('mollweide_geometry' con la misma orientación) no se vuelve a proyectar.
+    Si se entrega 'summary' (ver 'cluster_summary'), 'catalog_with_clusters' debe estar ordenado por cluster y no se vuelve a recorrer.
+
+    Retorno:
+    --------
+    El 'Axes' del mapa.
     '''
     if perpendicular:
-        added_angle=np.pi/2
+        added_angle=90
     else:
         added_angle=0
-    
-    catalog_with_clusters['longitude']=deg_to_rad(catalog_with_clusters['longitude'])
-    catalog_with_clusters['latitude']=deg_to_rad(catalog_with_clusters['latitude'])
-    catalog_with_clusters['angle']=deg_to_rad(catalog_with_clusters['angle'])
-
-    clusters_catalog['longitude']=deg_to_rad(clusters_catalog['longitude'])
-    clusters_catalog['latitude']=deg_to_rad(clusters_catalog['latitude'])
-    clusters_catalog['angle']=deg_to_rad(clusters_catalog['angle'])
-
-    # Crear una figura
-    plt.figure()
-
-    # Crear un subplot con la proyección de Mollweide
-    plt.subplot(111, projection="mollweide")
-    
-    # Color de fondo
-    plt.grid(True,color='black',linewidth=0.1)
+    bar_length=np.degrees(0.1) # El mismo largo de barra que en radianes (0.1)
 
-    #Color y tamaño de las etiquetas de los ejes de longitud y latitud
-    plt.tick_params(axis='x',colors='black',labelsize=4)
-    plt.tick_params(axis='y',colors='black',labelsize=4)
-    
-    # Color de fondo
-    plt.gca().set_facecolor('white') #Color de fondo del mapa
+    ax=fig.add_subplot(111)
+    sky=draw_mollweide_frame(ax,labelsize=4)
     
     #Gradación de colores según 'viridis'
-    cmap = plt.get_cmap('viridis')
+    cmap = mtp.colormaps.get_cmap('viridis')
 
     # Dibujar la dirección de cada cluster
-    for n in range(len(clusters_catalog)):
-        x1,y1,x2,y2,colors=direction_bar_coordinates_rad(clusters_catalog.loc[n,'longitude'],clusters_catalog.loc[n,'latitude'],clusters_catalog.loc[n,'angle']+added_angle,0.1)
-        plt.scatter(clusters_catalog.loc[n,'longitude'], clusters_catalog.loc[n,'latitude'], color=cmap(colors),marker="o",s=0.1)
-        plt.plot((x1,x2),(y1,y2),color=cmap(colors),linewidth=0.25)
+    if not has_mollweide_geometry(clusters_catalog,bar_length,added_angle):
+        clusters_catalog=mollweide_geometry(clusters_catalog,bar_length,added_angle)
+    x,y,x1,y1,x2,y2,bar_colors=[clusters_catalog[name].to_numpy() for name in MOLLWEIDE_GEOMETRY_COLUMNS]
+    ax.scatter(x,y,color=cmap(bar_colors),marker="o",s=0.1).set_clip_path(sky)
+    draw_direction_bars(x1,y1,x2,y2,cmap(bar_colors),0.25,ax=ax).set_clip_path(sky)
+
+    # Perímetro de cada cluster: calculado en longitud y latitud (ver 'cluster_polygons') y dibujado con los vértices proyectados
+    if summary is None:
+        summary,order=cluster_summary(catalog_with_clusters)
+        catalog_with_clusters=catalog_with_clusters.take(order)
+    polygons=[np.column_stack(mollweide_projection(polygon[:,0],polygon[:,1])) for polygon in cluster_polygons(catalog_with_clusters,summary)]
+    draw_cluster_outlines(ax,polygons,outline_color(summary['angle'],added_angle,180)).set_clip_path(sky)
+    add_angle_color_bar(fig,ax,labelsize=6)
+    return ax
+
+@instrumented
+def mollweide_plot_3D_clusters(catalog_with_clusters:pd.DataFrame,clusters_catalog:pd.DataFrame,perpendicular:bool,image_file=None,summary:pd.DataFrame=None):
+    '''
+    Parametros:
+    -----------
+    catalog_with_clusters: DataFrame de pandas. Debe contener al menos longitud 'longitude', latitud 'latitude' y angulo de polarización de su sector 'angle' y el número de cluster 'cluster'.
+    clusters_catalog:  DataFrame de pandas. Debe contener al menos la longitud 'longitude' y latitud 'latitude' del centro de gravedad de cada cluster así como el ángulo del sector al que pertenece.
+    number_of_sectors: Número de sectores utilizados para deteminar los puntos que pertenecen a un cluster. Se usa para poder indicar la toleráncia de ángulo usada para seleccionar los puntos que pertenecen a un cluster.
+    perpendicular: Si es 'True' nos representa la perpendicular, es decir la dirección del campo magnético asociado a esta polarización.
+    image_file: Si se introduce un nombre, se graba una imagen con este nombre en el directorio de trabajo.
+    summary: Resumen de los clusters obtenido con 'cluster_summary' para dibujar los perímetros sin volver a recorrer el catálogo.
     
-    cluster_outline_rad(catalog_with_clusters,perpendicular)
-    cbar=plt.colorbar()
-    bar_values,bar_labels=color_bar_values(6)
-    # Establecer las posiciones de las etiquetas
-    cbar.set_ticks(bar_values)
-    # Establecer las etiquetas
-    cbar.set_ticklabels(bar_labels)
-    cbar.ax.tick_params(labelsize=6)# Cambiamos el tamaño de las etiquetas de la barra de colores
-    if image_file!=None:
-        plt.savefig(image_file,bbox_inches='tight',dpi=1200)
+    Retorno:
+    --------
+    Muestra el mapa del plano galáctico con la dirección de polarización del sector al que pertenece así como el perímetro del cluster.
+    '''
+    draw_mollweide_3D_clusters(plt.figure(),catalog_with_clusters,clusters_catalog,perpendicular,summary)
+    # Como hasta ahora, los DataFrames de entrada quedan en radianes.
+    for dataframe in (catalog_with_clusters,clusters_catalog):
+        dataframe['longitude']=deg_to_rad(dataframe['longitude'])
+        dataframe['latitude']=deg_to_rad(dataframe['latitude'])
+        dataframe['angle']=deg_to_rad(dataframe['angle'])
+    jpg_creator(image_file)
     plt.show()
 
+MAP_RENDERERS={'cartesian_zones':draw_cartesian_by_zones,'mollweide_zones':draw_mollweide_by_zones,
+               'cartesian_clusters':draw_cartesian_3D_clusters,'mollweide_clusters':draw_mollweide_3D_clusters} # Funciones de dibujo de cada tipo de mapa
+
+def new_figure():
+    '''
+    'Figure' de 'matplotlib' con su propio 'canvas' Agg, independiente de 'pyplot': no se registra en la lista de figuras de 'pyplot',
+    no abre ninguna ventana y se libera como cualquier otro objeto. Se puede usar desde varios hilos o procesos a la vez.
+    '''
+    fig=Figure()
+    FigureCanvasAgg(fig)
+    return fig
+
+def save_figure_name(image_file:str):
+    '''
+    Nombre con el que 'save_figure' graba 'image_file': se añade '.jpg' si no tiene extensión.
+    '''
+    return image_file if os.path.splitext(image_file)[1]!="" else image_file+".jpg"
+
+def save_figure(fig,image_file:str=None,dots_per_inch:int=1200):
+    '''
+    Graba la figura 'fig' igual que 'jpg_creator' graba la figura actual de 'pyplot': si 'image_file' no tiene extensión se graba en '.jpg'.
+
+    Retorno:
+    --------
+    Nombre del fichero grabado, o 'None' si no se ha indicado ninguno.
+    '''
+    if image_file is None or image_file=="":
+        return None
+    image_file=save_figure_name(image_file)
+    fig.savefig(image_file,bbox_inches='tight',dpi=dots_per_inch)
+    return image_file
+
+def render_map(kind:str,*args,image_file:str=None,dots_per_inch:int=1200):
+    '''
+    Dibuja un mapa en una figura nueva independiente de 'pyplot' (ver 'new_figure') y, si se indica, lo graba.
+
+    Parametros:
+    -----------
+    kind: Tipo de mapa (ver 'MAP_RENDERERS').
+    args: Parámetros de la función de dibujo, por ejemplo (zonas, zone_size, perpendicular) para 'cartesian_zones'.
+    image_file: Nombre del fichero de imagen (ver 'save_figure').
+    dots_per_inch: Resolución de la imagen.
+
+    Retorno:
+    --------
+    La 'Figure' dibujada.
+    '''
+    fig=new_figure()
+    MAP_RENDERERS[kind](fig,*args)
+    save_figure(fig,image_file,dots_per_inch)
+    return fig
+
+def render_map_task(job:dict):
+    '''
+    Dibuja y graba en un proceso uno de los mapas de 'render_maps'.
+    '''
+    render_map(job['kind'],*job['args'],image_file=job['image_file'],dots_per_inch=job.get('dots_per_inch',1200))
+    return save_figure_name(job['image_file'])
+
+def render_maps(jobs:list,processes:int=None):
+    '''
+    Dibuja y graba varios mapas a la vez, cada uno en un proceso, sin 'pyplot' (con el 'backend' Agg, sin ventanas).
+    Por ejemplo, las variantes cartesiana, Mollweide y perpendicular de un mismo cálculo:
+
+        render_maps([{'kind':'cartesian_zones','args':(zonas,3,False),'image_file':'cartesiano'},
+                     {'kind':'cartesian_zones','args':(zonas,3,True),'image_file':'cartesiano_perpendicular'},
+                     {'kind':'mollweide_zones','args':(zonas,3,False),'image_file':'mollweide'}])
+
+    Parametros:
+    -----------
+    jobs: Lista de diccionarios con 'kind', 'args' e 'image_file' (y opcionalmente 'dots_per_inch'). Ver 'render_map'.
+    processes: Número de procesos. Por defecto uno por procesador. Con 1 los mapas se dibujan uno tras otro en este proceso.
+
+    Retorno:
+    --------
+    Lista de nombres de los ficheros grabados, en el orden de 'jobs'.
+    '''
+    if processes==1 or len(jobs)<=1:
+        return [render_map_task(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(render_map_task,jobs))
+
+PIPELINE_DEFAULTS={'task':1, # 1: zonas en cartesianas, 2: zonas en Mollweide, 3: clusters en cartesianas, 4: clusters en Mollweide
+                   'url':"https://cdsarc.cds.unistra.fr/viz-bin/nph-Cat/fits?II/226/catalog.dat.gz",'catalog_cache_dir':".catalog_cache",
+                   'lon_min':-180,'lon_max':180,'lat_min':-90,'lat_max':90,'pol_min':0.1,'ang_err_max':45,
+                   'zone_size':3,'zone_scheme':'grid','sigma_limit':3,'bootstrap':0,'seed':None,
+                   'field_smoothing':None, # Si se indica, las tareas 1 y 2 dibujan el campo continuo de 'stokes_field_map' (sigma en º) con píxeles de 'zone_size' en lugar de las zonas. Solo con 'zone_scheme' igual a 'grid'
+                   'max_separation':4,'min_num_points':20,'cluster_metric':'euclidean','angle_weight':1.0,
+                   'perpendicular':False,'write_tables':True,'write_images':True,'compact':False,
+                   'show':True} # Parámetros de 'polarization_pipeline'. Con 'show' igual a 'False' los mapas se dibujan sin 'pyplot' (ver 'render_map') y solo se graban
+TASK_DEFAULTS={1:{},2:{},3:{'pol_min':0.25,'ang_err_max':30,'perpendicular':True},4:{'pol_min':0.25,'ang_err_max':30,'perpendicular':True}} # Valores propios de cada tarea
+
+def pipeline_config(task:int=1,**parameters):
+    '''
+    Parámetros de 'polarization_pipeline' para una tarea: 'PIPELINE_DEFAULTS', los valores propios de la tarea ('TASK_DEFAULTS') y 'parameters'.
+    '''
+    config=dict(PIPELINE_DEFAULTS,**TASK_DEFAULTS[task],task=task)
+    unknown=set(parameters)-set(PIPELINE_DEFAULTS)
+    if unknown:
+        raise ValueError(f'Parámetros desconocidos: {sorted(unknown)}')
+    config.update(parameters)
+    return config
+
+class polarization_pipeline:
+    '''
+    Programa principal por etapas, cada una calculada solo cuando se pide y guardada ('memoizada') con una clave que depende de sus
+    parámetros y de la clave de la etapa de la que parte. Al cambiar un parámetro solo se recalculan las etapas que dependen de él:
+    por ejemplo, cambiar 'perpendicular' solo vuelve a dibujar el gráfico y cambiar 'sigma_limit' solo repite 'statistics'.
+
+    Etapas (y parámetros de los que dependen):
+     - catalog: 'url', 'catalog_cache_dir', 'compact' (si es 'True' se usa el catálogo compacto de 'compact_catalog').
+     - selection: 'catalog' y 'lon_min', 'lon_max', 'lat_min', 'lat_max', 'pol_min', 'ang_err_max'.
+     - zones: 'selection' y 'zone_size', 'zone_scheme'.
+     - statistics: 'zones' y 'sigma_limit', 'bootstrap', 'seed'.
+     - field: 'selection' y 'zone_size', 'field_smoothing'.
+     - clusters: 'selection' y 'max_separation', 'min_num_points', 'cluster_metric', 'angle_weight'.
+     - summary: 'clusters' (resumen de 'cluster_summary', compartido por 'centers' y los gráficos de clusters).
+ - centers: 'summary'.
+     - plot: según 'task' y 'perpendicular'. No se guarda.
+
+    Parametros:
+    -----------
+    config: Diccionario de parámetros (ver 'pipeline_config'). Los que falten toman el valor de 'PIPELINE_DEFAULTS'.
+    memo_dir: Si se indica, el resultado de cada etapa se graba también en este directorio (formato 'npz') y se reutiliza en ejecuciones posteriores.
+    '''
+    def __init__(self,config:dict=None,memo_dir:str=None):
+        self.config=dict(PIPELINE_DEFAULTS)
+        self.memo={}
+        self.keys={}
+        self.memo_dir=memo_dir
+        self.computed=[] # Etapas calculadas (no reutilizadas) desde la creación o el último 'update'
+        self.update(**(config or {}))
+
+    def update(self,**parameters):
+        '''
+        Cambia parámetros. Las etapas ya calculadas se conservan y se reutilizan si sus parámetros no han cambiado.
+        '''
+        unknown=set(parameters)-set(PIPELINE_DEFAULTS)
+        if unknown:
+            raise ValueError(f'Parámetros desconocidos: {sorted(unknown)}')
+        self.config.update(parameters)
+        self.computed=[]
+        return self
+
+    def memoized(self,name:str,upstream:str,parameter_names:list,compute):
+        '''
+        Devuelve el resultado de la etapa 'name', calculándolo con 'compute()' solo si no está en memoria ni en 'memo_dir'.
+        '''
+        content=json.dumps({'stage':name,'upstream':self.keys.get(upstream),'parameters':{parameter:self.config[parameter] for parameter in parameter_names}},sort_keys=True)
+        key=hashlib.sha256(content.encode('utf-8')).hexdigest()
+        self.keys[name]=key
+        if key in self.memo:
+            return self.memo[key]
+        memo_file=os.path.join(self.memo_dir,f'{name}_{key}.npz') if self.memo_dir is not None else None
+        if memo_file is not None and os.path.isfile(memo_file):
+            result=table_reader(memo_file)
+        else:
+            result=compute()
+            self.computed.append(name)
+            if memo_file is not None:
+                os.makedirs(self.memo_dir,exist_ok=True)
+                table_writer(result,memo_file,'npz')
+        self.memo[key]=result
+        return result
+
+    def table_file(self,file_name:str):
+        return file_name if self.config['write_tables'] else None
+
+    def catalog(self):
+        def compute():
+            catalog=read_catalog(self.config['url'],csv_file=self.table_file("0_initial_catalog.csv"),cache_dir=self.config['catalog_cache_dir'])
+            return compact_catalog(catalog) if self.config['compact'] else catalog
+        return self.memoized('catalog',None,['url','catalog_cache_dir','compact'],compute)
+
+    def selection(self):
+        catalog=self.catalog()
+        def compute():
+            config=self.config
+            mask=cutout_mask(catalog,config['lon_min'],config['lon_max'],config['lat_min'],config['lat_max'],config['pol_min'],config['ang_err_max'],positive_error=True)
+            return apply_mask(catalog,mask)
+        return self.memoized('selection','catalog',['lon_min','lon_max','lat_min','lat_max','pol_min','ang_err_max'],compute)
+
+    def zones(self):
+        selection=self.selection()
+        def compute():
+            polarization_data=add_coords_of_zone_center(selection.copy(deep=False),self.config['zone_size'],self.table_file("1_catalog_with_zones.csv"),self.config['zone_scheme']) # 'add_coords_of_zone_center' añade columnas a su entrada: basta una copia superficial, sin copiar los datos
+            return order_catalog(polarization_data,'zone_lon','zone_lat',self.table_file("2_catalog_ordered.csv"))
+        return self.memoized('zones','selection',['zone_size','zone_scheme'],compute)
+
+    def statistics(self):
+        zones=self.zones()
+        return self.memoized('statistics','zones',['sigma_limit','bootstrap','seed'],lambda:statistics_per_zone(zones,self.config['sigma_limit'],self.table_file('3_polarizationxzones.csv'),
+                                                                                                       self.config['bootstrap'],self.config['seed']))
+
+    def field(self):
+        if self.config['zone_scheme']!='grid':
+            raise ValueError(f"El campo continuo ('field_smoothing') solo se calcula en una rejilla 'grid', no con 'zone_scheme' igual a '{self.config['zone_scheme']}'")
+        selection=self.selection()
+        return self.memoized('field','selection',['zone_size','field_smoothing'],
+                             lambda:stokes_field_map(selection,self.config['zone_size'],self.config['field_smoothing'],csv_file=self.table_file('3_polarization_field.csv')))
+
+    def zone_table(self):
+        '''
+        Tabla por zonas de las tareas 1 y 2: el campo continuo ('field') si se ha indicado 'field_smoothing' y si no la estadística por zonas ('statistics').
+        '''
+        return self.statistics() if self.config['field_smoothing'] is None else self.field()
+
+    def clusters(self):
+        selection=self.selection()
+        return self.memoized('clusters','selection',['max_separation','min_num_points','cluster_metric','angle_weight'],
+                             lambda:cluster_catalog_creator(selection,self.config['max_separation'],self.config['min_num_points'],self.table_file("1_catalog_with_clusters.csv"),
+                                                            self.config['cluster_metric'],self.config['angle_weight']))
+
+    def summary(self):
+        catalog_with_clusters=self.clusters()
+        return self.memoized('summary','clusters',[],lambda:cluster_summary(catalog_with_clusters)[0])
+
+    def centers(self):
+        catalog_with_clusters=self.clusters()
+        summary=self.summary()
+        return self.memoized('centers','summary',[],lambda:clusters_center(catalog_with_clusters,self.table_file("2_clusters_catalog.csv"),summary))
+
+    def plot(self):
+        '''
+        Dibuja el gráfico de la tarea 'task' (siempre se vuelve a dibujar; las etapas que necesita se reutilizan).
+        '''
+        task=self.config['task']
+        perpendicular=self.config['perpendicular']
+        image_file=lambda name:name if self.config['write_images'] else None
+        if not self.config['show']:
+            if task in (1,2):
+                args=(self.zone_table(),self.config['zone_size'],perpendicular)
+            else:
+                args=(self.clusters(),self.centers(),perpendicular,self.summary())
+            kind,name=[('cartesian_zones',"4_cartesian_plot_by_zones"),('mollweide_zones',"4_mollweide_plot_by_zones"),
+                       ('cartesian_clusters',"3_cartesian_plot_3D_cluster"),('mollweide_clusters',"3_mollweide_plot_3D_cluster")][task-1]
+            render_map(kind,*args,image_file=image_file(name))
+        elif task==1:
+            cartesian_plot_by_zones(self.zone_table(),self.config['zone_size'],perpendicular,image_file("4_cartesian_plot_by_zones"))
+        elif task==2:
+            mollweide_plot_by_zones(self.zone_table(),self.config['zone_size'],perpendicular,image_file("4_mollweide_plot_by_zones"))
+        elif task==3:
+            catalog_with_clusters=self.clusters()
+            cartesian_plot_3D_clusters(catalog_with_clusters,self.centers(),perpendicular,image_file("3_cartesian_plot_3D_cluster"),self.summary())
+        else:
+            catalog_with_clusters=self.clusters()
+            mollweide_plot_3D_clusters(catalog_with_clusters.copy(),self.centers().copy(),perpendicular,image_file("3_mollweide_plot_3D_cluster"),self.summary()) # Esta función pasa los datos a radianes, por eso se le da una copia
+
+    def run(self):
+        '''
+        Calcula las etapas necesarias para la tarea 'task' y dibuja su gráfico.
+
+        Retorno:
+        --------
+        Tabla final de la tarea ('statistics', 'field' o 'centers').
+        '''
+        self.plot()
+        return self.zone_table() if self.config['task'] in (1,2) else self.centers()
+
+def pipeline_arguments(arguments=None):
+    '''
+    Lee los argumentos del modo por lotes del programa principal:
+
+        python galaxy_polarization_functions04.py --task 1 --set sigma_limit=2 --set perpendicular=true
+        python galaxy_polarization_functions04.py --config runs.json --memo-dir .pipeline_memo
+
+    El fichero 'json' de '--config' es un diccionario de parámetros (ver 'PIPELINE_DEFAULTS') y puede contener una lista 'runs'
+    de diccionarios que modifican esos parámetros: cada uno es una ejecución y todas comparten las etapas ya calculadas.
+    Los valores de '--set' se leen como 'json' (o como texto si no lo son) y tienen prioridad sobre los del fichero.
+
+    Retorno:
+    --------
+    memo_dir: Directorio de 'memo_dir' o 'None'.
+    runs: Lista de diccionarios de parámetros, uno por ejecución.
+    '''
+    parser=argparse.ArgumentParser(description='Mapas de polarización por zonas o por clusters')
+    parser.add_argument('--task',type=int,choices=[1,2,3,4],help='1/2: zonas en cartesianas/Mollweide, 3/4: clusters en cartesianas/Mollweide')
+    parser.add_argument('--config',help="Fichero 'json' de parámetros")
+    parser.add_argument('--set',action='append',default=[],metavar='PARAMETRO=VALOR',help='Cambia un parámetro')
+    parser.add_argument('--memo-dir',help='Directorio en el que se guardan los resultados de cada etapa entre ejecuciones')
+    arguments=parser.parse_args(arguments)
+    config={}
+    if arguments.config:
+        with open(arguments.config) as file:
+            config=json.load(file)
+    runs=config.pop('runs',[{}])
+    command_line={}
+    for assignment in arguments.set:
+        name,value=assignment.split('=',1)
+        try:
+            command_line[name]=json.loads(value)
+        except json.JSONDecodeError:
+            command_line[name]=value
+    if arguments.task is not None:
+        command_line['task']=arguments.task
+    runs=[{**config,**run,**command_line} for run in runs]
+    return arguments.memo_dir,[pipeline_config(run.pop('task',1),**run) for run in runs]
+
 if __name__=="__main__":
-    task=input('''
+    if len(sys.argv)>1: # Modo por lotes (ver 'pipeline_arguments')
+        memo_dir,runs=pipeline_arguments()
+        pipeline=polarization_pipeline(memo_dir=memo_dir)
+        for config in runs:
+            pipeline.update(**dict(config,show=False)).run() # Sin ventanas: los mapas solo se graban
+            print(f"Tarea {config['task']} finalizada. Etapas calculadas: {pipeline.computed or 'ninguna (todas reutilizadas)'}")
+    else:
+        task=int(input('''
 1.- Por zonas y grafico en cartesianas
 2.- Por zonas y grafico en proyección Mollweide
 3.- Clustering 3D y grafico en cartesianas
 4.- Clustering 3D y grafico en proyección Mollweide
-? ''')
-    polarization_data=read_catalog(csv_file="0_initial_catalog.csv") #Lectura del catálogo
-    print('Finalizada la lectura del catálogo')
-    task=int(task)
-    if task==1 or task==2:
-        zone_size=3
-        sigma_limit=3
-        longitude_min=-180
-        longitude_max=180
-        latitude_min=-90
-        latitude_max=90
-        pol_min=0.1
-        ang_err_max=45
-        perpendicular=False
-        print(f'''
-zone_size={zone_size}\t\tsigma_limit={sigma_limit}
-longitude_min={longitude_min}\tlongitude_max={longitude_max}
-latitude_min={latitude_min}\tlatitude_max={latitude_max}
-pol_min={pol_min}\t\tang_err_max={ang_err_max}
-perpendicular={perpendicular}''')
-        polarization_data=space_cutout(polarization_data,longitude_min,longitude_max,latitude_min,latitude_max)
-        polarization_data=values_cutout(polarization_data,pol_min,ang_err_max)
-        polarization_data=add_coords_of_zone_center(polarization_data,zone_size,"1_catalog_with_zones.csv")
-        polarization_data=order_catalog(polarization_data,'zone_lon','zone_lat',"2_catalog_ordered.csv")
-        polarizationxzones=statistics_per_zone(polarization_data,sigma_limit,'3_polarizationxzones.csv')
-        print('Finalizado el cálculo por zonas')
-        if task==1:
-            print('Iniciando el trazado por zonas del mapa en cartesianas')
-            cartesian_plot_by_zones(polarizationxzones,zone_size,perpendicular,"4_cartesian_plot_by_zones")
-        else:
-            print('Iniciando el trazado por zonas del mapa en proyección Mollweide')
-            mollweide_plot_by_zones(polarizationxzones,zone_size,perpendicular,"4_mollweide_plot_by_zones")
-    elif task==3 or task==4:
-        print('Iniciando el trazado por clusters (2D) del mapa en cartesianas')
-        longitude_min=-180
-        longitude_max=180
-        latitude_min=-90
-        latitude_max=90
-        pol_min=0.25
-        ang_err_max=30
-        maximum_distance_between_neighbors=4
-        minimum_number_of_neighbors=20
-        perpendicular=True
-        print(f'''
-longitude_min={longitude_min}\tlongitude_max={longitude_max}
-latitude_min={latitude_min}\tlatitude_max={latitude_max}
-pol_min={pol_min}\t\tang_err_max={ang_err_max}
-maximum_distance_between_neighbors={maximum_distance_between_neighbors}
-minimum_number_of_neighbors={minimum_number_of_neighbors}
-perpendicular={perpendicular}
-''')
-        polarization_data=space_cutout(polarization_data,longitude_min,longitude_max,latitude_min,latitude_max)
-        polarization_data=values_cutout(polarization_data,pol_min,ang_err_max)
-        catalog_with_clusters=cluster_catalog_creator(polarization_data,maximum_distance_between_neighbors,minimum_number_of_neighbors,"1_catalog_with_clusters.csv") #Sustituye el ángulo de cada punto por el ángulo del sector y añade el nº de cluster al que pertenece (los puntos que no pertenecen a ningun cluster son eliminados)
-        clusters_catalog=clusters_center(catalog_with_clusters,"2_clusters_catalog.csv") #Crea un nuevo DataFrame conteniendo las coordenadas del centro de gravedad de cada cluster y el ángulo del sector asociado.
-        if task==3:
-            cartesian_plot_3D_clusters(catalog_with_clusters,clusters_catalog,perpendicular,"3_cartesian_plot_3D_cluster") #Presenta el mapa de polarización conteniendo la dirección por sectores de los puntos y de cada cluster.
+? '''))
+        pipeline=polarization_pipeline(pipeline_config(task))
+        pipeline.catalog() #Lectura del catálogo (desde la caché local a partir de la segunda ejecución)
+        print('Finalizada la lectura del catálogo')
+        print('\n'.join(f'{name}={value}' for name,value in pipeline.config.items() if name not in ('url','catalog_cache_dir','write_tables','write_images')))
+        if task==1 or task==2:
+            pipeline.statistics() #Recorte, zonas y cálculo por zonas
+            print('Finalizado el cálculo por zonas')
+            print('Iniciando el trazado por zonas del mapa en '+('cartesianas' if task==1 else 'proyección Mollweide'))
         else:
-            mollweide_plot_3D_clusters(catalog_with_clusters,clusters_catalog,perpendicular,"3_mollweide_plot_3D_cluster") #Presenta el mapa de polarización conteniendo la dirección por sectores de los puntos y de cada cluster.
\ No newline at end of file
+            print('Iniciando el trazado por clusters del mapa en '+('cartesianas' if task==3 else 'proyección Mollweide'))
+        pipeline.plot()
+    report=write_run_report("run_report.json") #Tiempo, memoria y filas de cada etapa
+    print(report[report['depth']==0][['stage','wall_s','cpu_s','rows_in','rows_out']].to_string(index=False))
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+import pytest
+import galaxy_polarization_functions04 as gp
+
+def zone_arrays(seed:int=0):
+    '''
+    Zonas de prueba ordenadas y consecutivas: zonas normales, una de un solo punto, una con todos los ángulos iguales
+    (desviación estándar cero) y tolerancias nulas o negativas que se sustituyen por la máxima de la zona.
+    '''
+    rng=np.random.default_rng(seed)
+    points=[12,1,5,30,3,8]
+    rows_number=sum(points)
+    polarization=rng.uniform(0,5,rows_number)
+    polarization_error=rng.uniform(0.05,0.5,rows_number)
+    angle=rng.uniform(0,180,rows_number)
+    angle_error=rng.uniform(1,15,rows_number)
+    starts=np.cumsum([0]+points[:-1])
+    angle[starts[2]:starts[3]]=42.0
+    polarization_error[starts[3]]=0.0
+    angle_error[starts[3]+1]=-1.0
+    angle[starts[3]+2]=179.0
+    return polarization,polarization_error,angle,angle_error,starts
+
+def reference_statistics(polarization,polarization_error,angle,angle_error,starts,sigma_limit):
+    '''
+    'outliers_by_sigma' y 'weighted_average' aplicadas zona a zona.
+    '''
+    stops=np.append(starts[1:],len(angle))
+    zone_pol,zone_ang,points_after=[],[],[]
+    for start,stop in zip(starts,stops):
+        polxzone,pol_errxzone,angxzone,ang_errxzone=gp.outliers_by_sigma(*[list(column[start:stop]) for column in (polarization,polarization_error,angle,angle_error)],sigma_limit)
+        zone_pol.append(gp.weighted_average(polxzone,pol_errxzone))
+        zone_ang.append(gp.weighted_average(angxzone,ang_errxzone))
+        points_after.append(len(polxzone))
+    return np.array(zone_pol),np.array(zone_ang),np.array(points_after)
+
+def python_zone_kernel(polarization,polarization_error,angle,angle_error,starts,sigma_limit):
+    '''
+    'fused_zone_statistics' sin compilar.
+    '''
+    zone_pol=np.empty(len(starts))
+    zone_ang=np.empty(len(starts))
+    points_after=np.empty(len(starts),dtype=np.int64)
+    gp.fused_zone_statistics(polarization,polarization_error,angle,angle_error,starts,sigma_limit,zone_pol,zone_ang,points_after)
+    return zone_pol,zone_ang,points_after
+
+KERNELS={'numpy':gp.numpy_zone_kernel,
+         'python':python_zone_kernel,
+         'numba':pytest.param(gp.numba_zone_kernel,marks=pytest.mark.skipif(gp.numba is None,reason="'numba' no está instalado"))}
+
+@pytest.mark.parametrize('kernel',KERNELS.values(),ids=KERNELS.keys())
+@pytest.mark.parametrize('sigma_limit',[0.5,1,2])
+@pytest.mark.parametrize('seed',[0,1,2])
+def test_zone_kernel_matches_reference(kernel,sigma_limit,seed):
+    arrays=zone_arrays(seed)
+    zone_pol,zone_ang,points_after=kernel(*arrays,sigma_limit)
+    reference_pol,reference_ang,reference_points=reference_statistics(*arrays,sigma_limit)
+    np.testing.assert_allclose(zone_pol,reference_pol,rtol=1e-9,atol=0)
+    np.testing.assert_allclose(zone_ang,reference_ang,rtol=1e-9,atol=0)
+    np.testing.assert_array_equal(points_after,reference_points)
+
+@pytest.mark.parametrize('zone_scheme',list(gp.ZONE_SCHEMES))
+def test_zones_reject_non_finite_coordinates(zone_scheme):
+    with pytest.raises(ValueError):
+        gp.ZONE_SCHEMES[zone_scheme](np.array([10.0,np.nan]),np.array([20.0,30.0]),10)
+
+@pytest.mark.parametrize('limits',[(None,None,None,None),(None,None,-10,30),(-50,20,None,None),(-50,20,-10,30),(10,-10,None,None)])
+def test_space_cutout_index_matches_mask(limits):
+    rng=np.random.default_rng(0)
+    catalog=pd.DataFrame({'longitude':rng.uniform(-180,180,2000),'latitude':rng.uniform(-90,90,2000)})
+    catalog.loc[:20,'longitude']=np.nan
+    catalog.loc[15:40,'latitude']=np.nan
+    index=gp.build_catalog_index(catalog,cell_size=3)
+    pd.testing.assert_frame_equal(gp.space_cutout(catalog,*limits,index=index),gp.space_cutout(catalog,*limits))
+
+def test_space_cutout_rejects_index_of_other_catalog():
+    rng=np.random.default_rng(0)
+    catalog=pd.DataFrame({'longitude':rng.uniform(-180,180,100),'latitude':rng.uniform(-90,90,100)})
+    index=gp.build_catalog_index(catalog)
+    with pytest.raises(ValueError):
+        gp.space_cutout(catalog.sample(frac=1,random_state=1),-10,10,-10,10,index=index)
+
+def random_catalog(rows:int,seed:int=0):
+    rng=np.random.default_rng(seed)
+    catalog=pd.DataFrame({'longitude':rng.uniform(-180,180,rows),'latitude':rng.uniform(-90,90,rows),'polarization':rng.uniform(0,5,rows),
+                          'angle':rng.uniform(0,180,rows),'polarization_error':rng.uniform(0.05,0.5,rows),'angle_error':rng.uniform(1,15,rows)})
+    return catalog[gp.CATALOG_COLUMNS]
+
+def zone_loop_statistics(polarization_data_with_zones,sigma_limit):
+    '''
+    Bucle zona a zona del 'statistics_per_zone' original: 'outliers_by_sigma' y 'weighted_average' sobre las filas consecutivas de cada zona.
+    '''
+    rows=[]
+    zones=list(zip(polarization_data_with_zones['zone_lon'],polarization_data_with_zones['zone_lat']))
+    start=0
+    for n in range(1,len(zones)+1):
+        if n==len(zones) or zones[n]!=zones[start]:
+            zone=polarization_data_with_zones.iloc[start:n]
+            polxzone,pol_errxzone,angxzone,ang_errxzone=gp.outliers_by_sigma(list(zone['polarization']),list(zone['polarization_error']),list(zone['angle']),list(zone['angle_error']),sigma_limit)
+            rows.append({'zone_lon':zones[start][0],'zone_lat':zones[start][1],'zone_pol':gp.weighted_average(polxzone,pol_errxzone),
+                         'zone_ang':gp.weighted_average(angxzone,ang_errxzone),'points_before':n-start,'points_after':len(polxzone)})
+            start=n
+    return pd.DataFrame(rows)
+
+@pytest.mark.parametrize('with_zone_id',[True,False])
+@pytest.mark.parametrize('sigma_limit',[1,2])
+def test_statistics_per_zone_matches_zone_loop(with_zone_id,sigma_limit):
+    catalog=random_catalog(400)
+    catalog.loc[len(catalog)]=[179.5,90.0,2.0,45.0,0.1,5.0] # Un solo punto en la última zona (la del polo norte)
+    zones=gp.add_coords_of_zone_center(catalog,30)
+    if not with_zone_id:
+        zones=zones.drop(columns='zone_id')
+    statistics=gp.statistics_per_zone(zones,sigma_limit)
+    reference=zone_loop_statistics(zones,sigma_limit)
+    assert statistics.iloc[-1][['points_before','points_after']].tolist()==[1,1]
+    pd.testing.assert_frame_equal(statistics[reference.columns],reference,check_dtype=False,rtol=1e-9)
+
+def test_statistics_per_zone_empty_input():
+    zones=gp.add_coords_of_zone_center(random_catalog(0),30)
+    statistics=gp.statistics_per_zone(zones,2)
+    assert len(statistics)==0
+    assert ['zone_lon','zone_lat','zone_pol','zone_ang','points_before','points_after']==list(statistics.columns[:6])
+
+@pytest.mark.parametrize('arguments',[{'offline':True},{'offline':True,'refresh':True,'cache_dir':'.catalog_cache'}])
+def test_read_catalog_rejects_invalid_offline_arguments(arguments):
+    with pytest.raises(ValueError):
+        gp.read_catalog(**arguments)
+
+@pytest.mark.parametrize('file_format',list(gp.TABLE_FORMATS))
+def test_table_round_trip(file_format,tmp_path):
+    if file_format in ('parquet','feather'):
+        pytest.importorskip('pyarrow')
+    table=random_catalog(50)
+    table['zone_id']=np.arange(50,dtype=np.int64)
+    file_name=gp.table_writer(table,str(tmp_path/'table'),file_format)
+    assert file_name.endswith(gp.TABLE_FORMATS[file_format])
+    read_table=gp.table_reader(file_name)
+    assert all(type(name) is str for name in read_table.columns)
+    pd.testing.assert_frame_equal(read_table,table)
+
+def test_draw_mollweide_clusters_uses_given_summary():
+    rng=np.random.default_rng(0)
+    catalog=pd.DataFrame({'longitude':rng.uniform(-180,180,300),'latitude':rng.uniform(-80,80,300),'angle':rng.uniform(0,180,300),'cluster':rng.integers(0,6,300)})
+    summary,order=gp.cluster_summary(catalog)
+    centers=gp.clusters_center(catalog,summary=summary)
+    outlines=[]
+    for arguments in ((catalog,centers,True),(catalog.take(order).reset_index(drop=True),centers,True,summary)):
+        ax=gp.draw_mollweide_3D_clusters(gp.new_figure(),*arguments)
+        outlines.append([path.vertices for path in ax.collections[-1].get_paths()])
+    assert len(outlines[0])==len(summary)
+    for first,second in zip(*outlines):
+        np.testing.assert_allclose(first,second)
+
+def test_zone_map_append_and_load_match_statistics_per_zone(tmp_path):
+    catalog=random_catalog(600)
+    batches=[random_catalog(40,seed=1),random_catalog(25,seed=2)]
+    batches[1].loc[len(batches[1])]=[179.5,90.0,2.0,45.0,0.1,5.0] # Zona nueva
+    directory=str(tmp_path/'zone_map')
+    zone_map=gp.create_zone_map(catalog,30,2,directory=directory)
+    gp.append_to_zone_map(zone_map,batches[0])
+    loaded=gp.load_zone_map(directory)
+    gp.append_to_zone_map(loaded,batches[1]) # Los puntos de las zonas afectadas se leen del directorio
+    in_memory=gp.create_zone_map(catalog,30,2)
+    for batch in batches:
+        gp.append_to_zone_map(in_memory,batch)
+    reference=gp.statistics_per_zone(gp.add_coords_of_zone_center(pd.concat([catalog]+batches,ignore_index=True),30),2)
+    for zone_map in (loaded,gp.load_zone_map(directory),in_memory):
+        pd.testing.assert_frame_equal(gp.zone_map_statistics(zone_map)[reference.columns],reference,check_dtype=False,rtol=1e-9)
+
+def test_render_tiles_redraws_only_tiles_of_changed_zone(tmp_path):
+    lon,lat=np.meshgrid(np.arange(-175,0,10),np.arange(-85,90,10)) # Zonas solo en la mitad oeste del cielo
+    rng=np.random.default_rng(0)
+    zones=pd.DataFrame({'zone_lon':lon.ravel(),'zone_lat':lat.ravel(),'zone_ang':rng.uniform(0,180,lon.size),'zone_pol':rng.uniform(0,4,lon.size)})
+    zooms=[1,2]
+    counts=gp.render_tiles(zones,10,False,zooms,str(tmp_path/'tiles'))
+    tiles=[(zoom,x,y) for zoom in zooms for x in range(2**(zoom+1)) for y in range(2**zoom)]
+    def overlaps(zone,tile):
+        lon_min,lon_max,lat_min,lat_max=gp.tile_bounds(*tile)
+        return lon_min-10<=zone['zone_lon']<=lon_max+10 and lat_min-10<=zone['zone_lat']<=lat_max+10
+    non_empty=[tile for tile in tiles if any(overlaps(zone,tile) for zone in zones.to_dict('records'))]
+    assert counts=={'rendered':len(non_empty)+1,'reused':len(tiles)-len(non_empty)-1} # Las teselas vacías comparten una sola tesela en blanco
+    zones.loc[100,'zone_pol']+=0.5
+    counts=gp.render_tiles(zones,10,False,zooms,str(tmp_path/'tiles'))
+    affected=[tile for tile in tiles if overlaps(zones.loc[100],tile)]
+    assert counts=={'rendered':len(affected),'reused':len(tiles)-len(affected)}
+    assert all((tmp_path/'tiles'/str(zoom)/str(x)/('%d.png'%y)).is_file() for zoom,x,y in tiles)
+
+def test_pipeline_computes_cluster_summary_once(monkeypatch):
+    calls=[]
+    cluster_summary=gp.cluster_summary
+    monkeypatch.setattr(gp,'cluster_summary',lambda catalog_with_clusters:calls.append(1) or cluster_summary(catalog_with_clusters))
+    pipeline=gp.polarization_pipeline(gp.pipeline_config(3,max_separation=10,min_num_points=5,write_tables=False,write_images=False,show=False))
+    catalog=random_catalog(2000,seed=4)
+    monkeypatch.setattr(pipeline,'catalog',lambda:catalog)
+    pipeline.plot()
+    pipeline.update(task=4)
+    pipeline.plot()
+    assert len(calls)==1
+    assert pipeline.computed==[]
+    pd.testing.assert_frame_equal(pipeline.summary(),cluster_summary(pipeline.clusters())[0])
@@ -0,0 +1,22 @@
+import json
+import galaxy_polarization_benchmark as benchmark
+
+BASELINE={'results':[{'stage':'statistics_per_zone','rows':1000,'seconds':1.0,'peak_mb':10.0},
+                     {'stage':'cluster_catalog_creator','rows':1000,'seconds':2.0,'peak_mb':None},
+                     {'stage':'read_catalog','rows':1000,'seconds':0.0,'peak_mb':5.0}]}
+CURRENT={'results':[{'stage':'statistics_per_zone','rows':1000,'seconds':1.5,'peak_mb':10.5}, # Más lento, memoria dentro de la tolerancia
+                    {'stage':'cluster_catalog_creator','rows':1000,'seconds':2.1,'peak_mb':50.0}, # Sin memoria de referencia
+                    {'stage':'read_catalog','rows':1000,'seconds':1.0,'peak_mb':5.0}, # Tiempo de referencia nulo
+                    {'stage':'statistics_per_zone','rows':5000,'seconds':9.0,'peak_mb':90.0}]} # Sin referencia
+
+def test_compare_results_reports_only_regressions_beyond_tolerance():
+    regressions=benchmark.compare_results(CURRENT,BASELINE,tolerance=0.2)
+    assert regressions==[{'stage':'statistics_per_zone','rows':1000,'metric':'seconds','baseline':1.0,'current':1.5,'ratio':1.5}]
+    assert benchmark.compare_results(CURRENT,BASELINE,tolerance=0.6)==[]
+
+def test_check_baseline_exit_code(tmp_path,capsys):
+    baseline_file=tmp_path/'baseline.json'
+    baseline_file.write_text(json.dumps(BASELINE))
+    assert benchmark.check_baseline(CURRENT,str(baseline_file),0.2)==1
+    assert 'REGRESIÓN statistics_per_zone (1000 puntos) seconds' in capsys.readouterr().out
+    assert benchmark.check_baseline(BASELINE,str(baseline_file),0.2)==0